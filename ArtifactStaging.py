@@ -0,0 +1,66 @@
+import os
+import shutil
+import logging
+
+
+def _same_path(path_a, path_b):
+    return os.path.normcase(os.path.abspath(path_a)) == os.path.normcase(os.path.abspath(path_b))
+
+
+def _hard_link(src_path, dst_path):
+
+    if hasattr(os, 'link'):
+        os.link(src_path, dst_path)
+        return
+
+    # Python 2.7 on Windows has no os.link; NTFS supports hard links through the Win32 API.
+    import ctypes
+
+    create_hard_link = ctypes.windll.kernel32.CreateHardLinkW
+    if not create_hard_link(unicode(dst_path), unicode(src_path), None):
+        raise OSError("CreateHardLinkW failed ({} -> {})".format(src_path, dst_path))
+
+
+def stage_file(src_path, dst_path, logger=None):
+    """Make src_path available at dst_path without copying the bytes when possible.
+
+    Tries a hard link, then a symbolic link, and only falls back to shutil.copy2 if
+    neither works (e.g. the paths are on different volumes). dst_path may be a directory.
+
+    Returns the method used: 'same', 'hardlink', 'symlink' or 'copy'.
+    """
+
+    if logger is None:
+        logger = logging.getLogger('ArtifactStaging')
+
+    if os.path.isdir(dst_path):
+        dst_path = os.path.join(dst_path, os.path.basename(src_path))
+
+    if _same_path(src_path, dst_path):
+        return 'same'
+
+    if not os.path.isfile(src_path):
+        raise IOError("File not found: {}".format(src_path))
+
+    if os.path.lexists(dst_path):
+        os.remove(dst_path)
+
+    try:
+        _hard_link(src_path, dst_path)
+        logger.debug("Hard linked {} to {}".format(src_path, dst_path))
+        return 'hardlink'
+    except (OSError, AttributeError, ImportError):
+        pass
+
+    if hasattr(os, 'symlink'):
+        try:
+            os.symlink(os.path.abspath(src_path), dst_path)
+            logger.debug("Symlinked {} to {}".format(src_path, dst_path))
+            return 'symlink'
+        except OSError:
+            pass
+
+    shutil.copy2(src_path, dst_path)
+    logger.info("Copied {} to {} (could not link)".format(src_path, dst_path))
+
+    return 'copy'
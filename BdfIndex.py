@@ -0,0 +1,464 @@
+import os
+import sys
+import mmap
+import json
+import argparse
+import logging
+from array import array
+from bisect import bisect_left
+
+
+SIDECAR_VERSION = 1
+SIDECAR_EXTENSION = '.idx'
+
+# Element cards we index, with the maximum number of grid ids each can carry.
+ELEMENT_CARDS = {
+    'CTETRA': 10,
+    'CPENTA': 15,
+    'CHEXA': 20,
+    'CTRIA3': 3,
+    'CTRIA6': 6,
+    'CQUAD4': 4,
+    'CQUAD8': 8
+}
+
+ELEMENT_TYPE_CODES = {
+    'CTETRA': 1,
+    'CPENTA': 2,
+    'CHEXA': 3,
+    'CTRIA3': 4,
+    'CTRIA6': 5,
+    'CQUAD4': 6,
+    'CQUAD8': 7
+}
+
+# Corner grids come first on every element card; midside grids follow.
+CORNER_COUNTS = {
+    'CTETRA': 4,
+    'CPENTA': 6,
+    'CHEXA': 8,
+    'CTRIA3': 3,
+    'CTRIA6': 3,
+    'CQUAD4': 4,
+    'CQUAD8': 4
+}
+
+ELEMENT_TYPE_NAMES = dict((code, name) for name, code in ELEMENT_TYPE_CODES.items())
+
+PROPERTY_CARDS = ('PSOLID', 'PSHELL')
+
+INDEXED_CARDS = frozenset(['GRID', 'MAT1'] + list(ELEMENT_CARDS.keys()) + list(PROPERTY_CARDS))
+
+# name, typecode
+ARRAY_LAYOUT = [
+    ('node_ids', 'i'),
+    ('node_xyz', 'd'),
+    ('elem_ids', 'i'),
+    ('elem_pids', 'i'),
+    ('elem_types', 'b'),
+    ('conn_offsets', 'i'),
+    ('conn', 'i'),
+    ('elems_by_pid', 'i')
+]
+
+
+def parse_nastran_float(field):
+    """Convert a Nastran real field to float, including the exponent-without-E
+    forms written by Patran, e.g. '1.5-3' or '-.25+2'."""
+
+    field = field.strip().upper().replace('D', 'E')
+
+    if not field:
+        return 0.0
+
+    try:
+        return float(field)
+    except ValueError:
+        pass
+
+    for position in range(len(field) - 1, 0, -1):
+        if field[position] in '+-' and field[position - 1] != 'E':
+            return float(field[:position] + 'E' + field[position:])
+
+    raise ValueError("Not a Nastran real: '{}'".format(field))
+
+
+def parse_nastran_int(field):
+    field = field.strip()
+    if not field:
+        return 0
+    return int(field)
+
+
+def split_card_fields(lines):
+    """Return the data fields (everything after the card name) of a card given its
+    raw lines. Handles small field, large field (NAME*) and free field (comma) formats."""
+
+    first = lines[0]
+    fields = []
+
+    if ',' in first:
+        for line in lines:
+            fields.extend(token.strip() for token in line.split(',')[1:9])
+        return fields
+
+    large_field = first[:8].rstrip().endswith('*')
+    width = 16 if large_field else 8
+
+    for line in lines:
+        line = line.expandtabs(8)
+        for start in range(8, 72, width):
+            fields.append(line[start:start + width].strip())
+
+    return fields
+
+
+class BdfIndex(object):
+    """Compact, array-backed index of the nodes, elements, properties and materials
+    in a Nastran bulk data file.
+
+    Arrays:
+        node_ids      sorted grid ids
+        node_xyz      x, y, z per grid (same order as node_ids)
+        elem_ids      sorted element ids
+        elem_pids     property id per element
+        elem_types    ELEMENT_TYPE_CODES value per element
+        conn_offsets  start of each element's grids in conn (len = elements + 1)
+        conn          grid ids of all elements, back to back
+        elems_by_pid  element positions ordered by property id; see property_ranges
+    """
+
+    def __init__(self, bdf_path):
+
+        self.logger = logging.getLogger('BdfIndex')
+
+        self.bdf_path = bdf_path
+        self.sidecar_path = bdf_path + SIDECAR_EXTENSION
+
+        for name, typecode in ARRAY_LAYOUT:
+            setattr(self, name, array(typecode))
+
+        self.conn_offsets.append(0)
+
+        self.properties = {}        # pid -> {'Type': 'PSOLID', 'MID': mid}
+        self.materials = {}         # mid -> {'E': e, 'NU': nu, 'RHO': rho}
+        self.property_ranges = {}   # pid -> (start, stop) into elems_by_pid
+        self.non_basic_grids = 0
+        self.include_count = 0
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_elements(self):
+        return len(self.elem_ids)
+
+    @classmethod
+    def load(cls, bdf_path, rebuild=False, save=True):
+        """Return the index for bdf_path, reading the sidecar if it is current and
+        rescanning (and rewriting the sidecar) otherwise."""
+
+        index = cls(bdf_path)
+
+        if not rebuild and index.read_sidecar():
+            return index
+
+        index.scan()
+
+        if save:
+            try:
+                index.write_sidecar()
+            except (IOError, OSError) as e:
+                index.logger.warning("Could not write {}: {}".format(index.sidecar_path, e))
+
+        return index
+
+    def scan(self):
+
+        self.logger.info("Scanning {}".format(self.bdf_path))
+
+        with open(self.bdf_path, 'rb') as bdf_in:
+            if os.fstat(bdf_in.fileno()).st_size == 0:
+                self.finalize()
+                return
+
+            bdf_map = mmap.mmap(bdf_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                card_lines = None
+                readline = bdf_map.readline
+
+                while True:
+                    line = readline()
+                    if not line:
+                        break
+
+                    line = line.rstrip('\r\n')
+
+                    if not line or line[0] == '$':
+                        continue
+
+                    if line[0] in '+*, ':
+                        if card_lines is not None and line.strip():
+                            card_lines.append(line)
+                        continue
+
+                    if card_lines is not None:
+                        self.add_card(card_lines)
+                        card_lines = None
+
+                    name = line.split(',', 1)[0][:8].rstrip().rstrip('*').upper()
+
+                    if name in INDEXED_CARDS:
+                        card_lines = [line]
+                    elif name == 'INCLUDE':
+                        self.include_count += 1
+                    elif name == 'ENDDATA':
+                        break
+
+                if card_lines is not None:
+                    self.add_card(card_lines)
+
+            finally:
+                bdf_map.close()
+
+        if self.include_count:
+            self.logger.warning("{} INCLUDE statements were not followed".format(self.include_count))
+
+        if self.non_basic_grids:
+            self.logger.warning("{} GRIDs are not in the basic coordinate system; "
+                                "their coordinates are stored as written".format(self.non_basic_grids))
+
+        self.finalize()
+
+        self.logger.info("Indexed {} nodes, {} elements, {} properties".format(
+            self.num_nodes, self.num_elements, len(self.properties)))
+
+    def add_card(self, card_lines):
+
+        name = card_lines[0].split(',', 1)[0][:8].rstrip().rstrip('*').upper()
+        fields = split_card_fields(card_lines)
+
+        if name == 'GRID':
+            if parse_nastran_int(fields[1]) != 0:
+                self.non_basic_grids += 1
+            self.node_ids.append(parse_nastran_int(fields[0]))
+            self.node_xyz.append(parse_nastran_float(fields[2]))
+            self.node_xyz.append(parse_nastran_float(fields[3]))
+            self.node_xyz.append(parse_nastran_float(fields[4]))
+
+        elif name in ELEMENT_CARDS:
+            self.elem_ids.append(parse_nastran_int(fields[0]))
+            self.elem_pids.append(parse_nastran_int(fields[1]))
+            self.elem_types.append(ELEMENT_TYPE_CODES[name])
+
+            grids = [parse_nastran_int(g) for g in fields[2:2 + ELEMENT_CARDS[name]]]
+            while grids and grids[-1] == 0:
+                grids.pop()
+
+            self.conn.extend(grids)
+            self.conn_offsets.append(len(self.conn))
+
+        elif name in PROPERTY_CARDS:
+            self.properties[parse_nastran_int(fields[0])] = {
+                'Type': name,
+                'MID': parse_nastran_int(fields[1])
+            }
+
+        elif name == 'MAT1':
+            self.materials[parse_nastran_int(fields[0])] = {
+                'E': parse_nastran_float(fields[1]),
+                'NU': parse_nastran_float(fields[3]),
+                'RHO': parse_nastran_float(fields[4])
+            }
+
+    def finalize(self):
+        """Sort nodes and elements by id and build the property -> element ranges."""
+
+        if any(self.node_ids[i] > self.node_ids[i + 1] for i in xrange(len(self.node_ids) - 1)):
+            order = sorted(xrange(len(self.node_ids)), key=self.node_ids.__getitem__)
+            self.node_ids = array('i', (self.node_ids[i] for i in order))
+            xyz = self.node_xyz
+            self.node_xyz = array('d')
+            for i in order:
+                self.node_xyz.extend(xyz[3 * i:3 * i + 3])
+
+        if any(self.elem_ids[i] > self.elem_ids[i + 1] for i in xrange(len(self.elem_ids) - 1)):
+            order = sorted(xrange(len(self.elem_ids)), key=self.elem_ids.__getitem__)
+            self.elem_ids = array('i', (self.elem_ids[i] for i in order))
+            self.elem_pids = array('i', (self.elem_pids[i] for i in order))
+            self.elem_types = array('b', (self.elem_types[i] for i in order))
+            offsets, conn = self.conn_offsets, self.conn
+            self.conn_offsets = array('i', [0])
+            self.conn = array('i')
+            for i in order:
+                self.conn.extend(conn[offsets[i]:offsets[i + 1]])
+                self.conn_offsets.append(len(self.conn))
+
+        self.elems_by_pid = array('i', sorted(xrange(len(self.elem_ids)), key=self.elem_pids.__getitem__))
+        self.build_property_ranges()
+
+    def build_property_ranges(self):
+
+        self.property_ranges = {}
+        start = 0
+        count = len(self.elems_by_pid)
+
+        while start < count:
+            pid = self.elem_pids[self.elems_by_pid[start]]
+            stop = start + 1
+            while stop < count and self.elem_pids[self.elems_by_pid[stop]] == pid:
+                stop += 1
+            self.property_ranges[pid] = (start, stop)
+            start = stop
+
+    def source_signature(self):
+        stat = os.stat(self.bdf_path)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    def write_sidecar(self):
+
+        header = {
+            'Version': SIDECAR_VERSION,
+            'Source': self.source_signature(),
+            'Arrays': [[name, typecode, len(getattr(self, name))] for name, typecode in ARRAY_LAYOUT],
+            'Properties': self.properties,
+            'Materials': self.materials,
+            'NonBasicGrids': self.non_basic_grids,
+            'IncludeCount': self.include_count
+        }
+
+        temp_path = self.sidecar_path + '.tmp'
+
+        with open(temp_path, 'wb') as f_out:
+            f_out.write(json.dumps(header) + '\n')
+            for name, typecode in ARRAY_LAYOUT:
+                getattr(self, name).tofile(f_out)
+
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+        os.rename(temp_path, self.sidecar_path)
+
+        self.logger.info("Wrote {}".format(self.sidecar_path))
+
+    def read_sidecar(self):
+        """Populate the index from the sidecar. Returns False if it is missing or stale."""
+
+        if not os.path.exists(self.sidecar_path) or not os.path.exists(self.bdf_path):
+            return False
+
+        try:
+            with open(self.sidecar_path, 'rb') as f_in:
+                header = json.loads(f_in.readline())
+
+                if header.get('Version') != SIDECAR_VERSION or header.get('Source') != self.source_signature():
+                    self.logger.info("{} is stale".format(self.sidecar_path))
+                    return False
+
+                for name, typecode, length in header['Arrays']:
+                    values = array(str(typecode))
+                    values.fromfile(f_in, length)
+                    setattr(self, name, values)
+
+        except (IOError, OSError, ValueError, EOFError, KeyError) as e:
+            self.logger.warning("Could not read {}: {}".format(self.sidecar_path, e))
+            return False
+
+        self.properties = dict((int(pid), prop) for pid, prop in header['Properties'].items())
+        self.materials = dict((int(mid), mat) for mid, mat in header['Materials'].items())
+        self.non_basic_grids = header.get('NonBasicGrids', 0)
+        self.include_count = header.get('IncludeCount', 0)
+        self.build_property_ranges()
+
+        return True
+
+    def node_position(self, grid_id):
+        position = bisect_left(self.node_ids, grid_id)
+        if position == len(self.node_ids) or self.node_ids[position] != grid_id:
+            raise KeyError("GRID {} not in {}".format(grid_id, self.bdf_path))
+        return position
+
+    def node_coordinates(self, grid_id):
+        position = 3 * self.node_position(grid_id)
+        return tuple(self.node_xyz[position:position + 3])
+
+    def element_position(self, element_id):
+        position = bisect_left(self.elem_ids, element_id)
+        if position == len(self.elem_ids) or self.elem_ids[position] != element_id:
+            raise KeyError("Element {} not in {}".format(element_id, self.bdf_path))
+        return position
+
+    def property_for_element(self, element_id):
+        return self.elem_pids[self.element_position(element_id)]
+
+    def element_grids(self, element_id):
+        position = self.element_position(element_id)
+        return self.conn[self.conn_offsets[position]:self.conn_offsets[position + 1]]
+
+    def element_type(self, element_id):
+        return ELEMENT_TYPE_NAMES[self.elem_types[self.element_position(element_id)]]
+
+    def element_centroid(self, element_id):
+        """Average of the element's corner grid coordinates."""
+
+        position = self.element_position(element_id)
+        corners = CORNER_COUNTS[ELEMENT_TYPE_NAMES[self.elem_types[position]]]
+        start = self.conn_offsets[position]
+        grids = self.conn[start:min(start + corners, self.conn_offsets[position + 1])]
+
+        centroid = [0.0, 0.0, 0.0]
+        for grid_id in grids:
+            node = 3 * self.node_position(grid_id)
+            for axis in range(3):
+                centroid[axis] += self.node_xyz[node + axis]
+
+        return tuple(c / len(grids) for c in centroid)
+
+    def element_positions_for_property(self, pid):
+        start, stop = self.property_ranges.get(pid, (0, 0))
+        return self.elems_by_pid[start:stop]
+
+    def elements_for_property(self, pid):
+        return [self.elem_ids[position] for position in self.element_positions_for_property(pid)]
+
+    def element_count_by_property(self):
+        return dict((pid, stop - start) for pid, (start, stop) in self.property_ranges.items())
+
+    def property_label(self, pid):
+        """Name Patran gives the part for a property when importing the deck, e.g. 'PSOLID.3'."""
+        prop_type = self.properties.get(pid, {}).get('Type', 'PSOLID')
+        return "{}.{}".format(prop_type, pid)
+
+    def summary(self):
+        return {
+            'Nodes': self.num_nodes,
+            'Elements': self.num_elements,
+            'Properties': len(self.properties),
+            'Materials': len(self.materials),
+            'ElementsByProperty': self.element_count_by_property()
+        }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Index the nodes, elements and properties of a Nastran "
+                                                 "bulk data file and write a sidecar next to it")
+    parser.add_argument('bdf', help=".bdf/.nas File Name")
+    parser.add_argument('-rebuild', action='store_true', help="Ignore an existing sidecar")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if not os.path.exists(args.bdf):
+        print("File not found: {}".format(args.bdf))
+        sys.exit(1)
+
+    index = BdfIndex.load(args.bdf, rebuild=args.rebuild)
+
+    print(json.dumps(index.summary(), indent=4, sort_keys=True))
+
+
+if __name__ == '__main__':
+
+    main()
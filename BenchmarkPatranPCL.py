@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from SyntheticAssembly import SyntheticAssembly
+
+
+DEFAULT_PART_COUNTS = [100, 1000, 10000, 50000]
+
+BASELINE_FILE_NAME = 'BenchmarkPatranPCL_baseline.json'
+
+# Each case runs this many times, each in a fresh process; its times and peak memory are the medians
+DEFAULT_REPEATS = 5
+
+# A stage is a regression if it is this much slower (or bigger) than its baseline, and by more than
+# MIN_REGRESSION_SECONDS (MIN_REGRESSION_MB): small stages jitter by more than the tolerance
+DEFAULT_REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_MB = 5.0
+
+STAGES = ['Construct', 'Check', 'CreateInputFile']
+
+
+def peak_memory_mb():
+    """Peak resident set size of this process in MB, or None if it cannot be measured."""
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024. * 1024.) if sys.platform == 'darwin' else peak / 1024.
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().peak_wset / (1024. * 1024.)
+    except (ImportError, AttributeError):
+        return None
+
+
+def benchmark_case(case):
+    """Time PatranPCL on one generated assembly. Runs in a fresh worker process (see
+    run_benchmarks) so the peak memory is this case's alone."""
+
+    from CreatePatranInputFile import PatranPCL, load_material_library
+
+    parameters, result_dir = case
+    patran_nastran_dir = os.path.join(result_dir, 'Analysis', 'Patran_Nastran')
+    material_library = load_material_library(os.path.join(result_dir, 'material_library.json'))
+
+    # PatranPCL logs every section at INFO; that is part of what is measured
+    seconds = {}
+
+    start = time.time()
+    ppcl = PatranPCL(output_dir=patran_nastran_dir,
+                     cad_assembly_path=os.path.join(result_dir, 'CADAssembly.xml'),
+                     cad_assembly_metrics_path=os.path.join(result_dir, 'CADAssembly_metrics.xml'),
+                     computed_values_path=os.path.join(result_dir, 'ComputedValues.xml'),
+                     material_library=material_library)
+    seconds['Construct'] = time.time() - start
+
+    ppcl.pcl_globals['Geometry_File_Dir'] = os.path.join(result_dir, 'Parasolid')
+
+    start = time.time()
+    ppcl.check()
+    seconds['Check'] = time.time() - start
+
+    start = time.time()
+    input_file_path = ppcl.create_pcl_input_file(copy_xml_text=False)
+    seconds['CreateInputFile'] = time.time() - start
+
+    ppcl.close()
+
+    return {
+        'Parameters': parameters,
+        'Seconds': seconds,
+        'TotalSeconds': sum(seconds.values()),
+        'InputFileMB': os.path.getsize(input_file_path) / (1024. * 1024.),
+        'PeakMemoryMB': peak_memory_mb()
+    }
+
+
+def median(values):
+
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.
+
+
+def combine_repeats(samples):
+    """One result from the results of several runs of a case: the median of each stage, of the
+    total and of the peak memory."""
+
+    memory = [sample['PeakMemoryMB'] for sample in samples if sample['PeakMemoryMB'] is not None]
+
+    return {
+        'Parameters': samples[0]['Parameters'],
+        'Repeats': len(samples),
+        'Seconds': dict((stage, median([sample['Seconds'][stage] for sample in samples])) for stage in STAGES),
+        'TotalSeconds': median([sample['TotalSeconds'] for sample in samples]),
+        'InputFileMB': samples[0]['InputFileMB'],
+        'PeakMemoryMB': median(memory) if memory else None
+    }
+
+
+def run_benchmarks(cases, work_dir, repeats=DEFAULT_REPEATS):
+
+    jobs = []
+
+    # Generate everything first, so the generator's memory and time are not measured
+    for parameters in cases:
+        result_dir = os.path.join(work_dir, 'Parts_{}'.format(parameters['parts']))
+        SyntheticAssembly(**parameters).write(result_dir)
+        jobs.append((parameters, result_dir))
+
+    # maxtasksperchild=1: a new process per run, so peak memory does not carry over
+    pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+    try:
+        samples = pool.map(benchmark_case, [job for job in jobs for _ in range(repeats)], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [combine_repeats(samples[i:i + repeats]) for i in range(0, len(samples), repeats)]
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_REGRESSION_TOLERANCE):
+    """Return a list of regression messages for results that are slower or bigger than
+    the baseline case with the same parameters, by more than tolerance and the absolute floors."""
+
+    regressions = []
+    baseline_by_parameters = dict((json.dumps(b['Parameters'], sort_keys=True), b) for b in baseline['Results'])
+
+    for result in results:
+        base = baseline_by_parameters.get(json.dumps(result['Parameters'], sort_keys=True))
+        if base is None:
+            continue
+
+        parts = result['Parameters']['parts']
+
+        for stage in STAGES:
+            seconds = result['Seconds'][stage]
+            base_seconds = base['Seconds'].get(stage)
+
+            if base_seconds is None:
+                continue
+
+            if seconds - base_seconds > max(base_seconds * tolerance, MIN_REGRESSION_SECONDS):
+                regressions.append("{} parts, {}: {:.3f} s, baseline {:.3f} s".format(
+                    parts, stage, seconds, base_seconds))
+
+        memory = result['PeakMemoryMB']
+        base_memory = base.get('PeakMemoryMB')
+
+        if memory is not None and base_memory is not None and \
+                memory - base_memory > max(base_memory * tolerance, MIN_REGRESSION_MB):
+            regressions.append("{} parts, peak memory: {:.1f} MB, baseline {:.1f} MB".format(
+                parts, memory, base_memory))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Time and memory-profile PatranPCL on synthetic assemblies")
+    parser.add_argument('-parts', type=int, nargs='+', default=DEFAULT_PART_COUNTS)
+    parser.add_argument('-layered_fraction', type=float, default=0.1, help="Fraction of parts with a layup")
+    parser.add_argument('-layers', type=int, default=4)
+    parser.add_argument('-load_sets', type=int, default=2)
+    parser.add_argument('-loads', type=int, default=10, help="Loads per load set")
+    parser.add_argument('-constraints', type=int, default=10)
+    parser.add_argument('-materials', type=int, default=20)
+    parser.add_argument('-baseline', default=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                          BASELINE_FILE_NAME))
+    parser.add_argument('-save_baseline', action='store_true', help="Write the results as the new baseline")
+    parser.add_argument('-tolerance', type=float, default=DEFAULT_REGRESSION_TOLERANCE)
+    parser.add_argument('-repeats', type=int, default=DEFAULT_REPEATS,
+                        help="Runs of each case; the medians are reported and compared")
+    parser.add_argument('-workdir', default=None, help="Where the synthetic inputs go (default: a temp dir)")
+    parser.add_argument('-keep', action='store_true', help="Keep the synthetic inputs")
+    parser.add_argument('-json', default=None, help="Also write the results here")
+    args = parser.parse_args()
+
+    cases = [{
+        'parts': parts,
+        'layered_parts': int(parts * args.layered_fraction),
+        'layers': args.layers,
+        'load_sets': args.load_sets,
+        'loads': args.loads,
+        'constraints': args.constraints,
+        'materials': args.materials
+    } for parts in args.parts]
+
+    work_dir = args.workdir or tempfile.mkdtemp(prefix='BenchmarkPatranPCL_')
+
+    try:
+        results = run_benchmarks(cases, work_dir, args.repeats)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("{:>8} {:>10} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+        "Parts", "Construct", "Check", "CreateInput", "Total", "Input MB", "Peak MB"))
+
+    for result in results:
+        print("{:>8} {:>10.3f} {:>10.3f} {:>12.3f} {:>10.3f} {:>10.1f} {:>10}".format(
+            result['Parameters']['parts'], result['Seconds']['Construct'], result['Seconds']['Check'],
+            result['Seconds']['CreateInputFile'], result['TotalSeconds'], result['InputFileMB'],
+            '{:.1f}'.format(result['PeakMemoryMB']) if result['PeakMemoryMB'] is not None else '-'))
+
+    report = {
+        'Date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'Platform': sys.platform,
+        'Python': sys.version.split()[0],
+        'Results': results
+    }
+
+    if args.json:
+        with open(args.json, 'w') as f_out:
+            json.dump(report, f_out, indent=4, sort_keys=True, separators=(',', ': '))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f_out:
+            json.dump(report, f_out, indent=4, sort_keys=True, separators=(',', ': '))
+        print("Baseline written to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}; run with -save_baseline to create one".format(args.baseline))
+        return
+
+    with open(args.baseline, 'r') as f_in:
+        baseline = json.load(f_in)
+
+    if baseline.get('Platform') != sys.platform:
+        print("Note: the baseline was recorded on {}; timings may not be comparable".format(baseline.get('Platform')))
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+
+    for regression in regressions:
+        print("REGRESSION: {}".format(regression))
+
+    if regressions:
+        sys.exit(1)
+
+    print("No regressions against {} ({})".format(args.baseline, baseline.get('Date')))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -8,10 +8,28 @@ import shutil
 import logging
 import datetime
 import inspect
+import time
+import json
+import contextlib
 import cad_library
+from ArtifactStaging import stage_file
+from QueueLogging import add_queued_file_handler
+from ToolPaths import tool_path, ToolPathError, ABAQUS_COMMAND
+from JobMetrics import JobMetrics, METRICS_TEXTFILE_ENV, add_to_textfile
+from RuntimePredictor import RuntimePredictor, assembly_features, append_history, history_path
+from SolverResources import register_job, unregister_job, plan_resources, nastran_keywords, abaqus_options, \
+    calculix_environment, estimate_memory_mb, memory_mb_per_1000_elements, reserve_memory, release_memory, \
+    solver_rlimits, children_peak_memory_mb, wait_with_peak_memory
+from MeshConvergence import DEFAULT_TOLERANCE, DEFAULT_MAX_LEVELS
+from SolverMonitor import SolverMonitor, SolverRulesError, DEFAULT_RULES, load_rules, popen_kwargs, kill_process_tree
 
 print_cmds = True
 
+PATRAN_MODEL_COMMAND = "patran -b -graphics -sfp CreatePatranModel.ses -stdout CreatePatranModel_Session.log"
+
+# Wall time of each stage of the job, written to <result dir>/log when the job ends
+STAGE_TIMES_FILE_NAME = 'CADJobDriver_stages.json'
+
 
 def get_function_name():
     function_name = inspect.currentframe().f_back
@@ -25,7 +43,13 @@ def line_number_of_problem():
 
 class CADJobDriver():
 
-    def __init__(self, assembler, mesher, analyzer, mode, run_postprocessing=True):
+    def __init__(self, assembler, mesher, analyzer, mode, run_postprocessing=True, mesh_quality_check=True,
+                 mesh_convergence=False, convergence_tolerance=DEFAULT_TOLERANCE,
+                 convergence_levels=DEFAULT_MAX_LEVELS, mesh_parallel=1, nastran_restart=False, restart_from=None,
+                 mesh_cache_dir=None, mesh_cache_gb=None, solver_cores=None, solver_memory_mb=None,
+                 metrics_textfile=None, runtime_history=None, solver_rules=None):
+
+        self.start_time = time.time()
 
         self.logger = None
         self.get_logger()
@@ -57,8 +81,182 @@ class CADJobDriver():
         self.mode = mode
 
         self.run_pp = run_postprocessing
+        self.mesh_quality_check = mesh_quality_check
+
+        self.mesh_convergence = mesh_convergence
+        self.convergence_tolerance = convergence_tolerance
+        self.convergence_levels = convergence_levels
+        self.mesh_parallel = max(1, mesh_parallel)
+
+        # Keep the Nastran database and restart from it when only loads or constraints change
+        self.nastran_restart = nastran_restart
+        self.restart_from = os.path.abspath(restart_from) if restart_from else None
+
+        # Patran decks shared between jobs with the same geometry and mesh parameters
+        self.mesh_cache_dir = mesh_cache_dir
+        self.mesh_cache_gb = mesh_cache_gb
+
+        # Cores and memory of this node the solvers may use (default: all); shared by the jobs running on it
+        self.solver_cores = solver_cores
+        self.solver_memory_mb = solver_memory_mb
+        self.solver_plans = {}
+
+        self.result_dir = os.path.abspath(os.getcwd())
+        self.stage_seconds = {}
+
+        # Job and stage metrics, added to a Prometheus textfile when the job ends
+        self.metrics = JobMetrics()
+        self.metrics_textfile = metrics_textfile or os.environ.get(METRICS_TEXTFILE_ENV)
+        self.failed_stage = None
+        self.last_stage = None
+
+        # Model features and stage times of each job are kept, to predict how long the next ones take
+        self.runtime_history = runtime_history or history_path()
+        self.features = {}
+        self.predicted_seconds = None
+        self.history_records = []
+        self.predict_runtime()
+
+        # Largest memory estimate of the job's solves, recorded with their peak to calibrate the estimates.
+        # The solver peak leaves out Patran, which would swamp a small model's solve.
+        self.estimated_memory_mb = None
+        self.solver_peak_memory_mb = None
+
+        # Solver logs are watched for messages that mean the run is lost, to stop it early
+        try:
+            self.solver_rules = load_rules(solver_rules)
+        except SolverRulesError as e:
+            self.logger.warning("{}; using the default rules".format(e))
+            self.solver_rules = DEFAULT_RULES
+
+        self.job_record = None
+        try:
+            self.job_record = register_job(self.result_dir)
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not register the job; solver resources assume it runs alone: {}".format(e))
+
+        # run_job ends with sys.exit, also on success
+        exit_code = 0
+        try:
+            self.run_job()
+        except SystemExit as e:
+            exit_code = e.code
+            raise
+        except BaseException:
+            exit_code = 'exception'
+            raise
+        finally:
+            self.write_stage_times()
+            self.write_metrics(exit_code)
+            self.write_runtime_history(exit_code)
+            if self.job_record is not None:
+                unregister_job(self.job_record)
+
+    @contextlib.contextmanager
+    def timed_stage(self, name):
+
+        start = time.time()
+
+        try:
+            yield
+        except SystemExit as e:
+            if e.code not in (0, None) and self.failed_stage is None:
+                self.failed_stage = name
+            raise
+        except Exception:
+            if self.failed_stage is None:
+                self.failed_stage = name
+            raise
+        finally:
+            seconds = time.time() - start
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.last_stage = name
+            self.metrics.observe('cad_stage_duration_seconds', seconds, stage=name)
+            self.logger.info("Stage {}: {:.3f} s".format(name, seconds))
+
+    def write_stage_times(self):
+
+        log_dir = os.path.join(self.result_dir, 'log')
 
-        self.run_job()
+        try:
+            if not os.path.isdir(log_dir):
+                os.makedirs(log_dir)
+
+            with open(os.path.join(log_dir, STAGE_TIMES_FILE_NAME), 'w') as f_out:
+                json.dump(self.stage_seconds, f_out, indent=4, sort_keys=True)
+
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write stage times: {}".format(e))
+
+    def write_metrics(self, exit_code):
+        """Count the job in the metrics textfile. A failure is put down to the stage it happened in,
+        or else to the last stage that ran (most failures are found just after a tool returns)."""
+
+        if not self.metrics_textfile:
+            return
+
+        succeeded = exit_code in (0, None)
+        self.metrics.inc('cad_jobs_total', analyzer=self.analyzer, result='success' if succeeded else 'failure')
+        self.metrics.observe('cad_job_duration_seconds', time.time() - self.start_time, analyzer=self.analyzer)
+        self.metrics.set('cad_last_job_finish_timestamp_seconds', time.time())
+
+        if not succeeded:
+            self.metrics.inc('cad_stage_failures_total', stage=self.failed_stage or self.last_stage or 'Startup')
+
+        try:
+            add_to_textfile(self.metrics, self.metrics_textfile)
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write metrics to {}: {}".format(self.metrics_textfile, e))
+
+    def predict_runtime(self):
+
+        try:
+            self.features = assembly_features(self.result_dir)
+            predictor = RuntimePredictor.load(self.runtime_history, self.analyzer)
+            self.history_records = predictor.records
+            self.predicted_seconds = predictor.predict(self.features)
+        except Exception as e:
+            self.logger.warning("Could not predict the runtime: {}".format(e))
+            return
+
+        if self.predicted_seconds is None:
+            self.logger.info("Too few {} jobs in {} to predict the runtime".format(self.analyzer, self.runtime_history))
+        else:
+            self.logger.info("Predicted runtime: {:.1f} s from {} of {} jobs".format(
+                self.predicted_seconds, self.features, len(predictor.records)))
+
+    def write_runtime_history(self, exit_code):
+        """Append the job's features, stage times, runtime and predicted runtime to the history."""
+
+        seconds = time.time() - self.start_time
+        peak_memory_mb = children_peak_memory_mb()
+
+        if self.predicted_seconds is not None:
+            self.logger.info("Runtime {:.1f} s, predicted {:.1f} s ({:+.0f}%)".format(
+                seconds, self.predicted_seconds, 100.0 * (self.predicted_seconds - seconds) / seconds))
+
+        if peak_memory_mb is not None and self.estimated_memory_mb is not None:
+            self.logger.info("Peak memory {} MB (solver {} MB), estimated {} MB".format(
+                peak_memory_mb, self.solver_peak_memory_mb, self.estimated_memory_mb))
+
+        record = {
+            'Directory': self.result_dir,
+            'Analyzer': self.analyzer,
+            'Finished': time.time(),
+            'ExitCode': exit_code,
+            'Seconds': seconds,
+            'PredictedSeconds': self.predicted_seconds,
+            'PeakMemoryMB': peak_memory_mb,
+            'SolverPeakMemoryMB': self.solver_peak_memory_mb,
+            'EstimatedMemoryMB': self.estimated_memory_mb,
+            'Features': self.features,
+            'Stages': self.stage_seconds
+        }
+
+        try:
+            append_history(record, self.runtime_history)
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write the runtime history {}: {}".format(self.runtime_history, e))
 
     def run_job(self):
 
@@ -69,7 +267,8 @@ class CADJobDriver():
             result = 42
 
             try:
-                result = self.run_creo_assembler()
+                with self.timed_stage('Assembler'):
+                    result = self.run_creo_assembler()
                 self.logger.info("CADCreoCreateAssembly Result: {}".format(result))
             except Exception:
                 self.logger.error("CADCreoCreateAssembly Exception. See {}".format("log/cad-assembler.log"))
@@ -97,8 +296,13 @@ class CADJobDriver():
                 cad_library.exitwitherror('Abaqus mesher only supports Abaqus Model-Based.',-1)
         elif self.mesher == 'PATRAN':
             if self.analyzer == 'PATRAN_NASTRAN':
-                self.logger.info("Calling Patran/Nastran")
-                self.run_patran_nastran()
+                if self.mesh_convergence:
+                    self.logger.info("Calling Patran/Nastran (mesh convergence)")
+                    with self.timed_stage('MeshConvergence'):
+                        self.run_mesh_convergence()
+                else:
+                    self.logger.info("Calling Patran/Nastran")
+                    self.run_patran_nastran()
             else:
                 cad_library.exitwitherror('CADJobDriver.py: mesher=PATRAN requires analyzer=PATRAN_NASTRAN', -1)
         elif self.mesher == 'CREO':
@@ -156,30 +360,88 @@ class CADJobDriver():
 
         return result
 
-    def call_subprocess(self, cmd, failonexit = True):
+    def call_subprocess(self, cmd, failonexit = True, env=None, monitor=None, memory_mb=None):
+        """Run cmd and return its exit code. monitor: the solvers (SolverMonitor.DEFAULT_RULES) whose
+        logs cmd writes in the working directory; cmd is stopped as soon as they show it failed.
+        A monitored cmd also waits for memory_mb (default: estimated from past jobs) to be free on
+        the node, and runs with rlimits sized on the memory_mb given."""
         global print_cmds
         if print_cmds == True:
             print cmd
 
         result = 0
+        solver_monitor = None
 
         try:
-            result = subprocess.call(cmd)
+            # Windows parses the command string itself; elsewhere it needs a shell
+            if monitor is None:
+                result = subprocess.call(cmd, shell=(os.name != 'nt'), env=env)
+            else:
+                result, solver_monitor = self.call_monitored(cmd, monitor, env, memory_mb)
         except Exception as e:
             cad_library.exitwitherror('Failed to execute: ' + cmd + ' Error is: ' + e.message, -1)
 
+        if solver_monitor is not None and solver_monitor.reason is not None:
+            self.metrics.inc('cad_solver_aborts_total', rule=solver_monitor.matched_rule)
+            msg = 'The command {} was stopped: {}'.format(cmd, solver_monitor.reason)
+            self.logger.error(msg)
+
+            if failonexit:
+                cad_library.exitwitherror(msg, -1)
+
+            return result or -1
+
         if result != 0 and failonexit:
             cad_library.exitwitherror('The command {} exited with value: {}'.format(cmd, result), -1)
 
         return result
 
+    def call_monitored(self, cmd, solvers, env=None, memory_mb=None):
+        """Run cmd under a SolverMonitor once memory_mb is free. Returns (exit code, monitor)."""
+
+        # Only an estimate from the model size is good enough to limit the solver's address space
+        rlimits = solver_rlimits(memory_mb)
+
+        memory_mb = memory_mb or estimate_memory_mb(None, self.history_records)
+        self.estimated_memory_mb = max(memory_mb, self.estimated_memory_mb or 0)
+
+        reservation_path = None
+        try:
+            with self.timed_stage('MemoryWait'):
+                reservation_path = reserve_memory(memory_mb, self.solver_memory_mb, self.logger)[0]
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not reserve memory; solving without waiting for it: {}".format(e))
+
+        try:
+            process = subprocess.Popen(cmd, shell=(os.name != 'nt'), env=env,
+                                       **popen_kwargs(rlimits))
+            solver_monitor = SolverMonitor(process, solvers, rules=self.solver_rules, logger=self.logger).start()
+
+            try:
+                peak_memory_mb = wait_with_peak_memory(process)[1]
+            finally:
+                # Also when the job itself is interrupted; the solver is in its own process group
+                kill_process_tree(process)
+                solver_monitor.stop()
+
+        finally:
+            if reservation_path is not None:
+                release_memory(reservation_path)
+
+        if peak_memory_mb is not None and 'PATRAN' not in solvers:
+            self.solver_peak_memory_mb = max(peak_memory_mb, self.solver_peak_memory_mb or 0)
+
+        # Read after the monitor has stopped, which may also have reaped the process
+        return process.returncode, solver_monitor
+
     def copy_failed_and_exit(self, code):
-        for (root, dirs, files) in os.walk(os.getcwd(), topdown=False):
-            for file in files:
-                print os.path.join(root, file)
-                if cmp(file, '_FAILED.txt')==0:
-                    copy_command = 'copy {} {}'.format(os.path.join(root, file), os.getcwd())
-                    os.system('copy ' + os.path.join(root, file) + ' ' + os.getcwd())
+        with self.timed_stage('CopyFailed'):
+            for (root, dirs, files) in os.walk(os.getcwd(), topdown=False):
+                for file in files:
+                    print os.path.join(root, file)
+                    if cmp(file, '_FAILED.txt')==0:
+                        copy_command = 'copy {} {}'.format(os.path.join(root, file), os.getcwd())
+                        os.system('copy ' + os.path.join(root, file) + ' ' + os.getcwd())
 
         exit(code)
 
@@ -200,20 +462,23 @@ class CADJobDriver():
             elif mode == 'DYNEXPL':
                 param = '-e'
 
-        self.call_subprocess('c:\\SIMULIA\\Abaqus\\Commands\\abaqus.bat cae noGUI="' + feascript + '" -- ' + param)
+        abaqus = self.find_tool('AbaqusExe', ABAQUS_COMMAND)
+        self.call_subprocess(abaqus + ' cae noGUI="' + feascript + '" -- ' + param)
 
     def run_abaqus_deck_based(self):
         id = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(6))
         os.chdir(os.getcwd() + '\\Analysis\\Abaqus')
-        self.call_subprocess('c:\\SIMULIA\\Abaqus\\Commands\\abaqus.bat fromnastran job=' + id + ' input=..\Nastran_mod.nas')
-        self.call_subprocess('c:\\SIMULIA\\Abaqus\\Commands\\abaqus.bat analysis interactive job=' + id)
-        self.call_subprocess('c:\\SIMULIA\\Abaqus\\Commands\\abaqus.bat odbreport job=' + id + ' results')
-        self.call_subprocess('c:\\SIMULIA\\Abaqus\\Commands\\abaqus.bat cae noGUI="' + cad_library.META_PATH + '\\bin\\CAD\\ABQ_CompletePostProcess.py\" -- -o ' + id + '.odb -p ..\\AnalysisMetaData.xml -m ..\\..\\RequestedMetrics.xml -j ..\\..\\testbench_manifest.json')
+        abaqus = self.find_tool('AbaqusExe', ABAQUS_COMMAND)
+        self.call_subprocess(abaqus + ' fromnastran job=' + id + ' input=..\Nastran_mod.nas')
+        plan = self.solver_resources('..\\Nastran_mod.nas')
+        self.call_subprocess(abaqus + ' analysis interactive job=' + id + ' ' + abaqus_options(plan), monitor=['ABAQUS'],
+                             memory_mb=self.solver_memory('..\\Nastran_mod.nas'))
+        self.call_subprocess(abaqus + ' odbreport job=' + id + ' results')
+        self.call_subprocess(abaqus + ' cae noGUI="' + cad_library.META_PATH + '\\bin\\CAD\\ABQ_CompletePostProcess.py\" -- -o ' + id + '.odb -p ..\\AnalysisMetaData.xml -m ..\\..\\RequestedMetrics.xml -j ..\\..\\testbench_manifest.json')
 
     def run_patran_nastran(self):
 
         meta_bin_cad = os.path.join(cad_library.META_PATH, 'bin', 'CAD')
-        meta_src_cad_python = os.path.join(cad_library.META_PATH, 'src', 'CADAssembler', 'Python')
         cpif_name = 'CreatePatranInputFile.py'
 
         cpif_path = os.path.join(meta_bin_cad, cpif_name)
@@ -243,12 +508,29 @@ class CADJobDriver():
         try:
             self.logger.info("Creating Patran Model Input File...")
 
-            from CreatePatranInputFile import PatranPCL
-            ppcl = PatranPCL('../../CADAssembly.xml', '../../CADAssembly_metrics.xml', '../../ComputedValues.xml')
-            ppcl.create_pcl_input_file(copy_xml_text=False)
+            with self.timed_stage('PatranInput'):
+                from CreatePatranInputFile import PatranPCL
+                ppcl = PatranPCL('../../CADAssembly.xml', '../../CADAssembly_metrics.xml', '../../ComputedValues.xml')
+                self.features.update({'Layers': len(ppcl.layers), 'Loads': len(ppcl.loads)})
 
-        except Exception:
-            msg = "Exception with CreatPatranInputFile/PatranPCL"
+                # Mesh in Patran, but run Nastran here to check the mesh first, to keep its database
+                # or to solve a cached mesh
+                mesh_check = self.mesh_quality_check and self.mesh_quality_available()
+                mesh_cache = self.open_mesh_cache()
+                solve_deferred = (mesh_check or self.nastran_restart or mesh_cache is not None) and \
+                    self.nastran_available() and ppcl.defer_solve()
+
+                # Catch input errors here rather than after a Patran license has been checked out
+                ppcl.check()
+
+                restart_loads = self.find_restart_loads(ppcl) if solve_deferred and self.nastran_restart else None
+                mesh_key = self.mesh_cache_key(ppcl) if solve_deferred and mesh_cache is not None else None
+
+                ppcl.create_pcl_input_file(copy_xml_text=False)
+                ppcl.close()
+
+        except Exception as e:
+            msg = "Exception with CreatPatranInputFile/PatranPCL: {}".format(e)
             self.logger.error(msg)
             self.logger.error("- Is it in {}?".format(os.path.join('META', 'bin', 'CAD')))
             cad_library.exitwitherror(msg, 99)
@@ -257,36 +539,41 @@ class CADJobDriver():
 
         pcl_input_name = 'CreatePatranModelInput.txt'
         pcl_name = 'CreatePatranModel.pcl'
-        ses_name = 'CreatePatranModel.ses'
 
-        pcl_path = os.path.join(meta_src_cad_python, pcl_name)
-        if not os.path.exists(pcl_path):
-            pcl_path = os.path.join(meta_bin_cad, pcl_name)
-            if not os.path.exists(pcl_path):
-                cad_library.exitwitherror("Could not find {} ({}).".format(pcl_name, pcl_path), -1)
-
-        ses_path = os.path.join(meta_src_cad_python, ses_name)
-        if not os.path.exists(ses_path):
-            ses_path = os.path.join(meta_bin_cad, ses_name)
-            if not os.path.exists(ses_path):
-                cad_library.exitwitherror("Could not find {} ({}).".format(ses_name, ses_path), -1)
+        pcl_path, ses_path = self.get_patran_model_files()
 
         try:
-            shutil.copy2(pcl_path, patran_nastran_dir)
-            shutil.copy2(ses_path, patran_nastran_dir)
+            with self.timed_stage('StageFiles'):
+                stage_file(pcl_path, patran_nastran_dir, self.logger)
+                stage_file(ses_path, patran_nastran_dir, self.logger)
 
         except Exception:
             msg = "Could not find {} and/or {}".format(pcl_path, ses_path)
             self.logger.error(msg)
             cad_library.exitwitherror(msg, -1)
 
-        pcl_command = "patran -b -graphics -sfp {} -stdout CreatePatranModel_Session.log".format(ses_name)
+        pcl_command = PATRAN_MODEL_COMMAND
 
         with open('RunPatranNastran.cmd', 'wb') as cmd_file_out:
             cmd_file_out.write(pcl_command)
 
         if os.path.exists(pcl_input_name) and os.path.exists(pcl_name) and os.path.exists(ses_path):
-            patran_nastran_result = self.call_subprocess(pcl_command)
+            restarted = False
+            meshed_from_cache = False
+
+            if restart_loads is not None:
+                with self.timed_stage('NastranRestart'):
+                    restarted = self.restart_patran_nastran(restart_loads)
+
+            if mesh_key is not None and not restarted:
+                with self.timed_stage('MeshCache'):
+                    meshed_from_cache = self.mesh_from_cache(mesh_cache, mesh_key[0], ppcl)
+
+            if restarted or meshed_from_cache:
+                patran_nastran_result = 0
+            else:
+                with self.timed_stage('Patran'):
+                    patran_nastran_result = self.call_subprocess(pcl_command, monitor=['PATRAN', 'NASTRAN'])
 
             if patran_nastran_result != 0:
                 self.logger.error(line_number_of_problem())
@@ -300,16 +587,42 @@ class CADJobDriver():
                 cad_library.exitwitherror(msg, -1)
 
             else:
+                with self.timed_stage('IndexBdf'):
+                    bdf_index = self.index_bdf('Nastran_mod.bdf')
+                    if bdf_index is not None:
+                        self.features['Elements'] = bdf_index.num_elements
+
+                if solve_deferred and not restarted:
+                    if mesh_check:
+                        with self.timed_stage('MeshQuality'):
+                            self.check_mesh_quality(bdf_index)
+                    with self.timed_stage('Nastran'):
+                        self.solve_nastran_deck('Nastran_mod.bdf')
+
+                if mesh_key is not None and not restarted and not meshed_from_cache:
+                    mesh_cache.put(mesh_key[0], 'Nastran_mod.bdf', mesh_key[1])
+
+                if self.nastran_restart and solve_deferred:
+                    ppcl.write_model_state()
+
+                if not self.run_pp:
+                    self.logger.info("Post-processing skipped")
+                    return
+
                 try:
-                    from Patran_PP import Patran_PostProcess
+                    with self.timed_stage('PostProcess'):
+                        from Patran_PP import Patran_PostProcess
 
-                    patran_pp = Patran_PostProcess('Nastran_mod.bdf',
-                                                   'Nastran_mod.xdb',
-                                                   '..\\AnalysisMetaData.xml',
-                                                   '..\\..\\RequestedMetrics.xml',
-                                                   '..\\..\\testbench_manifest.json')
+                        patran_pp = Patran_PostProcess('Nastran_mod.bdf',
+                                                       'Nastran_mod.xdb',
+                                                       '..\\AnalysisMetaData.xml',
+                                                       '..\\..\\RequestedMetrics.xml',
+                                                       '..\\..\\testbench_manifest.json')
 
-                    pp_result = patran_pp.main()
+                        try:
+                            pp_result = patran_pp.main()
+                        finally:
+                            patran_pp.close()
 
                 except Exception:
                     import traceback
@@ -356,6 +669,501 @@ class CADJobDriver():
             msg = "Could not find {}, {}, or {}.".format(pcl_input_name, pcl_name, ses_path)
             cad_library.exitwitherror(msg, -1)
 
+    def get_patran_model_files(self):
+        """Paths of CreatePatranModel.pcl and CreatePatranModel.ses in the META installation."""
+
+        return [self.find_tool(file_name) for file_name in ['CreatePatranModel.pcl', 'CreatePatranModel.ses']]
+
+    def nastran_available(self):
+        """Whether NastranExe is found, for running Nastran here rather than in Patran
+        (MESH_AND_SOLVE) or through META's Nastran.py."""
+
+        try:
+            tool_path('NastranExe')
+            return True
+        except ToolPathError as e:
+            self.logger.warning("{}; leaving Nastran to Patran or Nastran.py, without the mesh quality check, "
+                                "restart database, mesh cache or solver resource plan".format(e))
+            return False
+
+    def find_tool(self, name, default=None):
+        """ToolPaths.tool_path(name), or default if it is not found. Exits with an error if there is no default."""
+
+        try:
+            return tool_path(name)
+        except ToolPathError as e:
+            if default is not None:
+                return default
+            cad_library.exitwitherror(str(e), -1)
+
+    def run_mesh_convergence(self):
+        """Solve the PATRAN_NASTRAN model with progressively finer meshes until no part's max
+        von Mises changes by more than convergence_tolerance, then post-process the coarsest
+        mesh that met the tolerance as the result of the job.
+
+        Levels run mesh_parallel at a time (one Patran license each) in
+        Analysis/Patran_Nastran/MeshConvergence/Mesh_<level>; each wave is post-processed in
+        one Patran session. Mesh size, element count and runtime of every level are written
+        to MeshConvergence.csv/.json."""
+
+        from MeshConvergence import MESH_CONVERGENCE_DIR_NAME, select_converged_level, write_convergence_files
+
+        result_dir = os.path.abspath(os.getcwd())
+        convergence_dir = os.path.join(result_dir, 'Analysis', 'Patran_Nastran', MESH_CONVERGENCE_DIR_NAME)
+
+        if not os.path.exists(convergence_dir):
+            os.makedirs(convergence_dir)
+
+        pcl_path, ses_path = self.get_patran_model_files()
+
+        levels = []
+        selected = None
+
+        while selected is None and len(levels) < self.convergence_levels:
+            wave_size = min(self.mesh_parallel, self.convergence_levels - len(levels))
+            wave = [self.prepare_convergence_level(len(levels) + i, result_dir, convergence_dir, pcl_path, ses_path)
+                    for i in range(wave_size)]
+
+            self.solve_convergence_levels(wave)
+            self.post_process_convergence_levels(wave, convergence_dir)
+
+            levels.extend(wave)
+            selected = select_converged_level(levels, self.convergence_tolerance)
+
+            if any(level['Status'] != 'Solved' for level in wave):
+                break
+
+        os.chdir(convergence_dir)
+
+        if selected is None:
+            solved = [level for level in levels if level['Status'] == 'Solved']
+            if not solved:
+                write_convergence_files(convergence_dir, levels, None, self.convergence_tolerance)
+                cad_library.exitwitherror("Mesh convergence: no mesh level solved; see {}".format(convergence_dir), -1)
+
+            selected = solved[-1]
+            self.logger.warning("Mesh did not converge to {} in {} levels; using level {}".format(
+                self.convergence_tolerance, len(levels), selected['Level']))
+
+        write_convergence_files(convergence_dir, levels, selected, self.convergence_tolerance)
+
+        self.logger.info("Mesh convergence selected level {} (Max_Global_Length {}, {} elements) in {}".format(
+            selected['Level'], selected['MaxGlobalLength'], selected.get('Elements'), selected['Directory']))
+
+        os.chdir(selected['Directory'])
+
+        try:
+            if not selected['PostProcess'].update_results_files():
+                cad_library.exitwitherror("Mesh convergence: post-processing failed in {}".format(
+                    selected['Directory']), -1)
+        finally:
+            os.chdir(result_dir)
+            for level in levels:
+                if 'PostProcess' in level:
+                    level['PostProcess'].close()
+
+    def prepare_convergence_level(self, level, result_dir, convergence_dir, pcl_path, ses_path):
+        """Write the Patran input for one refinement level in its own directory."""
+
+        from MeshConvergence import level_dir_name, level_length_factor
+        from CreatePatranInputFile import PatranPCL
+
+        level_dir = os.path.join(convergence_dir, level_dir_name(level))
+
+        if not os.path.exists(level_dir):
+            os.makedirs(level_dir)
+
+        try:
+            length_factor = level_length_factor(level)
+
+            ppcl = PatranPCL(os.path.join(result_dir, 'CADAssembly.xml'),
+                             os.path.join(result_dir, 'CADAssembly_metrics.xml'),
+                             os.path.join(result_dir, 'ComputedValues.xml'),
+                             output_dir=level_dir)
+            ppcl.pcl_globals['Geometry_File_Dir'] = os.path.join(result_dir, 'Parasolid')
+            ppcl.scale_mesh_parameters(length_factor)
+            ppcl.check()
+            ppcl.create_pcl_input_file(copy_xml_text=False)
+            ppcl.close()
+
+            stage_file(pcl_path, level_dir, self.logger)
+            stage_file(ses_path, level_dir, self.logger)
+
+        except Exception:
+            import traceback
+            self.logger.error(traceback.format_exc())
+            cad_library.exitwitherror("Mesh convergence: could not create the Patran input in {}".format(level_dir), -1)
+
+        return {
+            'Level': level,
+            'LengthFactor': length_factor,
+            'MaxGlobalLength': ppcl.mesh_parameters[1]['Max_Global_Length'],
+            'Directory': level_dir,
+            'Status': 'Created'
+        }
+
+    def solve_convergence_levels(self, levels):
+        """Mesh and solve the levels concurrently, one Patran process each."""
+
+        running = {}
+
+        for level in levels:
+            self.logger.info("Starting mesh level {} in {}".format(level['Level'], level['Directory']))
+            level['Started'] = time.time()
+            process = subprocess.Popen(PATRAN_MODEL_COMMAND, cwd=level['Directory'], shell=(os.name != 'nt'),
+                                       **popen_kwargs(solver_rlimits()))
+            level['Monitor'] = SolverMonitor(process, ['PATRAN', 'NASTRAN'], level['Directory'],
+                                             self.solver_rules, logger=self.logger).start()
+            running[process] = level
+
+        while running:
+            for process, level in running.items():
+                if process.poll() is None:
+                    continue
+
+                del running[process]
+                level['Runtime'] = round(time.time() - level.pop('Started'), 1)
+
+                solver_monitor = level.pop('Monitor')
+                reason = solver_monitor.stop()
+                if reason is not None:
+                    self.metrics.inc('cad_solver_aborts_total', rule=solver_monitor.matched_rule)
+                    level['Error'] = reason
+
+                xdb_path = os.path.join(level['Directory'], 'Nastran_mod.xdb')
+                if process.returncode == 0 and reason is None and os.path.exists(xdb_path):
+                    level['Status'] = 'Solved'
+                else:
+                    level['Status'] = 'Failed'
+                    self.logger.error("Mesh level {} failed ({}); see {}".format(
+                        level['Level'], reason or process.returncode, level['Directory']))
+
+            if running:
+                time.sleep(1)
+
+    def post_process_convergence_levels(self, levels, convergence_dir):
+        """Index each solved deck and extract per-part max von Mises with one Patran session.
+        A level Patran wrote no _out.txt for is marked Failed, so it is never compared."""
+
+        from Patran_PP import Patran_PostProcess, run_batch_patran
+        from MeshConvergence import read_part_max_von_mises
+
+        result_dir = os.getcwd()
+        post_processes = []
+
+        for level in levels:
+            if level['Status'] != 'Solved':
+                continue
+
+            os.chdir(level['Directory'])
+
+            try:
+                bdf_index = self.index_bdf('Nastran_mod.bdf')
+                if bdf_index is not None:
+                    level['Nodes'] = bdf_index.num_nodes
+                    level['Elements'] = bdf_index.num_elements
+
+                post_process = Patran_PostProcess('Nastran_mod.bdf',
+                                                  'Nastran_mod.xdb',
+                                                  os.path.join(result_dir, 'Analysis', 'AnalysisMetaData.xml'),
+                                                  os.path.join(result_dir, 'RequestedMetrics.xml'),
+                                                  os.path.join(result_dir, 'testbench_manifest.json'))
+                post_process.pre_process_cleanup()
+
+                level['PostProcess'] = post_process
+                post_processes.append((level['Directory'], post_process))
+
+            finally:
+                os.chdir(result_dir)
+
+        if not post_processes:
+            return
+
+        os.chdir(convergence_dir)
+
+        try:
+            if not run_batch_patran(post_processes, convergence_dir):
+                cad_library.exitwitherror("Mesh convergence: Patran post-processing failed in {}".format(
+                    convergence_dir), -1)
+        finally:
+            os.chdir(result_dir)
+
+        solved = [level for level in levels if level['Status'] == 'Solved']
+        missing = [level for level in solved
+                   if not os.path.exists(os.path.join(level['Directory'], 'Nastran_mod_out.txt'))]
+
+        if missing:
+            self.logger.error("Mesh convergence: Patran wrote no results for mesh level(s) {}".format(
+                ', '.join(str(level['Level']) for level in missing)))
+
+        for level in solved:
+            out_txt_path = os.path.join(level['Directory'], 'Nastran_mod_out.txt')
+
+            if level in missing:
+                level['Status'] = 'Failed'
+                level['Error'] = "File not found: {}".format(out_txt_path)
+                continue
+
+            level['PartMaxVM'] = read_part_max_von_mises(out_txt_path)
+            self.logger.info("Mesh level {}: {} elements, {} s, max VM {}".format(
+                level['Level'], level.get('Elements'), level.get('Runtime'), level['PartMaxVM']))
+
+    def index_bdf(self, bdf_path):
+        """Build (or reuse) the BdfIndex sidecar for bdf_path and log the model size.
+        Returns None if the deck cannot be indexed; callers treat the index as optional."""
+
+        if not os.path.exists(bdf_path):
+            self.logger.warning("Cannot index {}, file does not exist.".format(bdf_path))
+            return None
+
+        try:
+            from BdfIndex import BdfIndex
+
+            bdf_index = BdfIndex.load(bdf_path)
+
+        except Exception:
+            import traceback
+            self.logger.warning("Could not index {}: {}".format(bdf_path, traceback.format_exc()))
+            return None
+
+        self.logger.info("{}: {} nodes, {} elements, {} properties".format(
+            bdf_path, bdf_index.num_nodes, bdf_index.num_elements, len(bdf_index.properties)))
+
+        return bdf_index
+
+    def mesh_quality_available(self):
+
+        try:
+            import MeshQuality
+        except ImportError as e:
+            self.logger.warning("Mesh quality check disabled ({}); Patran will run Nastran.".format(e))
+            return False
+
+        return True
+
+    def check_mesh_quality(self, bdf_index):
+        """Exit with an error if the mesh in bdf_index fails MeshQuality's thresholds."""
+
+        if bdf_index is None:
+            self.logger.warning("No BDF index; solving without a mesh quality check.")
+            return
+
+        import json
+        from MeshQuality import check_mesh_quality, MESH_QUALITY_FILE_NAME
+
+        report = check_mesh_quality(bdf_index)
+
+        with open(MESH_QUALITY_FILE_NAME, 'w') as f_out:
+            json.dump(report, f_out, indent=4, sort_keys=True)
+
+        if report['Passed']:
+            self.logger.info("Mesh quality check passed ({} elements).".format(report['Elements']))
+            return
+
+        msg = "Mesh quality check failed: {} of {} elements outside thresholds {}; see {}".format(
+            report['FailedElements'], report['Elements'], report['Thresholds'],
+            os.path.join(os.getcwd(), MESH_QUALITY_FILE_NAME))
+        self.logger.error(msg)
+
+        if os.path.exists('log'):
+            with open(os.path.join('log', '_MESH_QUALITY_FAILED.txt'), 'wb') as f_out:
+                f_out.write(msg)
+
+        cad_library.exitwitherror(msg, -1)
+
+    def solve_nastran_deck(self, bdf_path):
+        """Run Nastran in the foreground on a deck Patran wrote with MESH_AND_DECK."""
+
+        nastran_exe = self.find_tool('NastranExe', 'nastran')
+        keywords = nastran_keywords(self.solver_resources(bdf_path))
+        self.logger.info("Running Nastran on {}...".format(bdf_path))
+
+        if not self.nastran_restart:
+            self.call_subprocess('{} {} batch=no scr=yes {}'.format(nastran_exe, bdf_path, keywords),
+                                 monitor=['NASTRAN'], memory_mb=self.solver_memory(bdf_path))
+            return
+
+        from NastranRestart import Deck, write_restart_state
+
+        self.call_subprocess('{} {} batch=no scr=no {}'.format(nastran_exe, bdf_path, keywords),
+                             monitor=['NASTRAN'], memory_mb=self.solver_memory(bdf_path))
+        write_restart_state(os.path.splitext(bdf_path)[0], Deck(bdf_path))
+
+    def solver_resources(self, deck_path):
+        """Cores and memory for solving deck_path (see SolverResources.plan_resources), planned
+        from the model size and the jobs running on this node. Logged once per deck."""
+
+        plan = self.solver_plans.get(os.path.abspath(deck_path))
+
+        if plan is None:
+            bdf_index = self.index_bdf(deck_path)
+            plan = plan_resources(bdf_index.num_elements if bdf_index is not None else None,
+                                  cores=self.solver_cores, memory_mb=self.solver_memory_mb,
+                                  mb_per_1000_elements=memory_mb_per_1000_elements(self.history_records))
+            self.solver_plans[os.path.abspath(deck_path)] = plan
+
+            self.logger.info("Solver resources for {}: {} cores (Nastran SMP {}, DMP {}), {} MB; {} elements, "
+                             "{} jobs on a {} core, {} MB node".format(
+                                 deck_path, plan['Cores'], plan['NastranSMP'], plan['NastranDMP'], plan['MemoryMB'],
+                                 plan['Elements'], plan['Jobs'], plan['NodeCores'], plan['NodeMemoryMB']))
+
+        return plan
+
+    def solver_memory(self, deck_path):
+        """Memory in MB the solve of deck_path is expected to use: what it is given, else its estimate."""
+
+        plan = self.solver_resources(deck_path)
+        return plan['MemoryMB'] or plan['EstimatedMemoryMB']
+
+    def restart_dir(self):
+        """Where the Nastran database to restart from is kept."""
+
+        return self.restart_from or os.path.abspath(os.getcwd())
+
+    def find_restart_loads(self, ppcl):
+        """The loads and constraints for PatranPCL.restart_loads, or None if there is no kept
+        database to restart from or the model changed."""
+
+        from CreatePatranInputFile import MODEL_STATE_FILE_NAME
+        from NastranRestart import read_restart_state
+
+        restart_dir = self.restart_dir()
+        state_path = os.path.join(restart_dir, MODEL_STATE_FILE_NAME)
+
+        if read_restart_state(os.path.join(restart_dir, 'Nastran_mod')) is None or not os.path.exists(state_path):
+            self.logger.info("No Nastran restart: no kept database in {}".format(restart_dir))
+            return None
+
+        with open(state_path, 'r') as f_in:
+            previous_state = json.load(f_in)
+
+        return ppcl.restart_loads(previous_state)
+
+    def restart_patran_nastran(self, restart_loads):
+        """Solve the kept Patran deck with new pressures and fixed DOFs by restarting Nastran
+        from its database, instead of remeshing. Returns False if the deck and the database do
+        not match; the model is then remeshed and solved from scratch."""
+
+        from NastranRestart import Deck, NastranRestartError, read_restart_state, can_restart, \
+            write_restart_deck, write_restart_state
+
+        restart_dir = self.restart_dir()
+        database_prefix = os.path.join(restart_dir, 'Nastran_mod')
+        state = read_restart_state(database_prefix)
+
+        try:
+            deck = Deck(os.path.join(restart_dir, 'Nastran_mod.bdf'))
+            deck.rewrite_patran_loads(*restart_loads)
+        except (IOError, NastranRestartError) as e:
+            self.logger.warning("No Nastran restart: {}".format(e))
+            return False
+
+        if not can_restart(deck, state):
+            self.logger.warning("No Nastran restart: {} is not the deck the database was built from".format(deck.path))
+            return False
+
+        # Post-processing reads the mesh from Nastran_mod.bdf here
+        stage_file(deck.path, os.getcwd(), self.logger)
+
+        restart_path, max_set_id = write_restart_deck(deck, database_prefix, state)
+        self.run_nastran_restart(restart_path, 'Nastran_mod', deck.path)
+        write_restart_state(database_prefix, deck, max_set_id)
+
+        return True
+
+    def open_mesh_cache(self):
+        """The shared MeshCache (-meshcache or %PATRAN_MESH_CACHE%), or None if there is none."""
+
+        from MeshCache import MeshCache, MESH_CACHE_ENV, DEFAULT_MAX_GB
+
+        cache_dir = self.mesh_cache_dir or os.environ.get(MESH_CACHE_ENV)
+        if not cache_dir:
+            return None
+
+        try:
+            return MeshCache(cache_dir, (self.mesh_cache_gb or DEFAULT_MAX_GB) * 1024 ** 3)
+        except OSError as e:
+            self.logger.warning("Mesh cache disabled, cannot use {}: {}".format(cache_dir, e))
+            return None
+
+    def mesh_cache_key(self, ppcl):
+        """(key, key state) of the deck Patran will write for ppcl, or None if the geometry cannot be read."""
+
+        from MeshCache import mesh_key
+
+        key_state = ppcl.mesh_key_state()
+
+        try:
+            return mesh_key(ppcl.geometry_path(), key_state), key_state
+        except IOError as e:
+            self.logger.warning("Mesh cache not used: {}".format(e))
+            return None
+
+    def mesh_from_cache(self, mesh_cache, key, ppcl):
+        """Write Nastran_mod.bdf from the cached deck for key with ppcl's loads, constraints and
+        material properties. Returns False on a miss; Patran then meshes the model."""
+
+        from MeshCache import adapt_deck
+        from NastranRestart import NastranRestartError
+
+        cached_path = mesh_cache.get(key)
+        if cached_path is None:
+            return False
+
+        load_values = ppcl.patran_load_values()
+        if load_values is None:
+            return False
+
+        try:
+            adapt_deck(cached_path, 'Nastran_mod.bdf', load_values[0], load_values[1], ppcl.patran_material_values())
+        except (IOError, OSError, NastranRestartError) as e:
+            self.logger.warning("Cached mesh not used: {}".format(e))
+            return False
+
+        self.logger.info("Nastran_mod.bdf written from the mesh cache; Patran not run")
+
+        return True
+
+    def run_nastran_restart(self, restart_path, output_prefix, model_path):
+
+        nastran_exe = self.find_tool('NastranExe', 'nastran')
+        keywords = nastran_keywords(self.solver_resources(model_path))
+        self.logger.info("Restarting Nastran with {}...".format(restart_path))
+
+        self.call_subprocess('{} {} batch=no scr=no out={} {}'.format(
+            nastran_exe, restart_path, output_prefix, keywords), monitor=['NASTRAN'],
+            memory_mb=self.solver_memory(model_path))
+
+    def solve_nastran_keeping_database(self, deck_path, database_prefix='Nastran_mod'):
+        """Solve deck_path and keep the database. If the database was built from the same model
+        and only loads or constraints changed, restart from it instead of solving from scratch."""
+
+        from NastranRestart import Deck, NastranRestartError, read_restart_state, can_restart, \
+            write_restart_deck, write_restart_state
+
+        try:
+            deck = Deck(deck_path)
+        except NastranRestartError as e:
+            self.logger.warning("No Nastran restart: {}".format(e))
+            deck = None
+
+        state = read_restart_state(database_prefix)
+
+        if deck is not None and can_restart(deck, state):
+            restart_path, max_set_id = write_restart_deck(deck, database_prefix, state)
+            self.run_nastran_restart(restart_path, database_prefix, deck_path)
+        else:
+            nastran_exe = self.find_tool('NastranExe', 'nastran')
+            self.logger.info("Running Nastran on {}...".format(deck_path))
+            self.call_subprocess('{} {} batch=no scr=no out={} dbs={} {}'.format(
+                nastran_exe, deck_path, database_prefix, database_prefix,
+                nastran_keywords(self.solver_resources(deck_path))), monitor=['NASTRAN'],
+                memory_mb=self.solver_memory(deck_path))
+            max_set_id = None
+
+        if deck is not None:
+            write_restart_state(database_prefix, deck, max_set_id)
+
     def popen_subprocess(self, command, log_name_no_extension=None):
 
         subprocess_command = command
@@ -397,14 +1205,24 @@ class CADJobDriver():
     def run_nastran(self):
         os.chdir(os.getcwd() + '\\Analysis\\Nastran')
 
-        nastran_py_cmd = ' \"' + cad_library.META_PATH + 'bin\\CAD\Nastran.py\" ..\\Nastran_mod.nas'
-
-        self.call_subprocess(sys.executable + nastran_py_cmd)
-
-        patranscript = cad_library.META_PATH + 'bin\\CAD\\Patran_PP.py'
+        if not self.nastran_available():
+            # META's Nastran.py finds Nastran itself, but takes no run keywords
+            nastran_py = self.find_tool('Nastran.py')
+            self.call_subprocess('{} "{}" ..\\Nastran_mod.nas'.format(sys.executable, nastran_py), monitor=['NASTRAN'])
+        elif self.nastran_restart:
+            self.solve_nastran_keeping_database('..\\Nastran_mod.nas')
+        else:
+            # Nastran directly rather than through META's Nastran.py, which takes no run keywords
+            nastran_exe = self.find_tool('NastranExe')
+            keywords = nastran_keywords(self.solver_resources('..\\Nastran_mod.nas'))
+            self.logger.info("Running Nastran on ..\\Nastran_mod.nas...")
+            self.call_subprocess('{} ..\\Nastran_mod.nas batch=no scr=yes out=Nastran_mod {}'.format(nastran_exe, keywords),
+                                 monitor=['NASTRAN'], memory_mb=self.solver_memory('..\\Nastran_mod.nas'))
 
-        if not os.path.isfile(patranscript):
-            msg = 'Can\'t find ' + patranscript + '. Do you have the META toolchain installed properly?'
+        try:
+            patranscript = tool_path('Patran_PP.py')
+        except ToolPathError as e:
+            msg = 'Can\'t find Patran_PP.py ({}). Do you have the META toolchain installed properly?'.format(e)
             cad_library.exitwitherror(msg, -1)
 
         nas_path = '..\\Nastran_mod.nas'
@@ -425,10 +1243,10 @@ class CADJobDriver():
             cad_library.exitwitherror ('PROE_ISIS_EXTENSIONS env. variable is not set. Do you have the META toolchain installed properly?', -1)
         deckconvexe = os.path.join(isisext,'bin','DeckConverter.exe')
         self.call_subprocess(deckconvexe + ' -i ..\\Nastran_mod.nas')
-        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, r'Software\CMS\CalculiX', 0,
-                         _winreg.KEY_READ | _winreg.KEY_WOW64_32KEY) as key:
-            bconvergedpath = _winreg.QueryValueEx(key, 'InstallLocation')[0]
-        self.call_subprocess(bconvergedpath+'\\CalculiX\\bin\\ccx.bat -i ..\\Nastran_mod')
+        bconvergedpath = self.find_tool('CalculixPath')
+        plan = self.solver_resources('..\\Nastran_mod.nas')
+        self.call_subprocess(bconvergedpath+'\\CalculiX\\bin\\ccx.bat -i ..\\Nastran_mod', env=calculix_environment(plan),
+                             monitor=['CALCULIX'], memory_mb=self.solver_memory('..\\Nastran_mod.nas'))
         metapython = os.path.join(cad_library.META_PATH, 'bin', 'Python27', 'Scripts', 'python.exe')
         calculix_pp = os.path.join(cad_library.META_PATH, 'bin', 'CAD', 'ProcessCalculix.py')
         self.call_subprocess(metapython + " " + calculix_pp + " -o ..\\Nastran_mod.frd -p ..\\AnalysisMetaData.xml -m ..\\..\\RequestedMetrics.xml -j ..\\..\\testbench_manifest.json -e PSolid_Element_Map.csv")
@@ -444,11 +1262,9 @@ def main():
 
     logger = logging.getLogger('CADJobDriver')
     logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler(os.path.join(log_path, 'CADJobDriver.py.txt'), 'w')
     formatter = logging.Formatter(
         '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    add_queued_file_handler(logger, os.path.join(log_path, 'CADJobDriver.py.txt'), 'w', formatter)
 
     global args
 
@@ -457,9 +1273,39 @@ def main():
     parser.add_argument('-mesher', choices=['NONE','CREO','ABAQUS','PATRAN','ABAQUSMDLCHECK','GMESH']);
     parser.add_argument('-analyzer', choices=['NONE','ABAQUSMODEL','ABAQUSDECK','NASTRAN','CALCULIX', 'PATRAN_NASTRAN']);
     parser.add_argument('-mode', choices=['STATIC','MODAL','DYNIMPL','DYNEXPL']);
+    parser.add_argument('-nopostprocess', action='store_true', help='Skip the post-processing of the solver results.');
+    parser.add_argument('-nomeshcheck', action='store_true', help='Let Patran solve without checking the mesh first.');
+    parser.add_argument('-meshconvergence', action='store_true', help='Refine the PATRAN mesh until the max von Mises stress converges.');
+    parser.add_argument('-convergence_tol', type=float, default=DEFAULT_TOLERANCE, help='Relative change in max von Mises that counts as converged.');
+    parser.add_argument('-convergence_levels', type=int, default=DEFAULT_MAX_LEVELS, help='Maximum number of mesh levels.');
+    parser.add_argument('-meshparallel', type=int, default=1, help='Mesh levels solved at once (Patran licenses used).');
+    parser.add_argument('-nastranrestart', action='store_true', help='Keep the Nastran database and restart from it when only loads or constraints changed.');
+    parser.add_argument('-restartfrom', default=None, help='Analysis directory of the run to restart from (default: this one).');
+    parser.add_argument('-meshcache', default=None, help='Directory of Patran meshes shared between jobs (default: %%PATRAN_MESH_CACHE%%).');
+    parser.add_argument('-meshcache_gb', type=float, default=None, help='Size the mesh cache is trimmed to, least recently used first.');
+    parser.add_argument('-solver_cores', type=int, default=None, help='Cores of this node the solvers may use (default: all, or %%SOLVER_CORES%%).');
+    parser.add_argument('-solver_memory_mb', type=int, default=None, help='Memory of this node the solvers may use (default: all, or %%SOLVER_MEMORY_MB%%).');
+    parser.add_argument('-metrics_textfile', default=None, help='Prometheus textfile the job adds its metrics to (default: %%CAD_METRICS_TEXTFILE%%).');
+    parser.add_argument('-runtime_history', default=None, help='File of past job runtimes that runtimes are predicted from (default: %%CAD_RUNTIME_HISTORY%%).');
+    parser.add_argument('-solver_rules', default=None, help='JSON file of solver log rules that stop a failing solve (default: %%SOLVER_MONITOR_RULES%%).');
     args = parser.parse_args()
 
-    cad_job_driver = CADJobDriver(args.assembler, args.mesher, args.analyzer, args.mode)
+    cad_job_driver = CADJobDriver(args.assembler, args.mesher, args.analyzer, args.mode,
+                                  run_postprocessing=not args.nopostprocess,
+                                  mesh_quality_check=not args.nomeshcheck,
+                                  mesh_convergence=args.meshconvergence,
+                                  convergence_tolerance=args.convergence_tol,
+                                  convergence_levels=args.convergence_levels,
+                                  mesh_parallel=args.meshparallel,
+                                  nastran_restart=args.nastranrestart,
+                                  restart_from=args.restartfrom,
+                                  mesh_cache_dir=args.meshcache,
+                                  mesh_cache_gb=args.meshcache_gb,
+                                  solver_cores=args.solver_cores,
+                                  solver_memory_mb=args.solver_memory_mb,
+                                  metrics_textfile=args.metrics_textfile,
+                                  runtime_history=args.runtime_history,
+                                  solver_rules=args.solver_rules)
     # cad_job_driver = CADJobDriver('ASSEMBLY_EXISTS', args.mesher, args.analyzer, args.mode, False)
     # cad_job_driver = CADJobDriver(args.assembler, args.mesher, args.analyzer, args.mode, False)
 
@@ -2,6 +2,8 @@ __author__ = 'James Klingler'
 
 import os
 import sys
+import time
+import hashlib
 from lxml import etree as letree
 import inspect
 import json
@@ -10,6 +12,45 @@ import argparse
 import logging
 import cad_library
 import datetime
+from ModelValidator import validate_model, pcl_number, pcl_text
+from QueueLogging import queued_handler, add_queued_handler, add_queued_file_handler, remove_queued_handler
+from ToolPaths import tool_path, ToolPathError
+
+
+MESH_PARAMETER_NAMES = ['Max_Global_Length', 'Max_Curv_Delta_Div_Edge_Len', 'Ratio_Min_Edge_To_Max_Edge',
+                        'Match_Face_Proximity_Tol']
+
+# Parts whose results are not requested can be meshed this many times coarser (e.g. 2.0); 0 meshes
+# them like the rest
+FAR_FIELD_LENGTH_FACTOR = 0.0
+
+BIN_CAD_DIR = os.path.dirname(os.path.realpath(__file__))
+PATRAN_INPUT_FILE_NAME = 'CreatePatranModelInput.txt'
+
+# The resolved model of the last solve, for deciding whether a rerun can restart Nastran
+MODEL_STATE_FILE_NAME = 'PatranModelState.json'
+
+# Sections a Nastran restart can take new values for; a change anywhere else needs a new mesh
+RESTART_VALUE_SECTIONS = ['Load_Value_Scalar', 'Constraint_Specifier_Displacement']
+
+DOF_COMPONENTS = [('x_Disp', '1'), ('y_Disp', '2'), ('z_Disp', '3'), ('x_Rot', '4'), ('y_Rot', '5'), ('z_Rot', '6')]
+
+# Sections of CreatePatranModelInput.txt in the order they are written
+DECK_SECTIONS = ['Analysis', 'Files', 'Point', 'Geometry', 'Surface', 'Mesh_Parameters', 'Solid', 'Material',
+                 'SubCase', 'Load', 'Load_Value_Scalar', 'Load_Value_Vector', 'Constraint',
+                 'Constraint_Specifier_Displacement', 'Constraint_Specifier_Pin', 'Surface_Contents', 'Material_Layup']
+
+# -watch polls the input files this often, and waits until they have not changed for WATCH_SETTLE_SECONDS
+# (editors save in more than one write)
+WATCH_POLL_SECONDS = 0.02
+WATCH_SETTLE_SECONDS = 0.05
+
+# Parsed JSON files (material library, input template) shared by every PatranPCL in the process
+_json_cache = {}
+
+
+class PatranPCLError(Exception):
+    pass
 
 
 def line_number_as_pcl_comment():
@@ -30,6 +71,86 @@ def is_float(string_value):
         return False
 
 
+def normalize_state(value):
+    """A section map with comments, XML text and the '# comment's on values removed."""
+
+    if isinstance(value, dict):
+        return dict((str(k), normalize_state(v)) for k, v in value.items() if k not in ['Comments', 'XML_Text'])
+
+    if isinstance(value, (list, tuple)):
+        return [normalize_state(v) for v in value]
+
+    if value is None:
+        return None
+
+    return pcl_text(value)
+
+
+def entry_order(key):
+    """Sort key for section entries: numeric IDs in numeric order ('2' before '10'), then the others."""
+
+    text = str(key)
+    return (0, int(text), '') if text.isdigit() else (1, 0, text)
+
+
+def content_hash(value):
+    """sha1 of a section entry (or list of them). Entries parsed the same way repr the same way;
+    one that reprs differently but is equal is only rendered again."""
+
+    return hashlib.sha1(repr(value)).hexdigest()
+
+
+def load_json(path):
+    """json.load with a per-process cache; callers must not modify the result."""
+
+    path = os.path.abspath(path)
+
+    if path not in _json_cache:
+        with open(path, 'r') as file_in:
+            _json_cache[path] = json.load(file_in)
+
+    return _json_cache[path]
+
+
+def find_material_library_path():
+    """The material library in the META installation (see ToolPaths), or where it should be if it is missing."""
+
+    try:
+        return tool_path('MaterialLibrary')
+    except ToolPathError:
+        return os.path.join(tool_path('MetaPath'), 'models', 'MaterialLibrary', 'material_library.json')
+
+
+def load_material_library(material_library_path=None):
+
+    if material_library_path is None:
+        material_library_path = find_material_library_path()
+
+    return load_json(material_library_path)["Material library"]
+
+
+def load_pcl_template(template_path=None):
+
+    if template_path is None:
+        template_path = os.path.join(BIN_CAD_DIR, 'PatranInputTemplate.json')
+
+    return load_json(template_path)
+
+
+def add_console_handler():
+    """Console output of every PatranPCL goes through the shared 'PatranPCL' logger; set it up once."""
+
+    parent_logger = logging.getLogger('PatranPCL')
+
+    if queued_handler(parent_logger) is None:
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.WARNING)
+        ch.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+        add_queued_handler(parent_logger, ch)
+
+    return parent_logger
+
+
 def remove_lines_with_none(block_string):
 
     split_lines = block_string.split('\n')
@@ -52,12 +173,25 @@ class PatranPCL():
 
     def __init__(self, cad_assembly_path='CADAssembly.xml',
                  cad_assembly_metrics_path='CADAssembly_metrics.xml',
-                 computed_values_path='ComputedValues.xml'):
+                 computed_values_path='ComputedValues.xml',
+                 far_field_length_factor=FAR_FIELD_LENGTH_FACTOR,
+                 output_dir=None,
+                 material_library=None,
+                 pcl_template_json=None):
+        """Relative input paths are relative to output_dir (default: the current directory), where
+        the log, _FAILED.txt and CreatePatranModelInput.txt are written. Pass material_library
+        and pcl_template_json to share already-loaded copies between instances.
+
+        Errors raise PatranPCLError."""
 
+        self.output_dir = os.path.abspath(output_dir if output_dir is not None else os.getcwd())
+
+        self.log_handler = None
         self.get_logger()
-        self.bin_cad_dir = os.path.dirname(os.path.realpath(__file__))
+        self.far_field_length_factor = far_field_length_factor
+        self.bin_cad_dir = BIN_CAD_DIR
 
-        self.patran_input_file_name = 'CreatePatranModelInput.txt'
+        self.patran_input_file_name = PATRAN_INPUT_FILE_NAME
 
         # TODO: Di please review
         self.patran_input_template_path = os.path.join(self.bin_cad_dir, 'PatranInputTemplate.json')
@@ -67,50 +201,49 @@ class PatranPCL():
             'Surface_Contents_Offset_Value': "000{}".format(line_number_as_pcl_comment()),
             'Surface_Element_Type': "000{}".format(line_number_as_pcl_comment()),
             'Surface_Mesh_Parameters_ID': '1{}'.format(line_number_as_pcl_comment()),
-            'Test_Bench_Name': 'A_horse_with_no_name{}'.format(line_number_as_pcl_comment())
+            'Test_Bench_Name': 'A_horse_with_no_name{}'.format(line_number_as_pcl_comment()),
+            'Geometry_File_Dir': '..\\..\\Parasolid'
         }
 
+        cad_assembly_path = self.resolve_path(cad_assembly_path)
+        cad_assembly_metrics_path = self.resolve_path(cad_assembly_metrics_path)
+        computed_values_path = self.resolve_path(computed_values_path)
+
         if not os.path.exists(computed_values_path):
-            self.failure("ComputedValues.xml not found at '{}'".format(os.path.abspath(computed_values_path)))
+            self.failure("ComputedValues.xml not found at '{}'".format(computed_values_path))
 
         self.cv_metrics_by_id = self.get_metrics_from_computed_values(computed_values_path)
 
         if not os.path.exists(cad_assembly_metrics_path):
-            self.failure("CADAssembly_metrics.xml not found at '{}'".format(os.path.abspath(cad_assembly_metrics_path)))
+            self.failure("CADAssembly_metrics.xml not found at '{}'".format(cad_assembly_metrics_path))
 
         self.cam_materials_by_comp_id = self.get_materials_from_ca_metrics(cad_assembly_metrics_path)
 
         # Get the example Material Library
-        meta_path = os.environ.get('MetaPath')  # this is set in the runCADJob.bat; if not, set it here
-        if meta_path is None:
-            meta_path = os.path.abspath(os.path.join(self.bin_cad_dir, '..', '..'))
+        self.material_library_path = None
+        self.material_library = material_library
 
-        self.logger.info('%MetaPath% = {}'.format(meta_path))
-
-        self.material_library_path = os.path.join(meta_path, 'models', 'MaterialLibrary', 'material_library.json')
-        self.material_library = {}
-
-        if not os.path.exists(self.material_library_path):
-            self.material_library_path = """C:\Users\Public\Documents\META Documents\MaterialLibrary\material_library.json"""
-            # self.material_library_path = os.path.join('C:', 'Users', 'Public', 'Documents', 'META Documents',
-            #                                           'MaterialLibrary', 'material_library.json')
+        if self.material_library is None:
+            self.material_library_path = find_material_library_path()
+            self.logger.info('Material library: {}'.format(self.material_library_path))
 
             if not os.path.exists(self.material_library_path):
                 abs_path = os.path.abspath(self.material_library_path)
                 self.failure("Material library path invalid: {} ({})".format(abs_path, line_number_of_problem()))
 
-        with open(self.material_library_path, 'r') as file_in:
-            material_library = json.load(file_in)
-            self.material_library = material_library["Material library"]
+            self.material_library = load_material_library(self.material_library_path)
 
         # Read in the PCL template
-        self.pcl_template_json = {}
+        self.pcl_template_json = pcl_template_json
+
+        if self.pcl_template_json is None:
+            if not os.path.exists(self.patran_input_template_path):
+                self.failure("Patran input template.json not found: {}".format(self.patran_input_template_path))
 
-        if not os.path.exists(self.patran_input_template_path):
-            self.failure("Patran input template.json not found: {}".format(self.patran_input_template_path))
+            self.pcl_template_json = load_pcl_template(self.patran_input_template_path)
 
-        with open(self.patran_input_template_path, 'r') as file_in:
-            self.pcl_template_json = json.load(file_in)
+        # Input problems found while reading the model; see problem() and check()
+        self.problems = []
 
         self.is_surface_model = False
         self.solids = {}
@@ -130,6 +263,7 @@ class PatranPCL():
         self.layers = {}
         self.surface_contents = {}
         self.materials = {}
+        self.subcases = {}
         self.loads = {}
         self.load_values = {
             'Scalar': {},
@@ -158,34 +292,36 @@ class PatranPCL():
 
     def get_logger(self):
 
-        # create logger with 'spam_application'
-        self.logger = logging.getLogger('PatranPCL')
-        self.logger.setLevel(logging.DEBUG)
-
-        # create file handler which logs even debug messages
-        if not os.path.isdir('log'):
-            os.mkdir('log')
+        add_console_handler()
 
-        fh = logging.FileHandler(os.path.join('log', 'CreatePatranInputFile.py.log'))
-        fh.setLevel(logging.DEBUG)
-
-        # create console handler with a higher log level
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.WARNING)
+        # One child logger per output directory, so instances working in different
+        # directories do not write to each other's log files
+        self.logger = logging.getLogger('PatranPCL.{}'.format(self.output_dir.replace('.', '_')))
+        self.logger.setLevel(logging.DEBUG)
 
-        # create formatter and add it to the handlers
-        formatter = logging.Formatter('%(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        ch.setFormatter(formatter)
+        # create file handler which logs even debug messages; an instance for the same directory reuses it
+        log_dir = os.path.join(self.output_dir, 'log')
+        if not os.path.isdir(log_dir):
+            os.mkdir(log_dir)
 
-        # add the handlers to the logger
-        self.logger.addHandler(fh)
-        self.logger.addHandler(ch)
+        self.log_handler = add_queued_file_handler(self.logger, os.path.join(log_dir, 'CreatePatranInputFile.py.log'),
+                                                   formatter=logging.Formatter('%(levelname)s - %(message)s'),
+                                                   level=logging.DEBUG)
 
         self.logger.info("=======================================")
         self.logger.info("New CreatePatranInputFile.py execution.")
         self.logger.info("=======================================")
 
+    def close(self):
+        """Write out and close this instance's log file."""
+
+        if self.log_handler is not None:
+            remove_queued_handler(self.logger)
+            self.log_handler = None
+
+    def resolve_path(self, path):
+        return os.path.normpath(os.path.join(self.output_dir, path))
+
     def failure(self, failure_message=None):
 
         if failure_message is None:
@@ -195,10 +331,26 @@ class PatranPCL():
 
         self.logger.error(failure_message)
 
-        with open("_FAILED.txt", 'w') as f_out:
+        with open(os.path.join(self.output_dir, "_FAILED.txt"), 'w') as f_out:
             f_out.writelines(failure_message)
 
-        sys.exit(99)
+        raise PatranPCLError(failure_message)
+
+    def problem(self, message):
+        """Record an input problem and carry on, so check() can report them all at once."""
+
+        self.logger.error(message)
+        self.problems.append(message)
+
+    def check(self):
+        """Validate the model before Patran is started; raise PatranPCLError listing every problem."""
+
+        problems = validate_model(self)
+
+        if problems:
+            self.failure("{} problem(s) in the model:\n    {}".format(len(problems), '\n    '.join(problems)))
+
+        self.logger.info("Model checked; no problems found")
 
     def get_metrics_from_computed_values(self, cv_path):
 
@@ -241,7 +393,11 @@ class PatranPCL():
         cam_tree = letree.parse(cam_path)
         cam_root = cam_tree.getroot()
 
-        cad_component_string = ".//CADComponent[@MetricID='{}']"
+        # One pass over the CADComponents; a find() per part is quadratic in the part count
+        cad_components_by_metric_id = {}
+
+        for cad_component_node in cam_root.iter('CADComponent'):
+            cad_components_by_metric_id.setdefault(cad_component_node.get('MetricID'), cad_component_node)
 
         metric_comp_string = "MetricComponents/MetricComponent[@Type='PART']"
         self.logger.info("Searching for {} ".format(metric_comp_string))
@@ -254,8 +410,7 @@ class PatranPCL():
             material_node = mc_node.find("Material")
             material_type = material_node.attrib['Type']
 
-            linked_cad_component_string = cad_component_string.format(metric_id)
-            cad_component_node = cam_root.find(linked_cad_component_string)
+            cad_component_node = cad_components_by_metric_id[metric_id]
 
             comp_instance_id = cad_component_node.attrib['ComponentInstanceID']
 
@@ -273,7 +428,12 @@ class PatranPCL():
 
         for metric_node in metrics_for_points:
             metric_id = metric_node.attrib['MetricID']
-            point_details = self.cv_metrics_by_id[metric_id]
+            point_details = self.cv_metrics_by_id.get(metric_id)
+
+            if point_details is None:
+                self.problem("POINTCOORDINATES MetricID {} not found in ComputedValues.xml".format(metric_id))
+                continue
+
             point_details['ID'] = str(id_counter)
 
             self.points_by_metric_id[metric_id] = point_details
@@ -298,10 +458,16 @@ class PatranPCL():
 
             xml_node_text = letree.tostring(feature_element)
 
+            point = self.points_by_metric_id.get(metric_id)
+
+            if point is None:
+                self.problem("No point for Geometry Feature with MetricID {}".format(metric_id))
+                point = {'ID': '000{}'.format(line_number_as_pcl_comment())}
+
             self.geometries_by_metric_id[metric_id] = {
                 'ID': str(id_counter),
                 'Type': 'FACE',
-                'Point_ID': self.points_by_metric_id[metric_id]['ID'],  # get point id from metric id
+                'Point_ID': point['ID'],  # get point id from metric id
                 'Comments': '(MetricID={})'.format(metric_id),
                 'XML_Text': xml_node_text
             }
@@ -330,7 +496,7 @@ class PatranPCL():
                     'Comments': "(MetricID={})".format(metric_id),
                     'XML_Text': xml_node_text,
                     'ID': id_counter,
-                    'Geometry_ID': self.geometries_by_metric_id[metric_id]['ID'],  # get Geometry_ID based on MetricID
+                    'Geometry_ID': self.get_geometry_id(metric_id, 'Surface'),  # get Geometry_ID based on MetricID
                     'Element_Type': '$Surface_Element_Type',
                     'Mesh_Parameters_ID': '$Surface_Mesh_Parameters_ID'
                 }
@@ -339,6 +505,16 @@ class PatranPCL():
 
                 id_counter += 1
 
+    def get_geometry_id(self, metric_id, referenced_by):
+
+        geometry = self.geometries_by_metric_id.get(metric_id)
+
+        if geometry is None:
+            self.problem("{} references MetricID {}, which has no Geometry".format(referenced_by, metric_id))
+            return '000{}'.format(line_number_as_pcl_comment())
+
+        return geometry['ID']
+
     def get_constraint_specifiers(self):
 
         analysis_constraint_string = "Assembly/Analyses/FEA/AnalysisConstraints/AnalysisConstraint/"
@@ -488,7 +664,7 @@ class PatranPCL():
         xml_node_text = letree.tostring(feature_node)
 
         metric_id = feature_node.attrib['MetricID']
-        geometry_id = self.geometries_by_metric_id[metric_id]['ID']
+        geometry_id = self.get_geometry_id(metric_id, 'Constraint')
 
         id_counter = len(self.constraints_by_id)
         id_counter += 1
@@ -496,7 +672,7 @@ class PatranPCL():
         constraint = {
             'ID': str(id_counter),
             'Type': 'DISPLACEMENT{}'.format(line_number_as_pcl_comment()),
-            'SubCase_ID': '1{}'.format(line_number_as_pcl_comment()),
+            'SubCase_ID': '1  # Constraints are shared by all subcases',
             'Geometry_ID': geometry_id,
             'Displacement_ID': displacement_id,
             'Comments': "Feature Node _id:{}".format(feature_node.attrib['_id']),
@@ -506,19 +682,24 @@ class PatranPCL():
         self.constraints_by_id[id_counter] = constraint
 
     def get_mesh_parameters(self):
+        """One Mesh_Parameters set per distinct mesh density, assigned per Solid.
+
+        A MeshParameters node without a ComponentID is the default set (ID 1). A node with a
+        ComponentID applies to that part only. Parts with neither get the default set, or, when
+        Assembly/Analyses/FEA/Metrics names the parts whose results are wanted (a metric on an
+        assembly wants all of its parts) and far_field_length_factor is set, the far-field set:
+        the default with Max_Global_Length scaled by far_field_length_factor."""
 
         mesh_param_string = "Assembly/Analyses/FEA/MeshParameters"
 
-        # First or default
         self.logger.info("Searching for {} ".format(mesh_param_string))
         mesh_params_list = self.cad_assm_root.findall(mesh_param_string)
         comment = '{}.'.format(mesh_param_string)
 
-        max_global_length = '0.101{}'.format(line_number_as_pcl_comment())
-        max_curv_delta = '0.102{}'.format(line_number_as_pcl_comment())
-        ratio_min_to_max = '0.201{}'.format(line_number_as_pcl_comment())
-        match_face_prox = '0.0501{}'.format(line_number_as_pcl_comment())
-        xml_node_text = 'None'
+        default_nodes = [mp for mp in mesh_params_list if mp.get('ComponentID') is None]
+        component_nodes = [mp for mp in mesh_params_list if mp.get('ComponentID') is not None]
+
+        self.mesh_parameters = {}
 
         if len(mesh_params_list) == 0:
 
@@ -526,33 +707,121 @@ class PatranPCL():
             comment += '  ' + warning_msg
             self.logger.warning(warning_msg)
 
-        if len(mesh_params_list) > 0:
+            self.add_mesh_parameters(None, comment, {
+                'Max_Global_Length': '0.101{}'.format(line_number_as_pcl_comment()),
+                'Max_Curv_Delta_Div_Edge_Len': '0.102{}'.format(line_number_as_pcl_comment()),
+                'Ratio_Min_Edge_To_Max_Edge': '0.201{}'.format(line_number_as_pcl_comment()),
+                'Match_Face_Proximity_Tol': '0.0501{}'.format(line_number_as_pcl_comment())
+            })
 
-            if len(mesh_params_list) > 1:
-                comment += ' Multiple MeshParameters nodes.'
+        else:
+            if len(default_nodes) > 1:
+                comment += ' Multiple default MeshParameters nodes; using the first.'
 
-                for mp in mesh_params_list:
+                for mp in default_nodes:
                     comment += "\n    #_id: {}".format(mp.attrib['_id'])
 
-            self.pcl_globals['Surface_Mesh_Parameters_ID'] = "1{}".format(line_number_as_pcl_comment())
+            # Without a default node, the first per-component node also serves as the default
+            default_node = default_nodes[0] if default_nodes else mesh_params_list[0]
+            self.add_mesh_parameters(default_node, comment)
 
-            mesh_params_node = mesh_params_list[0]
-            xml_node_text = letree.tostring(mesh_params_node)
+        self.pcl_globals['Surface_Mesh_Parameters_ID'] = "1{}".format(line_number_as_pcl_comment())
+
+        default_id = 1
+        mesh_parameters_id_by_component = {}
+
+        for mp in component_nodes:
+            mesh_parameters_id_by_component[mp.attrib['ComponentID']] = self.add_mesh_parameters(
+                mp, 'ComponentID {}'.format(mp.attrib['ComponentID']))
+
+        critical_string = "Assembly/Analyses/FEA/Metrics/Metric[@ComponentID]"
+        self.logger.info("Searching for {} ".format(critical_string))
+        critical_ids = self.part_ids(m.attrib['ComponentID'] for m in self.cad_assm_root.findall(critical_string))
+
+        far_field_id = None
+
+        for solid in self.solids.values():
+            component_id = solid['ComponentID']
+
+            if component_id in mesh_parameters_id_by_component:
+                solid['Mesh_Parameters_ID'] = mesh_parameters_id_by_component[component_id]
+
+            elif critical_ids and component_id not in critical_ids and self.far_field_length_factor:
+                if far_field_id is None:
+                    far_field_id = self.add_far_field_mesh_parameters(self.mesh_parameters[default_id])
+                solid['Mesh_Parameters_ID'] = far_field_id
+
+            else:
+                solid['Mesh_Parameters_ID'] = default_id
+
+        self.logger.info("{} Mesh_Parameters set(s) for {} solid(s)".format(
+            len(self.mesh_parameters), len(self.solids)))
+
+    def part_ids(self, component_ids):
+        """The ComponentIDs of the parts among component_ids, and of the parts in the assemblies
+        among them."""
+
+        component_ids = set(component_ids)
+        part_ids = set()
+
+        for cc in self.cad_assm_root.iter('CADComponent'):
+            if cc.get('ComponentID') not in component_ids:
+                continue
+
+            if cc.get('Type') == 'ASSEMBLY':
+                part_ids.update(child.get('ComponentID') for child in cc.iter('CADComponent')
+                                if child.get('Type') == 'PART')
+            else:
+                part_ids.add(cc.get('ComponentID'))
+
+        return part_ids
 
-            max_global_length = mesh_params_node.attrib['Max_Global_Length']
-            max_curv_delta = mesh_params_node.attrib['Max_Curv_Delta_Div_Edge_Len']
-            ratio_min_to_max = mesh_params_node.attrib['Ratio_Min_Edge_To_Max_Edge']
-            match_face_prox = mesh_params_node.attrib['Match_Face_Proximity_Tol']
+    def add_mesh_parameters(self, mesh_params_node, comment, values=None):
 
-        self.mesh_parameters = {
+        mesh_parameters_id = len(self.mesh_parameters) + 1
+
+        if mesh_params_node is not None:
+            values = dict((name, mesh_params_node.get(name)) for name in MESH_PARAMETER_NAMES)
+            xml_node_text = letree.tostring(mesh_params_node)
+        else:
+            xml_node_text = 'None'
+
+        mesh_parameters = {
             'Comments': comment,
             'XML_Text': xml_node_text,
-            'ID': "1{}".format(line_number_as_pcl_comment()),
-            'Max_Global_Length': max_global_length,
-            'Max_Curv_Delta_Div_Edge_Len': max_curv_delta,
-            'Ratio_Min_Edge_To_Max_Edge': ratio_min_to_max,
-            'Match_Face_Proximity_Tol': match_face_prox
+            'ID': mesh_parameters_id
         }
+        mesh_parameters.update(values)
+
+        self.mesh_parameters[mesh_parameters_id] = mesh_parameters
+
+        return mesh_parameters_id
+
+    def add_far_field_mesh_parameters(self, default_parameters):
+
+        max_global_length = pcl_number(default_parameters['Max_Global_Length'])
+
+        if max_global_length is None:
+            return default_parameters['ID']  # validate_model reports the bad length
+
+        values = dict((name, default_parameters[name]) for name in MESH_PARAMETER_NAMES)
+        values['Max_Global_Length'] = max_global_length * self.far_field_length_factor
+
+        comment = "Far field: parts without FEA metrics, Max_Global_Length x {}".format(self.far_field_length_factor)
+        self.logger.info(comment)
+
+        return self.add_mesh_parameters(None, comment, values)
+
+    def scale_mesh_parameters(self, length_factor):
+        """Multiply Max_Global_Length of every Mesh_Parameters set by length_factor
+        (e.g. < 1 to refine the mesh)."""
+
+        for mesh_parameters in self.mesh_parameters.values():
+            max_global_length = pcl_number(mesh_parameters['Max_Global_Length'])
+            if max_global_length is not None:
+                mesh_parameters['Max_Global_Length'] = max_global_length * length_factor
+
+        self.logger.info("Max_Global_Length scaled by {}".format(length_factor))
 
     def get_analysis(self):
 
@@ -596,6 +865,154 @@ class PatranPCL():
             'XML_Text': xml_node_text
         }
 
+    def defer_solve(self):
+        """Have Patran write the Nastran deck without running it (MESH_AND_DECK), so the
+        caller can check the mesh before solving. Returns True if the solve was deferred."""
+
+        if self.analysis.get('Instructions') != 'MESH_AND_SOLVE':
+            return False
+
+        self.analysis['Instructions'] = 'MESH_AND_DECK'
+        self.logger.info("Instructions changed to MESH_AND_DECK; Nastran will be run by the caller")
+
+        return True
+
+    def model_state(self):
+        """The resolved model, split into the values a Nastran restart can change ('Values') and
+        everything else ('Model'). Run-specific Analysis entries (Date, Instructions) are left out."""
+
+        analysis = dict((k, v) for k, v in self.analysis.items() if k not in ['Date', 'Instructions'])
+
+        sections = normalize_state({
+            'Analysis': analysis,
+            'Files': self.pcl_globals,
+            'Point': self.points_by_metric_id,
+            'Geometry': self.geometries_by_metric_id,
+            'Surface': self.surfaces_by_metric_id,
+            'Mesh_Parameters': self.mesh_parameters,
+            'Solid': self.solids,
+            'Material': self.materials,
+            'Layer': self.layers,
+            'Material_Layup': self.layups,
+            'SubCase': self.subcases,
+            'Load': self.loads,
+            'Load_Value_Scalar': self.load_values['Scalar'],
+            'Load_Value_Vector': self.load_values['Vector'],
+            'Constraint': self.constraints_by_id,
+            'Constraint_Specifier_Displacement': self.constraint_specifiers['Displacement'],
+            'Constraint_Specifier_Pin': self.constraint_specifiers['Pin'],
+            'Surface_Contents': self.surface_contents
+        })
+
+        return {
+            'Model': dict((k, v) for k, v in sections.items() if k not in RESTART_VALUE_SECTIONS),
+            'Values': dict((k, v) for k, v in sections.items() if k in RESTART_VALUE_SECTIONS)
+        }
+
+    def write_model_state(self, output_path=None):
+
+        if output_path is None:
+            output_path = os.path.join(self.output_dir, MODEL_STATE_FILE_NAME)
+
+        with open(output_path, 'w') as f_out:
+            json.dump(self.model_state(), f_out, indent=4, sort_keys=True)
+
+        return output_path
+
+    def restart_loads(self, previous_state):
+        """If this model differs from previous_state (a model_state) only in pressure values and
+        fixed DOFs, return its patran_load_values. Otherwise return None."""
+
+        state = self.model_state()
+        model, previous_model = state['Model'], previous_state.get('Model', {})
+
+        changed = sorted(name for name in set(model) | set(previous_model)
+                         if model.get(name) != previous_model.get(name))
+
+        if changed:
+            self.logger.info("No Nastran restart, the model changed: {}".format(', '.join(changed)))
+            return None
+
+        changed = [name for name in RESTART_VALUE_SECTIONS
+                   if state['Values'][name] != previous_state.get('Values', {}).get(name)]
+        self.logger.info("Nastran restart possible; changed: {}".format(', '.join(changed) or 'nothing'))
+
+        return self.patran_load_values(state)
+
+    def patran_load_values(self, state=None):
+        """The pressure of every PRESSURE load and the fixed DOFs (e.g. '123') of every DISPLACEMENT
+        constraint, keyed by load and constraint ID: the values to set in a deck Patran wrote for
+        the same loads on the same geometry. None if a constraint enforces a value or fixes nothing."""
+
+        if state is None:
+            state = self.model_state()
+
+        model = state['Model']
+        load_values = dict((v['ID'], v) for v in state['Values']['Load_Value_Scalar'].values())
+        pressures = {}
+
+        for load in model['Load'].values():
+            if load['Type'] == 'PRESSURE':
+                pressures[load['ID']] = float(load_values[load['Load_Value_ID']]['Scalar_Value'])
+
+        fixed_dofs = {}
+
+        for displacement in state['Values']['Constraint_Specifier_Displacement'].values():
+            if any(displacement.get(name + '_Val') not in [None, 'None'] for name, _ in DOF_COMPONENTS):
+                self.logger.info("Displacement {} enforces a value".format(displacement['ID']))
+                return None
+
+            fixed_dofs[displacement['ID']] = ''.join(
+                component for name, component in DOF_COMPONENTS if displacement.get(name + '_State') == 'FIXED')
+
+        fixed_components = {}
+
+        for constraint in model['Constraint'].values():
+            if constraint['Type'] == 'DISPLACEMENT':
+                components = fixed_dofs.get(constraint['Displacement_ID'])
+                if not components:
+                    self.logger.info("Constraint {} fixes nothing".format(constraint['ID']))
+                    return None
+                fixed_components[constraint['ID']] = components
+
+        return pressures, fixed_components
+
+    def mesh_key_state(self, state=None):
+        """The parts of model_state that Patran's deck depends on, less the values a deck for the
+        same mesh can be given afterwards (loads, constraints and isotropic material properties)."""
+
+        if state is None:
+            state = self.model_state()
+
+        # The geometry file is keyed by its contents, not its name or location
+        key_state = dict((k, v) for k, v in state['Model'].items() if k != 'Files')
+        key_state['Analysis'] = dict((k, v) for k, v in key_state['Analysis'].items() if k in ['Type', 'Solver'])
+
+        if all(material.get('Tropic_Type') == 'ISOTROPIC' for material in key_state['Material'].values()):
+            key_state['Material'] = sorted(material['ID'] for material in key_state['Material'].values())
+
+        return key_state
+
+    def patran_material_values(self, state=None):
+        """Properties of the isotropic materials solids and layers use, keyed by Material ID,
+        as MAT1 E, NU, RHO and A."""
+
+        if state is None:
+            state = self.model_state()
+
+        used = set(item['Material_ID'] for section in ['Solid', 'Layer'] for item in state['Model'][section].values())
+
+        return dict((material['ID'], [pcl_number(material.get(name)) for name in
+                                      ['Elastic_Modulus', 'Poissons_Ratio', 'Density', 'Therm_Expan_Coef']])
+                    for material in state['Model']['Material'].values()
+                    if material.get('Tropic_Type') == 'ISOTROPIC' and material['ID'] in used)
+
+    def geometry_path(self):
+
+        # Geometry_File_Dir is written for Patran on Windows
+        geometry_dir = self.pcl_globals['Geometry_File_Dir'].replace('\\', os.sep)
+        return os.path.join(self.output_dir, geometry_dir, self.pcl_globals.get('Geometry_File_Name', ''))
+
     def get_assembly_name(self):
 
         cad_assembly_string = ".//CADComponent[@Type='ASSEMBLY']"
@@ -625,9 +1042,14 @@ class PatranPCL():
                 self.is_surface_model = False
 
                 material_name = self.cam_materials_by_comp_id.get(cad_component_id, None)
-                material_id = self.get_material_data(material_name)
 
-                self.add_solid(material_id)
+                if material_name is None:
+                    self.problem("ComponentID {} has no material in CADAssembly_metrics.xml".format(cad_component_id))
+                    material_id = '000{}'.format(line_number_as_pcl_comment())
+                else:
+                    material_id = self.get_material_data(material_name)
+
+                self.add_solid(material_id, cad_component_id)
 
             else:
                 self.get_layup(cad_component_id, layup_node)
@@ -635,17 +1057,18 @@ class PatranPCL():
                 if element_node is not None:
                     self.get_surface_contents(cad_component_id, element_node)
 
-    def add_solid(self, material_id):
+    def add_solid(self, material_id, cad_component_id):
 
-        num_solids = len(self.solids.keys())
+        num_solids = len(self.solids)
         solid_id = num_solids + 1
 
         solid = {
-            'Comments': 'Element_Type is Hard-Coded; Only 1 Mesh_Parameters supported (6/1/2016).',
+            'Comments': 'Element_Type is Hard-Coded; ComponentID: {}'.format(cad_component_id),
+            'ComponentID': cad_component_id,
             'ID': solid_id,
             'Element_Type': 'TETRA10{}'.format(line_number_as_pcl_comment()),
             'Material_ID': material_id,
-            'Mesh_Parameters_ID': '1  # "There can be only one."'
+            'Mesh_Parameters_ID': 1  # Assigned per component in get_mesh_parameters
         }
 
         self.solids[solid_id] = solid
@@ -703,15 +1126,16 @@ class PatranPCL():
         data = self.material_library.get(material_name.lower(), None)
 
         if data is None:
-            self.logger.error("Material lookup needs attention: {}".format(material_name))
+            self.problem("Material not in the material library: {}".format(material_name))
+            data = {}
 
-        num_materials = len(self.materials.keys())
+        num_materials = len(self.materials)
         material_id = num_materials + 1
 
-        elastic_modulus_pa = data['mechanical__modulus_elastic']['value']
+        elastic_modulus_pa = data.get('mechanical__modulus_elastic', {}).get('value')
         try:
             elastic_modulus = elastic_modulus_pa/1000000.  # convert from Pa to MPa
-        except ValueError:
+        except (TypeError, ValueError):
             self.logger.warning("Could not convert Elastic Modulus to MPa: {}".format(line_number_of_problem()))
             elastic_modulus = '{}{}'.format(elastic_modulus_pa, line_number_as_pcl_comment())
 
@@ -726,11 +1150,11 @@ class PatranPCL():
             'Elastic_Modulus': '{}{}'.format(
                 elastic_modulus, line_number_as_pcl_comment()),
             'Poissons_Ratio': '{}{}'.format(
-                data['mechanical__ratio_poissons']['value'], line_number_as_pcl_comment()),
+                data.get('mechanical__ratio_poissons', {}).get('value'), line_number_as_pcl_comment()),
             'Density': '{}{}'.format(
-                data['density']['value'], line_number_as_pcl_comment()),
+                data.get('density', {}).get('value'), line_number_as_pcl_comment()),
             'Therm_Expan_Coef': '{}{}'.format(
-                data['thermal__coefficient_expansion_linear']['value'], line_number_as_pcl_comment())
+                data.get('thermal__coefficient_expansion_linear', {}).get('value'), line_number_as_pcl_comment())
         }
 
         self.materials[material_name] = material
@@ -815,65 +1239,110 @@ class PatranPCL():
         pass
 
     def get_loads(self):
+        """Each Assembly/Analyses/FEA/Loads node is one load set and becomes one SUBCASE of the
+        deck. All subcases share the mesh and the constraints, so Nastran decomposes the
+        stiffness matrix once and solves every load set against it."""
 
-        load_string = "Assembly/Analyses/FEA/Loads/Load"
-        self.logger.info("Searching for {} ".format(load_string))
-        load_nodes = self.cad_assm_root.findall(load_string)
+        loads_string = "Assembly/Analyses/FEA/Loads"
+        self.logger.info("Searching for {} ".format(loads_string))
+        load_set_nodes = self.cad_assm_root.findall(loads_string)
 
-        load_id_counter = 0
-        load_value_id = '000{}'.format(line_number_as_pcl_comment())
+        if len(load_set_nodes) == 0:
+            self.logger.warning("No Loads node found in CADAssembly.xml")
+            self.add_subcase(None)
 
-        for l_node in load_nodes:
-            load_id_counter += 1
+        for load_set_node in load_set_nodes:
+            subcase_id = self.add_subcase(load_set_node)
 
-            load_type = ''
-            load_comments = ""
-            metric_id = '000{}'.format(line_number_as_pcl_comment())
-            geometry_id = '000{}'.format(line_number_as_pcl_comment())
+            for l_node in load_set_node.findall("Load"):
+                load_id = self.get_load(l_node, subcase_id)
+                self.subcases[subcase_id]['Load_IDs'].append(load_id)
 
-            for child_node in l_node:
-                if child_node.tag == 'Pressure':
-                    load_type = 'PRESSURE'
-                    load_value_id = self.get_load_value('Pressure', child_node)
-                elif child_node.tag == 'Force':
-                    load_type = 'FORCE'
-                    load_value_id = self.get_load_value('Force', child_node)
-                elif child_node.tag == 'ForceMoment':  # TODO
-                    load_type = 'FORCEMOMENT'
-                    load_value_id = self.get_load_value('ForceMoment', child_node)
-                elif child_node.tag == 'Geometry':
-                    self.logger.info("Searching for {} ".format("Features/Feature"))
-                    feature_nodes = child_node.findall("Features/Feature")
+        for subcase in self.subcases.values():
+            load_ids = subcase.pop('Load_IDs')
+            subcase['Load_ID'] = load_ids[0] if load_ids else '0  # No loads in this load set'
 
-                    if len(feature_nodes) > 1:
-                        msg = "Red Alert: Multiple Features for one 'Load' node!"
+        self.logger.info("{} subcase(s), {} load(s)".format(len(self.subcases), len(self.loads)))
 
-                        load_comments += msg
+    def add_subcase(self, load_set_node):
 
-                        for f in feature_nodes:
-                            msg += "\n    _id: {}".format(f.attrib['_id'])
+        subcase_id = len(self.subcases) + 1
 
-                        self.logger.error(msg)
+        if load_set_node is None:
+            comments = "Default subcase; no Loads node{}".format(line_number_as_pcl_comment())
+            xml_node_text = 'None'
+        else:
+            comments = "Load set {}".format(load_set_node.get('Name', load_set_node.get('_id', subcase_id)))
+            xml_node_text = letree.tostring(load_set_node)
 
-                    feature_node = feature_nodes[0]
-                    metric_id = feature_node.attrib['MetricID']
-                    load_comments += "(MetricID: {})".format(metric_id)
-                    associated_geometry = self.geometries_by_metric_id[metric_id]
-                    geometry_id = associated_geometry['ID']
+        constraint_ids = sorted(self.constraints_by_id.keys())
 
-            xml_node_text = letree.tostring(l_node)
+        self.subcases[subcase_id] = {
+            'Comments': comments,
+            'XML_Text': xml_node_text,
+            'ID': subcase_id,
+            'Constraint_ID': constraint_ids[0] if constraint_ids else '0  # No constraints',
+            'Load_IDs': []
+        }
 
-            load = {
-                'Comments': load_comments,
-                'XML_Text': xml_node_text,
-                'ID': load_id_counter,
-                'Type': load_type,
-                'SubCase_ID': '1{}'.format(line_number_as_pcl_comment()),
-                'Geometry_ID': geometry_id,
-                'Load_Value_ID': load_value_id,
-            }
+        return subcase_id
 
-            self.loads[metric_id] = load
+    def get_load(self, l_node, subcase_id):
+
+        load_id_counter = len(self.loads)
+        load_id_counter += 1
+
+        load_type = ''
+        load_comments = ""
+        load_value_id = '000{}'.format(line_number_as_pcl_comment())
+        metric_id = '000{}'.format(line_number_as_pcl_comment())
+        geometry_id = '000{}'.format(line_number_as_pcl_comment())
+
+        for child_node in l_node:
+            if child_node.tag == 'Pressure':
+                load_type = 'PRESSURE'
+                load_value_id = self.get_load_value('Pressure', child_node)
+            elif child_node.tag == 'Force':
+                load_type = 'FORCE'
+                load_value_id = self.get_load_value('Force', child_node)
+            elif child_node.tag == 'ForceMoment':  # TODO
+                load_type = 'FORCEMOMENT'
+                load_value_id = self.get_load_value('ForceMoment', child_node)
+            elif child_node.tag == 'Geometry':
+                self.logger.info("Searching for {} ".format("Features/Feature"))
+                feature_nodes = child_node.findall("Features/Feature")
+
+                if len(feature_nodes) > 1:
+                    msg = "Red Alert: Multiple Features for one 'Load' node!"
+
+                    load_comments += msg
+
+                    for f in feature_nodes:
+                        msg += "\n    _id: {}".format(f.attrib['_id'])
+
+                    self.logger.error(msg)
+
+                feature_node = feature_nodes[0]
+                metric_id = feature_node.attrib['MetricID']
+                load_comments += "(MetricID: {})".format(metric_id)
+                geometry_id = self.get_geometry_id(metric_id, 'Load')
+
+        xml_node_text = letree.tostring(l_node)
+
+        load = {
+            'Comments': load_comments,
+            'XML_Text': xml_node_text,
+            'ID': load_id_counter,
+            'Type': load_type,
+            'SubCase_ID': subcase_id,
+            'Geometry_ID': geometry_id,
+            'Load_Value_ID': load_value_id,
+        }
+
+        # Keyed by ID, not MetricID: the same face may be loaded in more than one load set
+        self.loads[load_id_counter] = load
+
+        return load_id_counter
 
     def get_load_value(self, type_name, load_value_node):
 
@@ -957,26 +1426,19 @@ class PatranPCL():
 
         return block_string
 
-    def create_pcl_input_file(self, copy_xml_text):
-
-        line_ending = '\n'
-
-        singles = {
-            'Analysis': self.analysis,
-            'Mesh_Parameters': self.mesh_parameters
-        }
-
-        hard_coded = [
-            'SubCase',
-            'Files'
-        ]
+    def deck_blocks(self):
+        """(block id, template name, indent, source) of each block of the Patran model input, in
+        the order they are written: sections in DECK_SECTIONS order, entries in ID order.
+        source is the model entry the block's placeholders are filled from."""
 
         multiples = {
             'Point': self.points_by_metric_id,
             'Geometry': self.geometries_by_metric_id,
             'Surface': self.surfaces_by_metric_id,
+            'Mesh_Parameters': self.mesh_parameters,
             'Solid': self.solids,
             'Material': self.materials,
+            'SubCase': self.subcases,
             'Load': self.loads,
             'Load_Value_Scalar': self.load_values['Scalar'],
             'Load_Value_Vector': self.load_values['Vector'],
@@ -986,88 +1448,253 @@ class PatranPCL():
             'Surface_Contents': self.surface_contents
         }
 
-        specials = {
-            'Material_Layup': self.layups
-        }
+        blocks = []
 
-        block_list = []
-        pcl_input_string = ""
+        for section in DECK_SECTIONS:
+            if section == 'Analysis':
+                blocks.append((section, section, '', self.analysis))
 
-        # Singles
-        for template_name, replacement_map in singles.iteritems():
-            block_string = \
-                self.create_pcl_text_block(self.pcl_template_json[template_name], copy_xml_text=copy_xml_text)
-            template = string.Template(block_string)
-            block_string = template.safe_substitute(replacement_map)
+            elif section == 'Files':
+                # Hard-coded; its placeholders are pcl_globals, filled in over the whole file
+                blocks.append((section, section, '', None))
 
-            block_list.append(block_string)
-            pcl_input_string += block_string + line_ending
+            elif section == 'Material_Layup':
+                for cad_comp_id in sorted(self.layups, key=entry_order):
+                    layup_details = self.layups[cad_comp_id]
+                    blocks.append(('{}/{}'.format(section, cad_comp_id), section, '', layup_details))
 
-        # Hard-coded
-        for template_name in hard_coded:
-            block_string = \
-                self.create_pcl_text_block(self.pcl_template_json[template_name], copy_xml_text=copy_xml_text)
+                    for l_id in layup_details['LayerIDs']:
+                        blocks.append(('Layer/{}'.format(l_id), 'Layer', '    ', self.layers[l_id]))
 
-            block_list.append(block_string)
-            pcl_input_string += block_string + line_ending
+            else:
+                entries = multiples[section]
+                for key in sorted(entries, key=entry_order):
+                    blocks.append(('{}/{}'.format(section, key), section, '', entries[key]))
+
+        return blocks
 
-        # Multiples
-        for template_name, pcl_var in multiples.iteritems():
-            for key, replacement_map in pcl_var.iteritems():
-                block_string = \
-                    self.create_pcl_text_block(self.pcl_template_json[template_name], copy_xml_text=copy_xml_text)
-                template = string.Template(block_string)
-                block_string = template.safe_substitute(replacement_map)
+    def render_block(self, template_name, indent, source, copy_xml_text, raw_blocks):
+        """The text of one block. raw_blocks caches the unfilled template text per template and indent."""
 
-                # TODO: Remove lines with 'None'
-                if template_name == 'Constraint_Specifier_Displacement':
-                    block_string, deleted = remove_lines_with_none(block_string)
-                    self.logger.info("Lines removed from {}: {}".format(template_name, deleted))
+        line_ending = '\n'
 
-                block_list.append(block_string)
-                pcl_input_string += block_string + line_ending
+        if template_name == 'Material_Layup':
+            return template_name + line_ending + '    ' + "ID = {}".format(source['ID']) + line_ending
 
-        # Specials
-        for template_name, pcl_var in specials.iteritems():
-            if template_name == 'Material_Layup':
-                section_indent = '    '
+        raw_key = (template_name, indent)
 
-                for cad_comp_id, layup_details in self.layups.iteritems():
-                    pcl_input_string += template_name + line_ending
-                    pcl_input_string += section_indent + "ID = {}".format(layup_details['ID']) + line_ending
+        if raw_key not in raw_blocks:
+            raw_blocks[raw_key] = self.create_pcl_text_block(self.pcl_template_json[template_name], indent,
+                                                             copy_xml_text=copy_xml_text)
 
-                    for l_id in layup_details['LayerIDs']:
-                        # 1st pass: get raw template string
-                        block_string = \
-                            self.create_pcl_text_block(
-                                self.pcl_template_json['Layer'], section_indent, copy_xml_text=copy_xml_text)
+        block_string = raw_blocks[raw_key]
+
+        if source is not None:
+            block_string = string.Template(block_string).safe_substitute(source)
+
+        # TODO: Remove lines with 'None'
+        if template_name == 'Constraint_Specifier_Displacement':
+            block_string, deleted = remove_lines_with_none(block_string)
+            self.logger.info("Lines removed from {}: {}".format(template_name, deleted))
+
+        return block_string + line_ending
+
+    def create_pcl_input_file(self, copy_xml_text, output_path=None, snapshot=None):
+        """Write the Patran model input file to output_path (default:
+        <output_dir>/CreatePatranModelInput.txt) and return its path.
+
+        snapshot, a dict kept between calls (as -watch does), remembers the blocks written, so
+        the next call renders only the blocks whose model entries changed, and leaves the file
+        alone if nothing in it did."""
+
+        if output_path is None:
+            output_path = os.path.join(self.output_dir, self.patran_input_file_name)
+
+        previous_blocks, previous_deck_hash = {}, None
+
+        if snapshot is not None:
+            template_hash = content_hash([self.pcl_template_json, copy_xml_text, output_path])
+            if snapshot.get('Template') == template_hash:
+                previous_blocks, previous_deck_hash = snapshot['Blocks'], snapshot['Deck']
 
-                        # 2nd pass: replace placeholders with object instance data
-                        template = string.Template(block_string)
-                        replacement_map = self.layers[l_id]
-                        block_string = template.safe_substitute(replacement_map)
+        blocks = {}
+        rendered = []
+        raw_blocks = {}
 
-                        block_list.append(block_string)
-                        pcl_input_string += block_string + line_ending
+        # What the deck is made from; the Analysis block's Date alone does not make it a new deck
+        deck_sources = [sorted(self.pcl_globals.items()), sorted((k, v) for k, v in self.analysis.items() if k != 'Date')]
 
-            elif template_name == 'Surface_Contents':
-                block_string = \
-                    self.create_pcl_text_block(self.pcl_template_json[template_name], copy_xml_text=copy_xml_text)
+        # Joined once at the end; appending to one growing string is quadratic for large assemblies
+        pcl_input_parts = []
 
-                block_list.append(block_string)
-                pcl_input_string += block_string + line_ending
+        for block_id, template_name, indent, source in self.deck_blocks():
+            if snapshot is None:
+                pcl_input_parts.append(self.render_block(template_name, indent, source, copy_xml_text, raw_blocks))
+                continue
+
+            source_hash = content_hash(source)
+            previous = previous_blocks.get(block_id)
+
+            if previous is not None and previous[0] == source_hash:
+                block_string = previous[1]
+            else:
+                block_string = self.render_block(template_name, indent, source, copy_xml_text, raw_blocks)
+                rendered.append(block_id)
+
+            blocks[block_id] = [source_hash, block_string]
+            pcl_input_parts.append(block_string)
+
+            if block_id != 'Analysis':
+                deck_sources.append([block_id, source_hash])
+
+        if snapshot is not None:
+            removed = [block_id for block_id in previous_blocks if block_id not in blocks]
+            deck_hash = content_hash(deck_sources)
+
+            if previous_blocks:
+                self.logger.info("Rendered {} of {} blocks, {} removed: {}".format(
+                    len(rendered), len(blocks), len(removed), ', '.join(rendered + removed)[:1000]))
+
+            snapshot.update({'Template': template_hash, 'Blocks': blocks, 'Deck': deck_hash})
+
+            if deck_hash == previous_deck_hash and os.path.exists(output_path):
+                self.logger.info("{} is unchanged".format(output_path))
+                return output_path
+
+        pcl_input_string = ''.join(pcl_input_parts)
 
         global_template = string.Template(pcl_input_string)
         pcl_input_string = global_template.safe_substitute(self.pcl_globals)
 
-        with open(self.patran_input_file_name, 'w') as pcl_input_file:
+        with open(output_path, 'w') as pcl_input_file:
             pcl_input_file.write(pcl_input_string)
 
+        return output_path
 
-def main():
 
-    parser = argparse.ArgumentParser(description="reads in CADAssembly.xml, CADAssembly_metrics.xml, "
-                                                 "and ComputedValues.xml and creates a .pcl script for Patran")
+# Set in each batch worker process by init_batch_worker
+_batch_shared = {}
+
+
+def init_batch_worker(material_library, pcl_template_json):
+    _batch_shared['material_library'] = material_library
+    _batch_shared['pcl_template_json'] = pcl_template_json
+
+
+def create_input_in_dir(job):
+    """Pool worker for batch mode: write CreatePatranModelInput.txt in one testbench
+    directory. Returns (output_dir, success, message)."""
+
+    output_dir, options = job
+
+    try:
+        ppcl = PatranPCL(options['cadassembly'],
+                         options['cadassembly_metrics'],
+                         options['computedvalues'],
+                         options['far_field_factor'],
+                         output_dir=output_dir,
+                         material_library=_batch_shared.get('material_library'),
+                         pcl_template_json=_batch_shared.get('pcl_template_json'))
+        try:
+            ppcl.check()
+            return output_dir, True, ppcl.create_pcl_input_file(options['copyxmltext'])
+        finally:
+            ppcl.close()
+
+    except PatranPCLError as e:
+        return output_dir, False, str(e)
+
+    except Exception:
+        import traceback
+        return output_dir, False, traceback.format_exc()
+
+
+def run_batch(output_dirs, options, workers=None):
+    """Create the Patran model input in each directory on a pool of worker processes.
+    The material library and template are loaded once here and handed to every worker."""
+
+    import multiprocessing
+
+    logger = add_console_handler()
+
+    material_library_path = find_material_library_path()
+    if not os.path.exists(material_library_path):
+        logger.error("Material library path invalid: {}".format(os.path.abspath(material_library_path)))
+        return False
+
+    shared = (load_material_library(material_library_path), load_pcl_template())
+
+    pool = multiprocessing.Pool(processes=workers, initializer=init_batch_worker, initargs=shared)
+    try:
+        results = pool.map(create_input_in_dir, [(os.path.abspath(d), options) for d in output_dirs])
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = [(output_dir, message) for output_dir, success, message in results if not success]
+
+    for output_dir, message in failed:
+        logger.error("Failed in {}: {}".format(output_dir, message))
+
+    print("Created the Patran model input in {} of {} directories".format(len(results) - len(failed), len(results)))
+
+    return not failed
+
+
+def file_states(paths):
+    return [(os.stat(path).st_mtime, os.stat(path).st_size) if os.path.exists(path) else None for path in paths]
+
+
+def watch(args):
+    """Recreate the Patran model input whenever an input file changes, until interrupted. The
+    material library and template stay loaded, and only the blocks that changed are rendered."""
+
+    logger = add_console_handler()
+
+    material_library_path = find_material_library_path()
+    paths = [args.cadassembly, args.cadassembly_metrics, args.computedvalues, material_library_path]
+
+    print("Watching {}".format(', '.join(paths)))
+
+    last_states = None
+    snapshot = {}
+
+    while True:
+        states = file_states(paths)
+
+        if states == last_states:
+            time.sleep(WATCH_POLL_SECONDS)
+            continue
+
+        time.sleep(WATCH_SETTLE_SECONDS)
+        if file_states(paths) != states:
+            continue
+
+        if last_states is not None and states[3] != last_states[3]:
+            _json_cache.pop(os.path.abspath(material_library_path), None)
+
+        last_states = states
+        start = time.time()
+
+        try:
+            ppcl = PatranPCL(args.cadassembly, args.cadassembly_metrics, args.computedvalues, args.far_field_factor,
+                             material_library=load_material_library(material_library_path),
+                             pcl_template_json=load_pcl_template())
+            try:
+                ppcl.check()
+                output_path = ppcl.create_pcl_input_file(args.copyxmltext, snapshot=snapshot)
+            finally:
+                ppcl.close()
+
+            print("{} updated in {:.0f} ms".format(output_path, 1000 * (time.time() - start)))
+
+        except Exception as e:
+            # A PatranPCLError, or e.g. a CADAssembly.xml saved half way
+            logger.error("Not updated: {}".format(e))
+
+
+def add_input_arguments(parser):
+
     parser.add_argument('-cadassembly',
                         default="CADAssembly.xml",
                         help="CADAssembly.xml filename")
@@ -1080,17 +1707,69 @@ def main():
     parser.add_argument('-copyxmltext',
                         default=False,
                         help="Copy xml text to PCL input file.")
+    parser.add_argument('-far_field_factor',
+                        type=float,
+                        default=FAR_FIELD_LENGTH_FACTOR,
+                        help="Max_Global_Length multiplier for parts without FEA metrics (default 0: off)")
+
+
+def batch_main(argv):
+
+    parser = argparse.ArgumentParser(description="Create CreatePatranModelInput.txt in several testbench "
+                                                 "directories; input file names are relative to each directory")
+    parser.add_argument('directories', nargs='+', help='Output directories (e.g. Analysis\\Patran_Nastran)')
+    add_input_arguments(parser)
+    parser.add_argument('-workers', type=int, default=None, help='Worker processes')
+    args = parser.parse_args(argv)
+
+    options = {
+        'cadassembly': args.cadassembly,
+        'cadassembly_metrics': args.cadassembly_metrics,
+        'computedvalues': args.computedvalues,
+        'copyxmltext': args.copyxmltext == 'True',
+        'far_field_factor': args.far_field_factor
+    }
+
+    if not run_batch(args.directories, options, args.workers):
+        sys.exit(99)
+
+
+def main():
+
+    if len(sys.argv) > 1 and sys.argv[1] == '-batch':
+        batch_main(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="reads in CADAssembly.xml, CADAssembly_metrics.xml, "
+                                                 "and ComputedValues.xml and creates a .pcl script for Patran "
+                                                 "(or: -batch DIR [DIR ...] for several directories)")
+    add_input_arguments(parser)
+    parser.add_argument('-watch', '--watch', action='store_true',
+                        help="Keep running, and recreate the input file whenever an input changes")
 
     args = parser.parse_args()
 
     args.copyxmltext = True if args.copyxmltext == 'True' else False
 
-    ppcl = PatranPCL(
-        args.cadassembly,
-        args.cadassembly_metrics,
-        args.computedvalues)
+    if args.watch:
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        ppcl = PatranPCL(
+            args.cadassembly,
+            args.cadassembly_metrics,
+            args.computedvalues,
+            args.far_field_factor)
+
+        ppcl.check()
+        ppcl.create_pcl_input_file(args.copyxmltext)
 
-    ppcl.create_pcl_input_file(args.copyxmltext)
+    except PatranPCLError:
+        sys.exit(99)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,745 @@
+import os
+import sys
+import json
+import time
+import hmac
+import shlex
+import socket
+import struct
+import shutil
+import tarfile
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import SocketServer
+import subprocess
+import multiprocessing
+from RuntimePredictor import ORDERS, order_jobs, read_deadlines
+
+# Ships testbench directories to JobDispatch worker agents over TCP, runs CADJobDriver there and
+# brings the files it wrote back. Every message is a JSON header, optionally followed by a
+# .tar.gz payload:
+#
+#   coordinator -> agent   Hello {Token}                  agent -> coordinator   Hello {Name, Slots, Warm}
+#   coordinator -> agent   Job {JobId, Name, Key, DriverArgs} + the directory
+#   agent -> coordinator   Log {Line} ... and Heartbeat while the job runs
+#   agent -> coordinator   Result {ExitCode} + the files the job added or changed
+#
+# An agent runs whatever DriverArgs it is sent, so it listens on 127.0.0.1 unless given a shared
+# token, which every connection must send in its Hello before anything else.
+
+DEFAULT_PORT = 7391
+DEFAULT_HOST = '127.0.0.1'
+
+# The shared token, if not given with -token (which other users can see in the process list)
+TOKEN_ENV = 'JOBDISPATCH_TOKEN'
+
+# Agents send a heartbeat this often while a job runs; an agent silent for HEARTBEAT_TIMEOUT is dead
+HEARTBEAT_SECONDS = 5
+HEARTBEAT_TIMEOUT = 30
+
+# A job whose agents die this many times (e.g. because the job takes the node down) is not tried again
+MAX_ATTEMPTS = 3
+
+# A slot whose connection drops reconnects every RECONNECT_SECONDS; after RECONNECT_ATTEMPTS
+# failures in a row its agent is taken to be gone
+RECONNECT_SECONDS = 5
+RECONNECT_ATTEMPTS = 6
+
+DEFAULT_DRIVER_ARGS = '-assembler CREO -mesher PATRAN -analyzer PATRAN_NASTRAN -mode STATIC'
+
+# Geometry keys of the jobs an agent has meshed into its mesh cache, kept in its work directory
+WARM_KEYS_FILE_NAME = 'JobDispatch_warm.json'
+
+# The agent's console output of each attempt, in <job dir>/log
+CONSOLE_LOG_NAME = 'JobDispatch.txt'
+
+CHUNK_SIZE = 1024 * 1024
+HEADER = struct.Struct('!IQ')   # JSON header bytes, payload bytes
+
+BIN_CAD_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class DispatchError(Exception):
+    pass
+
+
+def send_message(sock, message, payload_path=None):
+
+    header = json.dumps(message)
+    size = os.path.getsize(payload_path) if payload_path else 0
+
+    sock.sendall(HEADER.pack(len(header), size) + header)
+
+    if payload_path:
+        with open(payload_path, 'rb') as f_in:
+            while True:
+                chunk = f_in.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sock.sendall(chunk)
+
+
+def recv_exactly(sock, size, f_out=None):
+
+    chunks = []
+
+    while size > 0:
+        chunk = sock.recv(min(size, CHUNK_SIZE))
+        if not chunk:
+            raise DispatchError("Connection closed")
+        size -= len(chunk)
+
+        if f_out is not None:
+            f_out.write(chunk)
+        else:
+            chunks.append(chunk)
+
+    return ''.join(chunks)
+
+
+def recv_message(sock, payload_dir=None, max_payload=None):
+    """The next message and the path of its payload (a temp file in payload_dir), or None."""
+
+    header_size, payload_size = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if max_payload is not None and payload_size > max_payload:
+        raise DispatchError("Unexpected payload of {} bytes".format(payload_size))
+
+    message = json.loads(recv_exactly(sock, header_size))
+
+    if not payload_size:
+        return message, None
+
+    fd, payload_path = tempfile.mkstemp(suffix='.tar.gz', dir=payload_dir)
+
+    try:
+        with os.fdopen(fd, 'wb') as f_out:
+            recv_exactly(sock, payload_size, f_out)
+    except BaseException:
+        os.remove(payload_path)
+        raise
+
+    return message, payload_path
+
+
+def snapshot(directory):
+    """{path relative to directory: (size, mtime)} of the files under it."""
+
+    files = {}
+
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            stat = os.stat(path)
+            files[os.path.relpath(path, directory)] = (stat.st_size, stat.st_mtime)
+
+    return files
+
+
+def pack(directory, tar_path, names):
+    """Every file goes in as a regular member, with its contents: ArtifactStaging's hard links
+    and symbolic links would otherwise become link members, which unpack refuses."""
+
+    with tarfile.open(tar_path, 'w:gz', dereference=True) as tar:
+        for name in sorted(names):
+            tar.add(os.path.join(directory, name), arcname=name.replace(os.sep, '/'))
+
+
+def unpack(tar_path, directory):
+    """Extract tar_path into directory; members that would land outside it are refused."""
+
+    directory = os.path.abspath(directory)
+
+    with tarfile.open(tar_path, 'r:gz') as tar:
+        for member in tar.getmembers():
+            target = os.path.abspath(os.path.join(directory, member.name))
+            if not member.isfile() or not target.startswith(directory + os.sep):
+                raise DispatchError("Refusing to extract {} from {}".format(member.name, tar_path))
+
+        tar.extractall(directory)
+
+
+def utf8(text):
+
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+
+def is_loopback(host):
+
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+def geometry_key(job_dir):
+    """Jobs with the same CADAssembly.xml have the same geometry, and so share their Patran meshes."""
+
+    path = os.path.join(job_dir, 'CADAssembly.xml')
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f_in:
+        return hashlib.sha1(f_in.read()).hexdigest()
+
+
+class WorkerAgent():
+    """Runs the jobs a coordinator sends, one per connection, at most slots at once. Each job runs
+    in its own directory under work_dir, as CADJobDriver.py in a fresh process. Given a token,
+    only coordinators that send it are served."""
+
+    def __init__(self, work_dir, slots=1, mesh_cache_dir=None, token=None):
+
+        self.logger = logging.getLogger('JobDispatch')
+        self.work_dir = os.path.abspath(work_dir)
+        self.slots = slots
+        self.mesh_cache_dir = mesh_cache_dir and os.path.abspath(mesh_cache_dir)
+        self.token = token
+        self.name = None
+
+        self.slot_semaphore = threading.BoundedSemaphore(slots)
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+
+        self.warm = set()
+        warm_path = os.path.join(self.work_dir, WARM_KEYS_FILE_NAME)
+
+        if self.mesh_cache_dir and os.path.exists(warm_path):
+            with open(warm_path, 'r') as f_in:
+                self.warm = set(json.load(f_in))
+
+    def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        """Serve until killed. ready, a multiprocessing Connection, is sent the port once listening."""
+
+        if not self.token and not is_loopback(host):
+            raise DispatchError("An agent listening on {} needs a token (-token or {})".format(host, TOKEN_ENV))
+
+        agent = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                agent.handle_connection(self.request)
+
+        server = SocketServer.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        server.allow_reuse_address = True
+        server.daemon_threads = True
+        server.server_bind()
+        server.server_activate()
+
+        port = server.server_address[1]
+        self.name = '{}:{}'.format(socket.gethostname(), port)
+        self.logger.info("Agent {} running up to {} jobs in {}".format(self.name, self.slots, self.work_dir))
+
+        if ready is not None:
+            ready.send(port)
+            ready.close()
+
+        server.serve_forever()
+
+    def handle_connection(self, sock):
+
+        if not self.slot_semaphore.acquire(False):
+            send_message(sock, {'Type': 'Busy'})
+            return
+
+        authenticated = not self.token
+
+        try:
+            while True:
+                try:
+                    message, payload_path = recv_message(sock, self.work_dir, None if authenticated else 0)
+                except DispatchError:
+                    return  # the coordinator is done with this slot
+
+                if message['Type'] == 'Hello':
+                    if not authenticated:
+                        if not hmac.compare_digest(utf8(message.get('Token') or ''), utf8(self.token)):
+                            self.logger.warning("Refused a coordinator with a wrong token")
+                            send_message(sock, {'Type': 'Refused'})
+                            return
+                        authenticated = True
+
+                    with self.lock:
+                        warm = sorted(self.warm)
+                    send_message(sock, {'Type': 'Hello', 'Name': self.name, 'Slots': self.slots, 'Warm': warm})
+
+                elif not authenticated:
+                    return
+
+                elif message['Type'] == 'Job':
+                    self.run_job(sock, message, payload_path)
+
+        except socket.error as e:
+            self.logger.warning("Lost the coordinator: {}".format(e))
+        finally:
+            sock.close()
+            self.slot_semaphore.release()
+
+    def run_job(self, sock, message, tar_path):
+
+        job_root = os.path.join(self.work_dir, message['JobId'])
+        job_dir = os.path.join(job_root, message['Name'])
+        result_path = os.path.join(job_root, 'result.tar.gz')
+
+        if os.path.exists(job_root):
+            shutil.rmtree(job_root)
+        os.makedirs(job_dir)
+
+        send_lock = threading.Lock()
+        process = None
+        running = [True]
+
+        def send(reply, payload_path=None):
+            with send_lock:
+                send_message(sock, reply, payload_path)
+
+        def heartbeat():
+            while running[0]:
+                time.sleep(HEARTBEAT_SECONDS)
+                if running[0]:
+                    try:
+                        send({'Type': 'Heartbeat', 'JobId': message['JobId']})
+                    except socket.error:
+                        return
+
+        try:
+            unpack(tar_path, job_dir)
+            os.remove(tar_path)
+
+            before = snapshot(job_dir)
+
+            cmd = [sys.executable, os.path.join(BIN_CAD_DIR, 'CADJobDriver.py')] + message['DriverArgs']
+            if self.mesh_cache_dir:
+                cmd += ['-meshcache', self.mesh_cache_dir]
+
+            self.logger.info("Running {} in {}".format(message['Name'], job_dir))
+
+            process = subprocess.Popen(cmd, cwd=job_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+            heartbeat_thread = threading.Thread(target=heartbeat, name='Heartbeat')
+            heartbeat_thread.daemon = True
+            heartbeat_thread.start()
+
+            for line in iter(process.stdout.readline, ''):
+                send({'Type': 'Log', 'JobId': message['JobId'], 'Line': line.rstrip('\r\n')})
+
+            exit_code = process.wait()
+
+            # Heartbeats go on while the results are packed and sent, which for a large deck can
+            # take longer than HEARTBEAT_TIMEOUT
+            after = snapshot(job_dir)
+            pack(job_dir, result_path, [name for name in after if before.get(name) != after[name]])
+
+            send({'Type': 'Result', 'JobId': message['JobId'], 'ExitCode': exit_code}, result_path)
+            running[0] = False
+
+            self.logger.info("{} finished with exit code {}".format(message['Name'], exit_code))
+
+            if exit_code == 0 and self.mesh_cache_dir and message.get('Key'):
+                self.add_warm_key(message['Key'])
+
+        except socket.error:
+            # The coordinator has gone, and will run the job elsewhere
+            if process is not None and process.poll() is None:
+                process.kill()
+            raise
+
+        finally:
+            running[0] = False
+            shutil.rmtree(job_root, ignore_errors=True)
+
+    def add_warm_key(self, key):
+
+        with self.lock:
+            self.warm.add(key)
+            warm = sorted(self.warm)
+
+        warm_path = os.path.join(self.work_dir, WARM_KEYS_FILE_NAME)
+        temp_path = '{}.{}.tmp'.format(warm_path, threading.current_thread().ident)
+
+        with open(temp_path, 'w') as f_out:
+            json.dump(warm, f_out)
+
+        if os.name == 'nt' and os.path.exists(warm_path):
+            os.remove(warm_path)
+        os.rename(temp_path, warm_path)
+
+
+def run_agent(work_dir, slots, mesh_cache_dir, host, port, ready=None, token=None):
+
+    WorkerAgent(work_dir, slots, mesh_cache_dir, token).serve(host, port, ready)
+
+
+def start_loopback_agents(count, work_root, slots=1, mesh_cache=False, token=None):
+    """count agents on 127.0.0.1, each a process with its own work directory (and mesh cache),
+    as if each were a node of its own. Returns [(process, (host, port))]."""
+
+    agents = []
+
+    for i in range(count):
+        work_dir = os.path.join(work_root, 'agent_{}'.format(i))
+        mesh_cache_dir = os.path.join(work_dir, 'mesh_cache') if mesh_cache else None
+
+        receiver, sender = multiprocessing.Pipe(False)
+
+        process = multiprocessing.Process(target=run_agent, name='JobDispatchAgent{}'.format(i),
+                                          args=(work_dir, slots, mesh_cache_dir, DEFAULT_HOST, 0, sender, token))
+        process.daemon = True
+        process.start()
+
+        agents.append((process, ('127.0.0.1', receiver.recv())))
+
+    return agents
+
+
+class DispatchJob():
+
+    def __init__(self, job_id, job_dir):
+
+        self.job_id = job_id
+        self.job_dir = os.path.abspath(job_dir)
+        self.name = os.path.basename(self.job_dir)
+        self.key = geometry_key(self.job_dir)
+        self.predicted = None
+        self.attempts = 0
+        self.host = None
+        self.start = None
+
+
+class Coordinator():
+    """Runs job directories on agents, as many at once as the agents have slots. A free slot takes
+    the next job whose geometry its agent has meshed before, else one whose geometry no live agent
+    has, else the next job. The jobs of an agent that dies go back on the queue for the others.
+
+    The queue is in the given order, or shortest predicted runtime or least deadline slack first
+    (see RuntimePredictor.order_jobs). Runtimes are predicted from this node's runtime history;
+    point CAD_RUNTIME_HISTORY at a shared file to predict from the agents' jobs."""
+
+    def __init__(self, addresses, driver_args=None, order='given', deadlines=None, token=None):
+
+        self.logger = logging.getLogger('JobDispatch')
+        self.addresses = addresses
+        self.token = token
+        self.driver_args = shlex.split(DEFAULT_DRIVER_ARGS if driver_args is None else driver_args)
+        self.order = order
+        self.deadlines = deadlines
+
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running = 0
+        self.results = []
+        self.affinity = {}      # geometry key -> name of the agent that has its meshes
+        self.live_slots = {}    # agent name -> slots still connected
+
+    def run(self, job_dirs):
+        """Run the jobs; returns a result dict per job, in the order of job_dirs."""
+
+        analyzer = None
+        if '-analyzer' in self.driver_args:
+            analyzer = self.driver_args[self.driver_args.index('-analyzer') + 1]
+
+        ordered, predicted = order_jobs(job_dirs, self.order, deadlines=self.deadlines, analyzer=analyzer)
+
+        self.queue = []
+
+        for i, job_dir in enumerate(ordered):
+            job = DispatchJob('{:05d}'.format(i), job_dir)
+            job.predicted = predicted[job_dir]
+            self.queue.append(job)
+
+            if job.predicted is not None:
+                self.logger.info("{}: predicted {:.1f} s".format(job.name, job.predicted))
+
+        threads = []
+
+        for address in self.addresses:
+            try:
+                sock, hello = self.connect(address)
+            except (socket.error, DispatchError) as e:
+                self.logger.warning("No agent at {}:{}: {}".format(address[0], address[1], e))
+                continue
+
+            name = hello['Name']
+            self.logger.info("Agent {}: {} slots, {} warm geometries".format(name, hello['Slots'], len(hello['Warm'])))
+
+            with self.condition:
+                self.live_slots[name] = 0
+                for key in hello['Warm']:
+                    self.affinity.setdefault(key, name)
+
+            for slot in range(hello['Slots']):
+                thread = threading.Thread(target=self.run_slot, name='{}/{}'.format(name, slot),
+                                          args=(name, address, sock if slot == 0 else None))
+                thread.daemon = True
+                threads.append(thread)
+
+                with self.condition:
+                    self.live_slots[name] += 1
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            # join with a timeout, so Ctrl-C gets through
+            while thread.is_alive():
+                thread.join(1)
+
+        for job in self.queue:
+            self.finish(job, None, "No agents left")
+
+        order = dict((os.path.abspath(job_dir), i) for i, job_dir in enumerate(job_dirs))
+        return sorted(self.results, key=lambda result: order[result['Directory']])
+
+    def connect(self, address):
+        """A connection to one of the agent's slots, and its Hello."""
+
+        sock = socket.create_connection(address, HEARTBEAT_TIMEOUT)
+        sock.settimeout(HEARTBEAT_TIMEOUT)
+
+        try:
+            send_message(sock, {'Type': 'Hello', 'Token': self.token})
+            hello, _ = recv_message(sock)
+        except BaseException:
+            sock.close()
+            raise
+
+        if hello['Type'] != 'Hello':
+            sock.close()
+            raise DispatchError("Refused the token" if hello['Type'] == 'Refused' else "No free slots")
+
+        return sock, hello
+
+    def jobs_left(self):
+
+        with self.condition:
+            return bool(self.queue) or self.running > 0
+
+    def run_slot(self, name, address, sock):
+        """Run jobs on one slot of agent name until there are none left. A dropped connection is
+        reconnected, as the agent may only have been slow or restarted."""
+
+        failures = 0
+
+        try:
+            while True:
+                job = None
+
+                try:
+                    if sock is None:
+                        sock = self.connect(address)[0]
+                        if failures:
+                            self.logger.info("Reconnected to agent {}".format(name))
+                    failures = 0
+
+                    while True:
+                        job = self.next_job(name)
+                        if job is None:
+                            return
+
+                        exit_code = self.run_job(sock, name, job)
+
+                        with self.condition:
+                            self.running -= 1
+                            self.finish(job, exit_code)
+                        job = None
+
+                except (socket.error, DispatchError) as e:
+                    failures += 1
+                    self.logger.warning("Lost agent {}: {}".format(name, e))
+
+                finally:
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+
+                    with self.condition:
+                        if job is not None:
+                            self.running -= 1
+                            if job.attempts >= MAX_ATTEMPTS:
+                                self.finish(job, None, "Agents died running it {} times".format(job.attempts))
+                            else:
+                                self.logger.info("Requeueing {}".format(job.name))
+                                self.queue.insert(0, job)
+                        self.condition.notify_all()
+
+                if failures >= RECONNECT_ATTEMPTS or not self.jobs_left():
+                    return
+
+                time.sleep(RECONNECT_SECONDS)
+
+        finally:
+            with self.condition:
+                self.live_slots[name] -= 1
+                self.condition.notify_all()
+
+    def next_job(self, name):
+        """The job for a free slot of agent name, or None once there are no more."""
+
+        with self.condition:
+            while not self.queue:
+                if self.running == 0:
+                    return None
+                # A running job may yet come back if its agent dies
+                self.condition.wait(1)
+
+            live = set(agent for agent, slots in self.live_slots.items() if slots > 0)
+
+            candidates = [job for job in self.queue if job.key is not None and self.affinity.get(job.key) == name]
+            candidates = candidates or [job for job in self.queue if self.affinity.get(job.key) not in live]
+            job = (candidates or self.queue)[0]
+
+            self.queue.remove(job)
+            self.running += 1
+
+            if job.key is not None and self.affinity.get(job.key) not in live:
+                self.affinity[job.key] = name
+
+            job.attempts += 1
+            job.host = name
+            if job.start is None:
+                job.start = time.time()
+
+            return job
+
+    def run_job(self, sock, name, job):
+
+        self.logger.info("{} -> {} (attempt {})".format(job.name, name, job.attempts))
+
+        fd, tar_path = tempfile.mkstemp(suffix='.tar.gz')
+        os.close(fd)
+
+        try:
+            pack(job.job_dir, tar_path, [path for path in snapshot(job.job_dir)
+                                         if path != os.path.join('log', CONSOLE_LOG_NAME)])
+            send_message(sock, {'Type': 'Job', 'JobId': job.job_id, 'Name': job.name, 'Key': job.key,
+                                'DriverArgs': self.driver_args}, tar_path)
+        finally:
+            os.remove(tar_path)
+
+        log_dir = os.path.join(job.job_dir, 'log')
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+
+        with open(os.path.join(log_dir, CONSOLE_LOG_NAME), 'a') as console_log:
+            console_log.write("=== Attempt {} on {}\n".format(job.attempts, name))
+
+            while True:
+                message, payload_path = recv_message(sock)
+
+                if message['Type'] == 'Log':
+                    console_log.write(message['Line'] + '\n')
+                    self.logger.debug("{}: {}".format(job.name, message['Line']))
+
+                elif message['Type'] == 'Busy':
+                    raise DispatchError("No free slot")
+
+                elif message['Type'] == 'Result':
+                    if payload_path is not None:
+                        try:
+                            unpack(payload_path, job.job_dir)
+                        finally:
+                            os.remove(payload_path)
+                    return message['ExitCode']
+
+    def finish(self, job, exit_code, error=None):
+
+        end = time.time()
+        start = job.start or end
+
+        with self.condition:
+            self.results.append({'Directory': job.job_dir, 'Host': job.host, 'Attempts': job.attempts,
+                                 'ExitCode': exit_code, 'Error': error, 'PredictedSeconds': job.predicted,
+                                 'Start': start, 'End': end, 'Seconds': end - start})
+            self.condition.notify_all()
+
+        if error is not None:
+            self.logger.error("{}: {}".format(job.name, error))
+        else:
+            self.logger.info("{} finished on {} with exit code {}".format(job.name, job.host, exit_code))
+
+
+def parse_address(text):
+
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port or DEFAULT_PORT)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run CADJobDriver jobs on JobDispatch agents over TCP")
+    subparsers = parser.add_subparsers(dest='command')
+
+    worker_parser = subparsers.add_parser('worker', help="Run an agent that takes jobs from coordinators")
+    worker_parser.add_argument('-host', default=DEFAULT_HOST,
+                               help="Address to listen on; any but 127.0.0.1 needs a token")
+    worker_parser.add_argument('-port', type=int, default=DEFAULT_PORT)
+    worker_parser.add_argument('-workdir', default=os.path.join(tempfile.gettempdir(), 'JobDispatch'))
+    worker_parser.add_argument('-slots', type=int, default=1, help="Jobs run at once")
+    worker_parser.add_argument('-meshcache', default=None, help="Mesh cache directory the jobs share")
+    worker_parser.add_argument('-token', default=os.environ.get(TOKEN_ENV),
+                               help="Shared token coordinators must send (default: ${})".format(TOKEN_ENV))
+
+    run_parser = subparsers.add_parser('run', help="Run job directories on agents")
+    run_parser.add_argument('job_dirs', nargs='+')
+    run_parser.add_argument('-workers', default=None, help="Agents, as host:port,host:port,...")
+    run_parser.add_argument('-loopback', type=int, default=None, metavar='N',
+                            help="Start N agents on this machine instead")
+    run_parser.add_argument('-slots', type=int, default=1, help="Jobs each loopback agent runs at once")
+    run_parser.add_argument('-meshcache', action='store_true', help="Give each loopback agent a mesh cache")
+    run_parser.add_argument('-driver_args', default=DEFAULT_DRIVER_ARGS, help="CADJobDriver.py arguments")
+    run_parser.add_argument('-order', choices=ORDERS, default='given',
+                            help="Run the jobs in the given order, shortest predicted first, or by deadline")
+    run_parser.add_argument('-deadlines', default=None, help="JSON file of {job directory: seconds from now}")
+    run_parser.add_argument('-json', default=None, help="Write the per-job results here")
+    run_parser.add_argument('-token', default=os.environ.get(TOKEN_ENV),
+                            help="Shared token of the agents (default: ${})".format(TOKEN_ENV))
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)-16s %(levelname)-8s %(message)s')
+
+    if args.command == 'worker':
+        try:
+            run_agent(args.workdir, args.slots, args.meshcache, args.host, args.port, token=args.token)
+        except DispatchError as e:
+            parser.error(str(e))
+        return
+
+    if (args.workers is None) == (args.loopback is None):
+        parser.error("give one of -workers and -loopback")
+
+    agents = []
+    loopback_dir = None
+
+    try:
+        if args.loopback is not None:
+            loopback_dir = tempfile.mkdtemp(prefix='JobDispatch_')
+            agents = start_loopback_agents(args.loopback, loopback_dir, args.slots, args.meshcache, args.token)
+            addresses = [address for _, address in agents]
+        else:
+            addresses = [parse_address(text) for text in args.workers.split(',')]
+
+        deadlines = read_deadlines(args.deadlines) if args.deadlines else None
+        results = Coordinator(addresses, args.driver_args, args.order, deadlines, args.token).run(args.job_dirs)
+
+    finally:
+        for process, _ in agents:
+            process.terminate()
+        if loopback_dir is not None:
+            shutil.rmtree(loopback_dir, ignore_errors=True)
+
+    for result in results:
+        print("{:<8}{:<24}{}".format(result['ExitCode'], result['Host'], result['Directory']))
+
+    if args.json:
+        with open(args.json, 'w') as f_out:
+            json.dump(results, f_out, indent=4, sort_keys=True, separators=(',', ': '))
+
+    sys.exit(0 if all(result['ExitCode'] == 0 for result in results) else 1)
+
+
+if __name__ == '__main__':
+
+    main()
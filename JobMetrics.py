@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import threading
+import contextlib
+import BaseHTTPServer
+
+# Prometheus textfile (e.g. in node_exporter's --collector.textfile.directory) that jobs add to
+METRICS_TEXTFILE_ENV = 'CAD_METRICS_TEXTFILE'
+
+# Seconds; Patran and Nastran stages run from seconds to hours
+DURATION_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400]
+
+# name: (type, help)
+METRICS = {
+    'cad_jobs_total': ('counter', 'CADJobDriver jobs finished, by analyzer and result.'),
+    'cad_job_duration_seconds': ('histogram', 'Wall time of CADJobDriver jobs.'),
+    'cad_stage_duration_seconds': ('histogram', 'Wall time of CADJobDriver stages (Patran, Nastran, PostProcess, ...).'),
+    'cad_stage_failures_total': ('counter', 'Failed jobs by the stage they failed in.'),
+    'cad_solver_aborts_total': ('counter', 'Solver runs stopped early by SolverMonitor, by the rule that matched.'),
+    'cad_last_job_finish_timestamp_seconds': ('gauge', 'When the last CADJobDriver job finished.')
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels, extra=()):
+
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                          for k, v in pairs) + '}'
+
+
+def format_value(value):
+
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class JobMetrics():
+    """Counters, gauges and histograms of METRICS, kept in memory and written in the Prometheus
+    text format. Each histogram sample is [count per bucket of DURATION_BUCKETS and +Inf, sum]."""
+
+    def __init__(self):
+
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+
+        with self.lock:
+            key = (name, label_key(labels))
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+
+        with self.lock:
+            self.samples[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+
+        with self.lock:
+            key = (name, label_key(labels))
+            sample = self.samples.setdefault(key, [0] * (len(DURATION_BUCKETS) + 1) + [0.0])
+
+            bucket = len(DURATION_BUCKETS)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    bucket = i
+                    break
+
+            sample[bucket] += 1
+            sample[-1] += value
+
+    def merge(self, other):
+        """Add other's counters and histograms to these; other's gauges win."""
+
+        with self.lock:
+            for key, value in other.samples.items():
+                kind = METRICS[key[0]][0]
+
+                if key not in self.samples or kind == 'gauge':
+                    self.samples[key] = list(value) if kind == 'histogram' else value
+                elif kind == 'histogram':
+                    self.samples[key] = [a + b for a, b in zip(self.samples[key], value)]
+                else:
+                    self.samples[key] += value
+
+    def to_state(self):
+
+        with self.lock:
+            return [[name, dict(labels), value] for (name, labels), value in sorted(self.samples.items())]
+
+    @staticmethod
+    def from_state(state):
+
+        metrics = JobMetrics()
+
+        for name, labels, value in state:
+            if name in METRICS:
+                metrics.samples[(name, label_key(labels))] = value
+
+        return metrics
+
+    def render(self):
+
+        lines = []
+
+        with self.lock:
+            samples = sorted(self.samples.items())
+
+        for name in sorted(set(name for (name, _), _ in samples)):
+            kind, help_text = METRICS[name]
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+            for (_, labels), value in [s for s in samples if s[0][0] == name]:
+                if kind != 'histogram':
+                    lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS + [float('inf')], value[:-1]):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels, [('le', format_value(bound))]),
+                                                         cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(value[-1])))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def locked(lock_path):
+    """Hold an exclusive lock on lock_path, for jobs that update the same textfile."""
+
+    with open(lock_path, 'a') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except IOError:
+                    pass    # LK_LOCK gives up after 10 s; keep waiting
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def replace_file(path, text):
+
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+    with open(temp_path, 'w') as f_out:
+        f_out.write(text)
+
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_path, path)
+
+
+def state_path(textfile_path):
+    # Not *.prom, so the textfile collector does not read it
+    return textfile_path + '.json'
+
+
+def add_to_textfile(metrics, textfile_path):
+    """Add metrics to the totals in textfile_path (kept in <textfile_path>.json) and rewrite it."""
+
+    with locked(textfile_path + '.lock'):
+        totals = JobMetrics()
+
+        if os.path.exists(state_path(textfile_path)):
+            try:
+                with open(state_path(textfile_path), 'r') as f_in:
+                    totals = JobMetrics.from_state(json.load(f_in))
+            except ValueError:
+                logging.getLogger('JobMetrics').warning("{} is damaged; starting new totals".format(
+                    state_path(textfile_path)))
+
+        totals.merge(metrics)
+
+        replace_file(state_path(textfile_path), json.dumps(totals.to_state()))
+        replace_file(textfile_path, totals.render())
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.render()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(render, port, host='127.0.0.1', background=True):
+    """Serve render() (a JobMetrics' render, or a textfile's contents) at http://host:port/metrics."""
+
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    server.render = render
+
+    if not background:
+        server.serve_forever()
+        return server
+
+    thread = threading.Thread(target=server.serve_forever, name='MetricsServer')
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Show or serve the CADJobDriver metrics textfile")
+    parser.add_argument('textfile', nargs='?', default=os.environ.get(METRICS_TEXTFILE_ENV))
+    parser.add_argument('-serve', type=int, default=None, metavar='PORT', help="Serve it at /metrics on this port")
+    parser.add_argument('-host', default='127.0.0.1')
+    args = parser.parse_args()
+
+    if not args.textfile:
+        print("No textfile given and {} is not set".format(METRICS_TEXTFILE_ENV))
+        sys.exit(1)
+
+    def render():
+        if not os.path.exists(args.textfile):
+            return ''
+        with open(args.textfile, 'r') as f_in:
+            return f_in.read()
+
+    if args.serve is None:
+        sys.stdout.write(render())
+        return
+
+    print("Serving {} at http://{}:{}/metrics".format(args.textfile, args.host, args.serve))
+    serve_metrics(render, args.serve, args.host, background=False)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,314 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import logging
+import xml.etree.cElementTree as etree
+import numpy as np
+from BdfIndex import BdfIndex
+from MeshQuality import element_coordinates, tetra_volumes, tetra10_shape_derivatives, TETRA10_EDGES
+
+
+# 4-point rule for tetrahedra (exact for quadratics); weights sum to the unit tet volume 1/6
+GAUSS_A = 0.5854101966249685
+GAUSS_B = 0.1381966011250105
+TETRA_GAUSS_POINTS = [(GAUSS_B, GAUSS_B, GAUSS_B),
+                      (GAUSS_A, GAUSS_B, GAUSS_B),
+                      (GAUSS_B, GAUSS_A, GAUSS_B),
+                      (GAUSS_B, GAUSS_B, GAUSS_A)]
+TETRA_GAUSS_WEIGHT = 1. / 24.
+
+# CADAssembly_metrics.xml has each part's CAD Volume and Mass as MetricComponent/Scalars/Scalar
+# {Name, Value, Unit}. The deck is in mm and its densities are the material library's kg/m^3, so
+# a mesh mass is in 1e-9 kg; CAD values are converted to the deck's units to compare them.
+CAD_VOLUME_UNITS = {'mm^3': 1.0, 'cm^3': 1e3, 'm^3': 1e9, 'in^3': 16387.064}
+CAD_MASS_UNITS = {'kg': 1e9, 'g': 1e6, 'tonne': 1e12, 'lbm': 0.45359237e9}
+
+# A part whose mesh volume or mass is off its CAD value by more than this fraction is reported
+MASS_PROPERTIES_TOLERANCE = 0.05
+
+# Largest deviation over the parts, added to the testbench manifest's Metrics
+VOLUME_DEVIATION_METRIC = 'MeshVolumeDeviation'
+MASS_DEVIATION_METRIC = 'MeshMassDeviation'
+
+
+def tetra10_shape_functions(xi, eta, zeta):
+    """The 10 TETRA10 shape functions at (xi, eta, zeta), in Nastran grid order."""
+
+    volume_coords = [1. - xi - eta - zeta, xi, eta, zeta]
+    n = np.zeros(10)
+
+    for i in range(4):
+        n[i] = volume_coords[i] * (2. * volume_coords[i] - 1.)
+
+    for m, (i, j) in enumerate(TETRA10_EDGES):
+        n[4 + m] = 4. * volume_coords[i] * volume_coords[j]
+
+    return n
+
+
+def tetra10_volumes_and_moments(coords):
+    """Volume and first moment of volume (integral of x dV) of TETRA10 elements
+    given coords[elements, 10, 3]."""
+
+    volumes = np.zeros(len(coords))
+    moments = np.zeros((len(coords), 3))
+
+    for point in TETRA_GAUSS_POINTS:
+        jacobians = np.einsum('eni,nj->eij', coords, tetra10_shape_derivatives(*point))
+        weights = TETRA_GAUSS_WEIGHT * np.linalg.det(jacobians)
+        volumes += weights
+        moments += weights[:, None] * np.einsum('eni,n->ei', coords, tetra10_shape_functions(*point))
+
+    return volumes, moments
+
+
+def compute_mass_properties(bdf_index):
+    """Volume, mass and center of gravity of the CTETRA elements of each property.
+
+    Density is the RHO of the property's MAT1 (the Density PatranPCL wrote from the
+    material library), so mass is in the deck's own units.
+
+    Returns {pid: {'Elements', 'Volume', 'Density', 'Mass', 'CG'}}."""
+
+    logger = logging.getLogger('MassProperties')
+
+    if not bdf_index.num_elements or not bdf_index.num_nodes:
+        return {}
+
+    positions = []
+    volumes = []
+    moments = []
+
+    for grid_count in (4, 10):
+        element_positions, coords = element_coordinates(bdf_index, 'CTETRA', grid_count)
+        if not len(element_positions):
+            continue
+
+        if grid_count == 4:
+            element_volumes = tetra_volumes(coords)
+            element_moments = element_volumes[:, None] * coords.mean(axis=1)
+        else:
+            element_volumes, element_moments = tetra10_volumes_and_moments(coords)
+
+        positions.append(element_positions)
+        volumes.append(element_volumes)
+        moments.append(element_moments)
+
+    if not positions:
+        logger.warning("No CTETRA elements in {}".format(bdf_index.bdf_path))
+        return {}
+
+    positions = np.concatenate(positions)
+    volumes = np.concatenate(volumes)
+    moments = np.concatenate(moments)
+
+    pids = np.frombuffer(bdf_index.elem_pids, dtype=np.intc)[positions]
+    unique_pids, inverse = np.unique(pids, return_inverse=True)
+
+    pid_elements = np.bincount(inverse)
+    pid_volumes = np.bincount(inverse, weights=volumes)
+    pid_moments = np.stack([np.bincount(inverse, weights=moments[:, axis]) for axis in range(3)], axis=1)
+
+    mass_properties = {}
+
+    for i, pid in enumerate(unique_pids.tolist()):
+        material = bdf_index.materials.get(bdf_index.properties.get(pid, {}).get('MID'), {})
+        density = material.get('RHO', 0.0)
+
+        if not density:
+            logger.warning("No density for property {}; mass reported as 0".format(pid))
+
+        volume = float(pid_volumes[i])
+        cg = tuple((pid_moments[i] / volume).tolist()) if volume else (0.0, 0.0, 0.0)
+
+        mass_properties[pid] = {
+            'Elements': int(pid_elements[i]),
+            'Volume': volume,
+            'Density': density,
+            'Mass': density * volume,
+            'CG': cg
+        }
+
+    return mass_properties
+
+
+def read_cad_mass_properties(cam_path, logger=None):
+    """{ComponentID: {'Volume', 'Mass'}} of the parts in CADAssembly_metrics.xml, in the deck's
+    units. Values in units not in CAD_VOLUME_UNITS/CAD_MASS_UNITS are left out."""
+
+    logger = logger or logging.getLogger('MassProperties')
+    root = etree.parse(cam_path).getroot()
+
+    component_ids_by_metric_id = {}
+    for cad_component in root.iter('CADComponent'):
+        component_ids_by_metric_id.setdefault(cad_component.get('MetricID'), cad_component.get('ComponentInstanceID'))
+
+    units_by_name = {'Volume': CAD_VOLUME_UNITS, 'Mass': CAD_MASS_UNITS}
+    cad_mass_properties = {}
+
+    for metric_component in root.findall("MetricComponents/MetricComponent[@Type='PART']"):
+        component_id = component_ids_by_metric_id.get(metric_component.get('MetricID'))
+        values = {}
+
+        for scalar in metric_component.findall('Scalars/Scalar'):
+            name = scalar.get('Name')
+            if name not in units_by_name:
+                continue
+
+            unit = (scalar.get('Unit') or '').replace(' ', '').lower()
+            factor = units_by_name[name].get(unit)
+
+            try:
+                value = float(scalar.get('Value'))
+            except (TypeError, ValueError):
+                continue
+
+            if factor is None:
+                logger.warning("{} {} of {}: unknown unit '{}'".format(name, value, component_id, unit))
+                continue
+
+            values[name] = value * factor
+
+        if component_id is not None and values:
+            cad_mass_properties[component_id] = values
+
+    return cad_mass_properties
+
+
+def compare_mass_properties(mass_properties, bdf_index, component_ids_by_label, cad_mass_properties,
+                            tolerance=MASS_PROPERTIES_TOLERANCE, logger=None):
+    """Deviation ((mesh - CAD) / CAD) of each property's volume and mass from its part's CAD
+    values. Returns {pid: {'CADVolume', 'VolumeDeviation', 'CADMass', 'MassDeviation',
+    'WithinTolerance'}}, with None for what the CAD does not give."""
+
+    logger = logger or logging.getLogger('MassProperties')
+    comparison = {}
+
+    for pid, part in mass_properties.items():
+        label = bdf_index.property_label(pid)
+        cad = cad_mass_properties.get(component_ids_by_label.get(label.lower()))
+
+        if cad is None:
+            continue
+
+        result = {}
+        for name in ['Volume', 'Mass']:
+            cad_value = cad.get(name)
+            result['CAD' + name] = cad_value
+            result[name + 'Deviation'] = (part[name] - cad_value) / cad_value if cad_value else None
+
+        deviations = [abs(result[name]) for name in ['VolumeDeviation', 'MassDeviation'] if result[name] is not None]
+        result['WithinTolerance'] = all(deviation <= tolerance for deviation in deviations)
+
+        if not result['WithinTolerance']:
+            logger.warning("{}: mesh volume {:.4g} vs CAD {}, mass {:.4g} vs CAD {}: more than {:.0%} off".format(
+                label, part['Volume'], result['CADVolume'], part['Mass'], result['CADMass'], tolerance))
+
+        comparison[pid] = result
+
+    return comparison
+
+
+def mass_properties_metrics(comparison):
+    """The largest volume and mass deviation over the parts, as {manifest metric name: value}."""
+
+    metrics = {}
+
+    for metric_name, name in [(VOLUME_DEVIATION_METRIC, 'VolumeDeviation'), (MASS_DEVIATION_METRIC, 'MassDeviation')]:
+        deviations = [result[name] for result in comparison.values() if result[name] is not None]
+        if deviations:
+            metrics[metric_name] = max(deviations, key=abs)
+
+    return metrics
+
+
+def update_manifest_metrics(manifest_path, metrics):
+    """Set the Value of each of metrics ({name: value}) in the testbench manifest's Metrics,
+    adding those it does not have."""
+
+    with open(manifest_path, 'r') as f_in:
+        manifest = json.load(f_in)
+
+    manifest_metrics = manifest.setdefault('Metrics', [])
+    by_name = dict((metric.get('Name'), metric) for metric in manifest_metrics)
+
+    for name, value in sorted(metrics.items()):
+        if name in by_name:
+            by_name[name]['Value'] = value
+        else:
+            manifest_metrics.append({'Name': name, 'Value': value, 'Unit': ''})
+
+    temp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+
+    with open(temp_path, 'w') as f_out:
+        json.dump(manifest, f_out, indent=4)
+
+    if os.name == 'nt':
+        os.remove(manifest_path)
+    os.rename(temp_path, manifest_path)
+
+
+def write_mass_properties_csv(csv_path, mass_properties, bdf_index, component_ids_by_label, comparison=None):
+    """One row per property plus a TOTAL row. component_ids_by_label maps Patran part
+    labels (e.g. 'psolid.3', lower case) to ComponentIDs; comparison is compare_mass_properties'."""
+
+    comparison = comparison or {}
+
+    total_volume = 0.0
+    total_mass = 0.0
+    total_moment = [0.0, 0.0, 0.0]
+
+    with open(csv_path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Unique ID", "Part", "Elements", "Mesh Volume", "Density", "Mesh Mass",
+                         "CG X", "CG Y", "CG Z", "CAD Volume", "Volume Deviation", "CAD Mass", "Mass Deviation",
+                         "Within Tolerance"])
+
+        for pid in sorted(mass_properties):
+            part = mass_properties[pid]
+            label = bdf_index.property_label(pid)
+            result = comparison.get(pid, {})
+
+            writer.writerow([component_ids_by_label.get(label.lower(), ''), label, part['Elements'],
+                             part['Volume'], part['Density'], part['Mass']] + list(part['CG']) +
+                            ['' if result.get(name) is None else result[name]
+                             for name in ['CADVolume', 'VolumeDeviation', 'CADMass', 'MassDeviation',
+                                          'WithinTolerance']])
+
+            total_volume += part['Volume']
+            total_mass += part['Mass']
+            for axis in range(3):
+                total_moment[axis] += part['Mass'] * part['CG'][axis]
+
+        total_cg = [m / total_mass for m in total_moment] if total_mass else [0.0, 0.0, 0.0]
+        writer.writerow(['', 'TOTAL', sum(p['Elements'] for p in mass_properties.values()),
+                         total_volume, '', total_mass] + total_cg)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Per-property volume, mass and CG of the CTETRA mesh "
+                                                 "in a Nastran bulk data file")
+    parser.add_argument('bdf', help=".bdf/.nas File Name")
+    parser.add_argument('-csv', default=None, help="Output .csv (default: <bdf>_mass_properties.csv)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if not os.path.exists(args.bdf):
+        print("File not found: {}".format(args.bdf))
+        sys.exit(1)
+
+    bdf_index = BdfIndex.load(args.bdf)
+    csv_path = args.csv or os.path.splitext(args.bdf)[0] + '_mass_properties.csv'
+
+    write_mass_properties_csv(csv_path, compute_mass_properties(bdf_index), bdf_index, {})
+
+    print("Wrote {}".format(csv_path))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+from BdfIndex import split_card_fields
+from NastranRestart import LOAD_SET_COMMENT, NastranRestartError, format_card, nastran_real, \
+    rewrite_patran_card, check_patran_lbcs_found
+
+MESH_CACHE_ENV = 'PATRAN_MESH_CACHE'
+DEFAULT_MAX_GB = 20.0
+
+DECK_FILE_NAME = 'Nastran_mod.bdf'
+KEY_STATE_FILE_NAME = 'mesh_key.json'
+
+# Patran names materials M<ID>_<name> and writes '$ Material Record : <material name>' before each MAT1
+MATERIAL_RECORD_COMMENT = re.compile(r'^\$.*\bMaterial Record\s*:\s*M(\d+)_')
+
+# MAT1 fields set from the model: E, G (left blank, Nastran derives it), NU, RHO, A
+MAT1_FIELDS = [1, 3, 4, 5]
+
+
+def file_sha1(path):
+
+    sha1 = hashlib.sha1()
+
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(1 << 20), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def mesh_key(geometry_path, key_state):
+    """Cache key for a Patran deck: the geometry file's contents and the resolved model it was meshed for."""
+
+    sha1 = hashlib.sha1(file_sha1(geometry_path))
+    sha1.update(json.dumps(key_state, sort_keys=True))
+
+    return sha1.hexdigest()
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def adapt_deck(cached_path, output_path, pressures, fixed_components, materials):
+    """Copy a cached Patran deck to output_path with the pressures and fixed DOFs of its LBCs
+    (see NastranRestart.rewrite_patran_card) and its MAT1 properties (E, NU, RHO, A by
+    Material ID) set from the model. Everything else is copied as is."""
+
+    found = set()
+    found_materials = set()
+
+    with open(cached_path, 'r') as f_in, open(output_path, 'w') as f_out:
+        card_lines = []
+        card_tag = None
+        tag = None
+        bulk = False
+
+        def flush():
+
+            if not card_lines:
+                return
+
+            name = card_lines[0].split(',', 1)[0][:8].rstrip().rstrip('*').upper()
+
+            if name in ['PLOAD4', 'SPC1', 'MAT1'] and card_tag is not None:
+                fields = split_card_fields(card_lines)
+                while fields and not fields[-1]:
+                    fields.pop()
+
+                if name == 'MAT1':
+                    material = materials.get(card_tag[1]) if card_tag[0] == 'Material' else None
+                    if material is not None:
+                        fields.extend([''] * (6 - len(fields)))
+                        fields[2] = ''
+                        for i, value in zip(MAT1_FIELDS, material):
+                            if value is not None:
+                                fields[i] = nastran_real(value)
+                        found_materials.add(card_tag[1])
+                        card_lines[:] = format_card(name, fields)
+                else:
+                    lbc = rewrite_patran_card(name, fields, card_tag[1] if card_tag[0] == 'LBC' else None,
+                                              pressures, fixed_components)
+                    if lbc is not None:
+                        found.add(lbc)
+                        card_lines[:] = format_card(name, fields)
+
+            f_out.write('\n'.join(card_lines) + '\n')
+            del card_lines[:]
+
+        for line in f_in:
+            line = line.rstrip('\r\n')
+            upper = line.strip().upper()
+
+            if not bulk:
+                f_out.write(line + '\n')
+                bulk = upper.startswith('BEGIN') and 'BULK' in upper
+                continue
+
+            if line and line[0] in '+*, \t' and card_lines:
+                card_lines.append(line)
+                continue
+
+            flush()
+
+            if line.startswith('$'):
+                match = LOAD_SET_COMMENT.match(line)
+                if match:
+                    tag = ('LBC', match.group(1))
+                match = MATERIAL_RECORD_COMMENT.match(line)
+                if match:
+                    tag = ('Material', match.group(1))
+                f_out.write(line + '\n')
+            elif line and line[0].isalpha():
+                card_lines.append(line)
+                card_tag = tag
+            else:
+                f_out.write(line + '\n')
+
+        flush()
+
+    missing_materials = sorted(set(materials) - found_materials)
+
+    try:
+        check_patran_lbcs_found(cached_path, found, pressures, fixed_components)
+        if missing_materials:
+            raise NastranRestartError("{}: no MAT1 for Material {}".format(cached_path, ', '.join(missing_materials)))
+    except NastranRestartError:
+        os.remove(output_path)
+        raise
+
+
+class MeshCache():
+    """Patran decks shared between jobs, one directory per mesh_key. Entries are used
+    least recently used first when the cache is over max_bytes."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_GB * 1024 ** 3):
+
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger('MeshCache')
+
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Path of the cached deck for key, or None. Marks the entry as used."""
+
+        entry_dir = self.entry_dir(key)
+        deck_path = os.path.join(entry_dir, DECK_FILE_NAME)
+
+        if not os.path.exists(deck_path):
+            self.logger.info("Mesh cache miss: {}".format(key))
+            return None
+
+        try:
+            os.utime(entry_dir, None)
+        except OSError:
+            pass  # Being evicted; the caller's copy still works on POSIX, and fails cleanly on Windows
+
+        self.logger.info("Mesh cache hit: {}".format(key))
+
+        return deck_path
+
+    def put(self, key, deck_path, key_state):
+        """Store deck_path under key. Another job storing the same key at the same time is harmless."""
+
+        entry_dir = self.entry_dir(key)
+
+        if os.path.exists(entry_dir):
+            return
+
+        temp_dir = '{}.{}.tmp'.format(entry_dir, os.getpid())
+
+        try:
+            os.makedirs(temp_dir)
+            shutil.copy2(deck_path, os.path.join(temp_dir, DECK_FILE_NAME))
+
+            with open(os.path.join(temp_dir, KEY_STATE_FILE_NAME), 'w') as f_out:
+                json.dump(key_state, f_out, indent=4, sort_keys=True)
+
+            # Readers only ever see a complete entry
+            os.rename(temp_dir, entry_dir)
+            self.logger.info("Mesh cache stored: {}".format(key))
+
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not store {} in the mesh cache: {}".format(deck_path, e))
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def entries(self):
+        """(last used, bytes, directory) of every entry, least recently used first."""
+
+        entries = []
+
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isdir(entry_dir):
+                continue
+
+            try:
+                entries.append((os.path.getmtime(entry_dir), directory_size(entry_dir), entry_dir))
+            except OSError:
+                pass
+
+        return sorted(entries)
+
+    def evict(self):
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                total -= size
+                self.logger.info("Mesh cache evicted {} ({} bytes)".format(os.path.basename(entry_dir), size))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="List or trim the shared Patran mesh cache")
+    parser.add_argument('cache_dir', nargs='?', default=os.environ.get(MESH_CACHE_ENV))
+    parser.add_argument('-max_gb', type=float, default=DEFAULT_MAX_GB)
+    parser.add_argument('-evict', action='store_true', help="Trim the cache to -max_gb")
+    args = parser.parse_args()
+
+    if not args.cache_dir:
+        print("No cache directory given and {} is not set".format(MESH_CACHE_ENV))
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    mesh_cache = MeshCache(args.cache_dir, args.max_gb * 1024 ** 3)
+
+    if args.evict:
+        mesh_cache.evict()
+
+    entries = mesh_cache.entries()
+
+    for last_used, size, entry_dir in entries:
+        print("{}  {:>10.1f} MB  {}".format(time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used)),
+                                            size / (1024. * 1024.), os.path.basename(entry_dir)))
+
+    print("{} entries, {:.1f} MB".format(len(entries), sum(size for _, size, _ in entries) / (1024. * 1024.)))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import csv
+import json
+import argparse
+
+
+MESH_CONVERGENCE_DIR_NAME = 'MeshConvergence'
+MESH_CONVERGENCE_FILE_NAME = 'MeshConvergence'
+
+# Each level multiplies every Max_Global_Length by this ratio
+DEFAULT_REFINEMENT_RATIO = 0.7
+
+# Stop once no part's max von Mises changes by more than this fraction between levels
+DEFAULT_TOLERANCE = 0.05
+DEFAULT_MAX_LEVELS = 5
+
+
+def level_length_factor(level, refinement_ratio=DEFAULT_REFINEMENT_RATIO):
+    return refinement_ratio ** level
+
+
+def level_dir_name(level):
+    return 'Mesh_{}'.format(level)
+
+
+def read_part_max_von_mises(out_txt_path):
+    """Max von Mises per Patran part label (e.g. 'psolid.3') over all load cases, from the
+    <filename>_out.txt that patran_pp.pcl writes (rows of type, load case, part, value)."""
+
+    part_max = {}
+
+    with open(out_txt_path, 'r') as f_in:
+        for row in csv.reader(f_in):
+            if len(row) < 4 or row[0] != 'VM':
+                continue
+
+            part = row[2].lower()
+            value = float(row[3])
+
+            if part not in part_max or value > part_max[part]:
+                part_max[part] = value
+
+    return part_max
+
+
+def max_relative_change(previous, current):
+    """Largest |current - previous| / |previous| over the parts of previous.
+    A part missing from current counts as not converged."""
+
+    if not previous:
+        return float('inf')
+
+    change = 0.0
+
+    for part, previous_value in previous.items():
+        if part not in current:
+            return float('inf')
+
+        if previous_value == 0:
+            part_change = 0.0 if current[part] == 0 else float('inf')
+        else:
+            part_change = abs(current[part] - previous_value) / abs(previous_value)
+
+        change = max(change, part_change)
+
+    return change
+
+
+def select_converged_level(levels, tolerance=DEFAULT_TOLERANCE):
+    """The coarsest solved level whose results are within tolerance of the next finer level,
+    or None. levels are dicts in refinement order, as recorded by CADJobDriver."""
+
+    for previous, current in zip(levels, levels[1:]):
+        if previous['Status'] != 'Solved' or current['Status'] != 'Solved':
+            return None
+
+        # A level without post-processed results cannot be compared
+        if 'PartMaxVM' not in previous or 'PartMaxVM' not in current:
+            return None
+
+        current['Change'] = max_relative_change(previous['PartMaxVM'], current['PartMaxVM'])
+
+        if current['Change'] <= tolerance:
+            return previous
+
+    return None
+
+
+def write_convergence_files(convergence_dir, levels, selected, tolerance):
+    """Write MeshConvergence.csv (one row per level) and MeshConvergence.json."""
+
+    parts = sorted(set(part for level in levels for part in level.get('PartMaxVM', {})))
+
+    with open(os.path.join(convergence_dir, MESH_CONVERGENCE_FILE_NAME + '.csv'), 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Level", "Length Factor", "Max Global Length", "Nodes", "Elements", "Runtime (s)",
+                         "Max Change", "Status", "Selected"] + ["Max VM {}".format(p) for p in parts])
+
+        for level in levels:
+            writer.writerow([level['Level'], level['LengthFactor'], level['MaxGlobalLength'], level.get('Nodes', ''),
+                             level.get('Elements', ''), level.get('Runtime', ''), level.get('Change', ''),
+                             level['Status'], level is selected] +
+                            [level.get('PartMaxVM', {}).get(p, '') for p in parts])
+
+    summary = {
+        'Tolerance': tolerance,
+        'SelectedLevel': selected['Level'] if selected is not None else None,
+        'Levels': [dict((k, v) for k, v in level.items() if k != 'PostProcess') for level in levels]
+    }
+
+    with open(os.path.join(convergence_dir, MESH_CONVERGENCE_FILE_NAME + '.json'), 'w') as f_out:
+        json.dump(summary, f_out, indent=4, sort_keys=True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the per-part max von Mises of two Patran_PP "
+                                                 "_out.txt files")
+    parser.add_argument('previous', help="_out.txt of the coarser mesh")
+    parser.add_argument('current', help="_out.txt of the finer mesh")
+    parser.add_argument('-tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    for path in [args.previous, args.current]:
+        if not os.path.exists(path):
+            print("File not found: {}".format(path))
+            sys.exit(1)
+
+    change = max_relative_change(read_part_max_von_mises(args.previous), read_part_max_von_mises(args.current))
+
+    print("Max relative change: {}".format(change))
+
+    if change > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
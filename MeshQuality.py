@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import numpy as np
+from BdfIndex import BdfIndex, ELEMENT_TYPE_CODES
+
+
+MAX_ASPECT_RATIO = 50.0
+MIN_JACOBIAN_RATIO = 0.05
+WORST_ELEMENT_COUNT = 20
+
+MESH_QUALITY_FILE_NAME = 'MeshQuality.json'
+
+# CTETRA midside grids G5..G10 sit on these corner pairs
+TETRA10_EDGES = [(0, 1), (1, 2), (2, 0), (0, 3), (1, 3), (2, 3)]
+
+# Volume coordinate derivatives d(L1..L4)/d(xi, eta, zeta)
+TETRA_DL = np.array([[-1., -1., -1.],
+                     [1., 0., 0.],
+                     [0., 1., 0.],
+                     [0., 0., 1.]])
+
+# The TETRA10 Jacobian is sampled at the corners and the centroid
+TETRA_SAMPLE_POINTS = [(0., 0., 0.), (1., 0., 0.), (0., 1., 0.), (0., 0., 1.), (.25, .25, .25)]
+
+
+def tetra10_shape_derivatives(xi, eta, zeta):
+    """dN/d(xi, eta, zeta) of the 10 TETRA10 shape functions, in Nastran grid order."""
+
+    volume_coords = [1. - xi - eta - zeta, xi, eta, zeta]
+    dn = np.zeros((10, 3))
+
+    for i in range(4):
+        dn[i] = (4. * volume_coords[i] - 1.) * TETRA_DL[i]
+
+    for m, (i, j) in enumerate(TETRA10_EDGES):
+        dn[4 + m] = 4. * (volume_coords[i] * TETRA_DL[j] + volume_coords[j] * TETRA_DL[i])
+
+    return dn
+
+
+def element_coordinates(bdf_index, type_name, grid_count):
+    """Return (element positions, coordinates[elements, grid_count, 3]) for every element
+    of type_name that has exactly grid_count grids."""
+
+    types = np.frombuffer(bdf_index.elem_types, dtype=np.int8)
+    offsets = np.frombuffer(bdf_index.conn_offsets, dtype=np.intc)
+    conn = np.frombuffer(bdf_index.conn, dtype=np.intc)
+    node_ids = np.frombuffer(bdf_index.node_ids, dtype=np.intc)
+    node_xyz = np.frombuffer(bdf_index.node_xyz, dtype=np.float64).reshape(-1, 3)
+
+    counts = np.diff(offsets)
+    positions = np.nonzero((types == ELEMENT_TYPE_CODES[type_name]) & (counts == grid_count))[0]
+
+    grids = conn[offsets[positions][:, None] + np.arange(grid_count)]
+    node_positions = np.searchsorted(node_ids, grids)
+    node_positions = np.minimum(node_positions, len(node_ids) - 1)
+
+    missing = node_ids[node_positions] != grids
+    if missing.any():
+        raise KeyError("GRIDs referenced by {} are not in {}: {}".format(
+            type_name, bdf_index.bdf_path, sorted(set(grids[missing].tolist()))[:10]))
+
+    return positions, node_xyz[node_positions]
+
+
+def tetra_volumes(corners):
+    """Signed volumes of tetrahedra given corners[elements, 4, 3]."""
+
+    a = corners[:, 0]
+    return np.einsum('ij,ij->i', np.cross(corners[:, 1] - a, corners[:, 2] - a), corners[:, 3] - a) / 6.
+
+
+def tetra_aspect_ratios(corners, volumes):
+    """Longest edge over the inscribed sphere diameter, scaled so a regular tetrahedron is 1."""
+
+    edge_lengths = np.stack([np.linalg.norm(corners[:, j] - corners[:, i], axis=1) for i, j in TETRA10_EDGES])
+    longest_edge = edge_lengths.max(axis=0)
+
+    face_area = np.zeros(len(corners))
+    for i, j, k in [(0, 1, 2), (0, 1, 3), (0, 2, 3), (1, 2, 3)]:
+        face_area += 0.5 * np.linalg.norm(
+            np.cross(corners[:, j] - corners[:, i], corners[:, k] - corners[:, i]), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inradius = 3. * np.abs(volumes) / face_area
+        ratios = longest_edge / (2. * np.sqrt(6.) * inradius)
+
+    return np.where(np.isfinite(ratios), ratios, np.inf)
+
+
+def tetra_jacobian_ratios(coords):
+    """min/max of the Jacobian determinant over the sample points. 1 for straight-sided
+    tetrahedra, <= 0 for inverted ones."""
+
+    if coords.shape[1] == 4:
+        determinants = 6. * tetra_volumes(coords)
+        return np.where(determinants > 0, 1., np.sign(determinants))
+
+    determinants = np.stack([
+        np.linalg.det(np.einsum('eni,nj->eij', coords, tetra10_shape_derivatives(*point)))
+        for point in TETRA_SAMPLE_POINTS])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = determinants.min(axis=0) / determinants.max(axis=0)
+
+    # All negative means the element is inside out
+    ratios = np.where(determinants.max(axis=0) <= 0, -1., ratios)
+
+    return np.where(np.isfinite(ratios), ratios, -1.)
+
+
+def check_mesh_quality(bdf_index, max_aspect_ratio=MAX_ASPECT_RATIO, min_jacobian_ratio=MIN_JACOBIAN_RATIO):
+    """Compute aspect ratio, Jacobian ratio and volume of every CTETRA in bulk and
+    compare them with the thresholds. Returns a report dict; report['Passed'] is the gate."""
+
+    logger = logging.getLogger('MeshQuality')
+
+    report = {
+        'Thresholds': {
+            'MaxAspectRatio': max_aspect_ratio,
+            'MinJacobianRatio': min_jacobian_ratio
+        },
+        'Elements': 0,
+        'UncheckedElements': bdf_index.num_elements,
+        'Passed': True
+    }
+
+    if not bdf_index.num_elements or not bdf_index.num_nodes:
+        logger.warning("No elements in {}; mesh quality not checked".format(bdf_index.bdf_path))
+        return report
+
+    positions = []
+    aspect_ratios = []
+    jacobian_ratios = []
+    volumes = []
+
+    for grid_count in (4, 10):
+        element_positions, coords = element_coordinates(bdf_index, 'CTETRA', grid_count)
+        if not len(element_positions):
+            continue
+
+        element_volumes = tetra_volumes(coords[:, :4])
+
+        positions.append(element_positions)
+        volumes.append(element_volumes)
+        aspect_ratios.append(tetra_aspect_ratios(coords[:, :4], element_volumes))
+        jacobian_ratios.append(tetra_jacobian_ratios(coords))
+
+    if not positions:
+        logger.warning("No CTETRA elements in {}; mesh quality not checked".format(bdf_index.bdf_path))
+        return report
+
+    positions = np.concatenate(positions)
+    aspect_ratios = np.concatenate(aspect_ratios)
+    jacobian_ratios = np.concatenate(jacobian_ratios)
+    volumes = np.concatenate(volumes)
+
+    bad_aspect = aspect_ratios > max_aspect_ratio
+    bad_jacobian = jacobian_ratios < min_jacobian_ratio
+    bad_volume = volumes <= 0
+    failed = bad_aspect | bad_jacobian | bad_volume
+
+    elem_ids = np.frombuffer(bdf_index.elem_ids, dtype=np.intc)
+    elem_pids = np.frombuffer(bdf_index.elem_pids, dtype=np.intc)
+
+    # Worst first: inverted/degenerate, then lowest Jacobian ratio, then highest aspect ratio
+    worst = np.lexsort((-aspect_ratios, jacobian_ratios, ~bad_volume))[:WORST_ELEMENT_COUNT]
+
+    report.update({
+        'Elements': int(len(positions)),
+        'UncheckedElements': int(bdf_index.num_elements - len(positions)),
+        'FailedElements': int(failed.sum()),
+        'AspectRatio': {
+            'Max': float(aspect_ratios.max()),
+            'Mean': float(aspect_ratios[np.isfinite(aspect_ratios)].mean()) if np.isfinite(aspect_ratios).any() else None,
+            'Failed': int(bad_aspect.sum())
+        },
+        'JacobianRatio': {
+            'Min': float(jacobian_ratios.min()),
+            'Failed': int(bad_jacobian.sum())
+        },
+        'Volume': {
+            'Min': float(volumes.min()),
+            'Total': float(volumes.sum()),
+            'NonPositive': int(bad_volume.sum())
+        },
+        'WorstElements': [
+            {
+                'ID': int(elem_ids[positions[i]]),
+                'PID': int(elem_pids[positions[i]]),
+                'AspectRatio': float(aspect_ratios[i]),
+                'JacobianRatio': float(jacobian_ratios[i]),
+                'Volume': float(volumes[i])
+            }
+            for i in worst if failed[i]],
+        'Passed': not failed.any()
+    })
+
+    return report
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check the CTETRA mesh quality of a Nastran bulk data file")
+    parser.add_argument('bdf', help=".bdf/.nas File Name")
+    parser.add_argument('-max_aspect_ratio', type=float, default=MAX_ASPECT_RATIO)
+    parser.add_argument('-min_jacobian_ratio', type=float, default=MIN_JACOBIAN_RATIO)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if not os.path.exists(args.bdf):
+        print("File not found: {}".format(args.bdf))
+        sys.exit(1)
+
+    report = check_mesh_quality(BdfIndex.load(args.bdf), args.max_aspect_ratio, args.min_jacobian_ratio)
+
+    with open(MESH_QUALITY_FILE_NAME, 'w') as f_out:
+        json.dump(report, f_out, indent=4, sort_keys=True)
+
+    print(json.dumps(report, indent=4, sort_keys=True))
+
+    if not report['Passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
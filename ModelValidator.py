@@ -0,0 +1,181 @@
+import os
+import sys
+import argparse
+import logging
+
+
+def pcl_number(value):
+    """The number at the start of a PatranPCL value (values may carry a '# comment'), or None."""
+
+    try:
+        return float(str(value).split('#')[0])
+    except ValueError:
+        return None
+
+
+def pcl_id(value):
+    """The integer ID at the start of a PatranPCL value, or None."""
+
+    number = pcl_number(value)
+
+    if number is None or number != int(number):
+        return None
+
+    return int(number)
+
+
+def pcl_text(value):
+    """A PatranPCL value without its '# comment'."""
+
+    return str(value).split('#')[0].strip()
+
+
+def ids_of(items):
+    return set(pcl_id(item['ID']) for item in items)
+
+
+def validate_model(ppcl):
+    """Check a resolved PatranPCL against the rules CreatePatranModel.pcl applies in
+    checkDataStructure (and the ones it finds out about later, in Patran). Returns a list
+    of problem messages, including those recorded while the model was read; empty if the
+    model can go to Patran."""
+
+    problems = list(ppcl.problems)
+
+    material_ids = ids_of(ppcl.materials.values())
+    mesh_parameters_ids = ids_of(ppcl.mesh_parameters.values())
+    geometry_ids = ids_of(ppcl.geometries_by_metric_id.values())
+    subcase_ids = ids_of(ppcl.subcases.values())
+    load_value_ids = ids_of(ppcl.load_values['Scalar'].values())
+    displacement_ids = ids_of(ppcl.constraint_specifiers['Displacement'].values())
+    constraint_ids = ids_of(ppcl.constraints_by_id.values())
+    load_ids = ids_of(ppcl.loads.values())
+
+    # checkDataStructure
+    if not ppcl.solids and not ppcl.surfaces_by_metric_id:
+        problems.append("No solids: there must be at least one PART with a material")
+
+    # checkSolid
+    element_types = set()
+
+    for solid_id, solid in sorted(ppcl.solids.items()):
+        if pcl_id(solid['Material_ID']) not in material_ids:
+            problems.append("Solid {} (ComponentID {}): missing Material with ID {}".format(
+                solid_id, solid['ComponentID'], pcl_text(solid['Material_ID'])))
+
+        if pcl_id(solid['Mesh_Parameters_ID']) not in mesh_parameters_ids:
+            problems.append("Solid {} (ComponentID {}): missing Mesh_Parameters with ID {}".format(
+                solid_id, solid['ComponentID'], pcl_text(solid['Mesh_Parameters_ID'])))
+
+        element_types.add(pcl_text(solid['Element_Type']))
+
+    if len(element_types) > 1:
+        problems.append("Mixed solid element types: {}".format(', '.join(sorted(element_types))))
+
+    # Patran rejects non-positive mesh sizes only after the geometry is imported
+    for mesh_parameters_id, mesh_parameters in sorted(ppcl.mesh_parameters.items()):
+        for name in ['Max_Global_Length', 'Max_Curv_Delta_Div_Edge_Len', 'Ratio_Min_Edge_To_Max_Edge',
+                     'Match_Face_Proximity_Tol']:
+            value = pcl_number(mesh_parameters.get(name))
+            if value is None or value <= 0:
+                problems.append("Mesh_Parameters {}: {} must be a positive number, not '{}'".format(
+                    mesh_parameters_id, name, pcl_text(mesh_parameters.get(name))))
+
+    for material in sorted(ppcl.materials.values(), key=lambda m: m['ID']):
+        if material['Name'].lower() not in ppcl.material_library:
+            continue  # Already reported while the model was read
+
+        for name in ['Elastic_Modulus', 'Poissons_Ratio', 'Density']:
+            if pcl_number(material.get(name)) is None:
+                problems.append("Material {} ({}): {} is not a number: '{}'".format(
+                    material['ID'], material['Name'], name, pcl_text(material.get(name))))
+
+    # checkLoad
+    for load_id, load in sorted(ppcl.loads.items()):
+        if pcl_id(load['SubCase_ID']) not in subcase_ids:
+            problems.append("Load {}: missing SubCase with ID {}".format(load_id, pcl_text(load['SubCase_ID'])))
+
+        if pcl_id(load['Geometry_ID']) not in geometry_ids:
+            problems.append("Load {} {}: missing Geometry".format(load_id, load['Comments']))
+
+        if pcl_id(load['Load_Value_ID']) not in load_value_ids:
+            problems.append("Load {}: missing Load_Value with ID {}".format(load_id, pcl_text(load['Load_Value_ID'])))
+
+    # checkConstraint
+    for constraint_id, constraint in sorted(ppcl.constraints_by_id.items()):
+        if pcl_id(constraint['SubCase_ID']) not in subcase_ids:
+            problems.append("Constraint {}: missing SubCase with ID {}".format(
+                constraint_id, pcl_text(constraint['SubCase_ID'])))
+
+        if pcl_id(constraint['Geometry_ID']) not in geometry_ids:
+            problems.append("Constraint {} ({}): missing Geometry".format(constraint_id, constraint['Comments']))
+
+        if pcl_id(constraint['Displacement_ID']) not in displacement_ids:
+            problems.append("Constraint {}: missing Displacement with ID {}".format(
+                constraint_id, pcl_text(constraint['Displacement_ID'])))
+
+    # checkLayer
+    for layer_id, layer in sorted(ppcl.layers.items()):
+        if pcl_id(layer['Material_ID']) not in material_ids:
+            problems.append("Layer {}: missing Material with ID {}".format(layer_id, pcl_text(layer['Material_ID'])))
+
+    # checkSubcase (commented out in the PCL) and createLoadCases
+    for subcase_id, subcase in sorted(ppcl.subcases.items()):
+        if constraint_ids and pcl_id(subcase['Constraint_ID']) not in constraint_ids:
+            problems.append("SubCase {}: missing Constraint with ID {}".format(
+                subcase_id, pcl_text(subcase['Constraint_ID'])))
+
+        if len(ppcl.subcases) > 1 and pcl_id(subcase['Load_ID']) not in load_ids:
+            problems.append("SubCase {} ({}): no loads".format(subcase_id, subcase['Comments']))
+
+    if ppcl.surfaces_by_metric_id or ppcl.layups:
+        element_type = pcl_text(ppcl.pcl_globals['Surface_Element_Type'])
+        if element_type not in ['QUAD4']:
+            problems.append("Unsupported ShellElementType: Surface_Element_Type is '{}'".format(element_type))
+
+    geometry_file_name = ppcl.pcl_globals.get('Geometry_File_Name')
+
+    if geometry_file_name is None:
+        problems.append("No geometry file: CADAssembly.xml must have exactly one CADComponent of Type ASSEMBLY")
+    else:
+        geometry_path = ppcl.geometry_path()
+        if not os.path.exists(geometry_path):
+            problems.append("Geometry file not found: {}".format(os.path.normpath(geometry_path)))
+
+    return problems
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Check CADAssembly.xml, CADAssembly_metrics.xml and "
+                                                 "ComputedValues.xml before Patran is started")
+    parser.add_argument('-cadassembly', default="CADAssembly.xml")
+    parser.add_argument('-cadassembly_metrics', default="CADAssembly_metrics.xml")
+    parser.add_argument('-computedvalues', default="ComputedValues.xml")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    from CreatePatranInputFile import PatranPCL, PatranPCLError
+
+    try:
+        ppcl = PatranPCL(args.cadassembly, args.cadassembly_metrics, args.computedvalues)
+    except PatranPCLError as e:
+        print(e)
+        sys.exit(1)
+
+    problems = validate_model(ppcl)
+    ppcl.close()
+
+    for problem in problems:
+        print(problem)
+
+    if problems:
+        sys.exit(1)
+
+    print("No problems found")
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,342 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import logging
+from BdfIndex import split_card_fields
+
+RESTART_DECK_NAME = 'Nastran_restart.bdf'
+RESTART_STATE_EXTENSION = '.restart.json'
+
+# Bulk data cards that only define loads and constraints. Changing them leaves the assembled
+# stiffness in the database valid; Nastran's automatic restart works out what to recompute.
+LOAD_CARDS = frozenset(['FORCE', 'FORCE1', 'FORCE2', 'MOMENT', 'MOMENT1', 'MOMENT2', 'PLOAD', 'PLOAD1',
+                        'PLOAD2', 'PLOAD4', 'GRAV', 'ACCEL', 'ACCEL1', 'RFORCE', 'SLOAD', 'LOAD', 'TEMP',
+                        'TEMPD', 'SPC', 'SPC1', 'SPCD', 'SPCADD'])
+
+# Case control requests that select a load or SPC set
+SET_REQUEST = re.compile(r'^(\s*(?:LOAD|SPC|TEMP(?:ERATURE)?\s*\(\s*LOAD\s*\))\s*=\s*)(\d+)', re.IGNORECASE)
+
+# Patran writes a comment like '$ Pressures of Load Set : Load_Set_2' before each LBC's cards
+LOAD_SET_COMMENT = re.compile(r'^\$.*\bLoad Set\s*:\s*(\S+)')
+
+# File management statements that belong to the run, not to the model
+FMS_STATEMENTS = ('RESTART', 'ASSIGN', 'INIT')
+
+
+class NastranRestartError(Exception):
+    pass
+
+
+def set_id_positions(name, fields):
+    """Data field positions of a load card that hold a load or SPC set ID."""
+
+    if name == 'LOAD':
+        return [0] + range(3, len(fields), 2)     # SID, S, S1, L1, S2, L2, ...
+    if name == 'SPCADD':
+        return range(len(fields))                 # SID, S1, S2, ...
+    if name == 'TEMPD':
+        return range(0, len(fields), 2)           # SID1, T1, SID2, T2, ...
+    return [0]
+
+
+def nastran_real(value):
+    """A float as a Nastran real field, e.g. 1e-05 -> '1.E-05'."""
+
+    text = repr(float(value)).upper()
+    mantissa, e, exponent = text.partition('E')
+
+    if '.' not in mantissa:
+        mantissa += '.'
+
+    return mantissa + e + exponent
+
+
+def format_card(name, fields):
+    """Card lines in small field format, or large field if a field does not fit in 8 characters."""
+
+    large = any(len(field) > 8 for field in fields)
+    width, per_line = (16, 4) if large else (8, 8)
+    lines = []
+
+    for start in range(0, max(len(fields), 1), per_line):
+        chunk = fields[start:start + per_line]
+
+        if start == 0:
+            head = (name + '*' if large else name).ljust(8)
+        else:
+            head = '*'.ljust(8) if large else ' ' * 8
+
+        lines.append((head + ''.join(field.ljust(width) for field in chunk)).rstrip())
+
+    return lines
+
+
+class Card():
+
+    def __init__(self, name, fields, load_set=None):
+        self.name = name
+        self.fields = fields
+        self.load_set = load_set
+
+
+class Deck():
+    """The run-time parts of a Nastran deck: executive and case control, the load and constraint
+    cards, and a digest of everything else in the bulk data (the model the stiffness depends on)."""
+
+    def __init__(self, path):
+
+        self.path = path
+
+        self.executive = []
+        self.case_control = []
+        self.load_cards = []
+        self.stiffness_digest = None
+
+        self.read()
+
+    def read(self):
+
+        digest = hashlib.sha1()
+        section = 'executive'
+        card_lines = None
+        card_load_set = None
+        load_set = None
+
+        with open(self.path, 'r') as f_in:
+            for line in f_in:
+                line = line.rstrip('\r\n')
+
+                if section != 'bulk':
+                    upper = line.strip().upper()
+
+                    if section == 'executive':
+                        self.executive.append(line)
+                        if upper.startswith('CEND'):
+                            section = 'case'
+                    elif upper.startswith('BEGIN') and 'BULK' in upper:
+                        section = 'bulk'
+                    else:
+                        self.case_control.append(line)
+                    continue
+
+                if not line:
+                    continue
+
+                if line[0] == '$':
+                    match = LOAD_SET_COMMENT.match(line)
+                    if match:
+                        load_set = match.group(1)
+                    continue
+
+                if line[0] in '+*, \t':
+                    if card_lines is not None and line.strip():
+                        card_lines.append(line)
+                    continue
+
+                if card_lines is not None:
+                    self.add_card(card_lines, card_load_set, digest)
+
+                name = line.split(',', 1)[0][:8].rstrip().rstrip('*').upper()
+
+                if name == 'ENDDATA':
+                    card_lines = None
+                    break
+
+                if name == 'INCLUDE':
+                    raise NastranRestartError("{}: INCLUDE is not supported".format(self.path))
+
+                card_lines = [line]
+                card_load_set = load_set
+
+        if card_lines is not None:
+            self.add_card(card_lines, card_load_set, digest)
+
+        if section != 'bulk':
+            raise NastranRestartError("{}: no BEGIN BULK".format(self.path))
+
+        self.stiffness_digest = digest.hexdigest()
+
+    def add_card(self, card_lines, load_set, digest):
+
+        name = card_lines[0].split(',', 1)[0][:8].rstrip().rstrip('*').upper()
+        fields = split_card_fields(card_lines)
+
+        while fields and not fields[-1]:
+            fields.pop()
+
+        if name in LOAD_CARDS:
+            self.load_cards.append(Card(name, fields, load_set))
+        else:
+            digest.update(name + ',' + ','.join(fields) + '\n')
+
+    def max_set_id(self):
+
+        set_ids = [0]
+
+        for card in self.load_cards:
+            set_ids.extend(int(card.fields[i]) for i in set_id_positions(card.name, card.fields)
+                           if i < len(card.fields) and card.fields[i].isdigit())
+
+        for line in self.case_control:
+            match = SET_REQUEST.match(line)
+            if match:
+                set_ids.append(int(match.group(2)))
+
+        return max(set_ids)
+
+    def run_statements(self):
+        """Executive control without the file management statements."""
+
+        return [line for line in self.executive if not line.strip().upper().startswith(FMS_STATEMENTS)]
+
+    def rewrite_patran_loads(self, pressures, fixed_components):
+        """Set the pressures and fixed DOFs of the deck's Patran LBCs; see rewrite_patran_card.
+        Every LBC in the arguments must be found in the deck."""
+
+        found = set()
+
+        for card in self.load_cards:
+            found.add(rewrite_patran_card(card.name, card.fields, card.load_set, pressures, fixed_components))
+
+        check_patran_lbcs_found(self.path, found, pressures, fixed_components)
+
+
+def rewrite_patran_card(name, fields, load_set, pressures, fixed_components):
+    """Set the pressure of a 'Load_Set_<load ID>' PLOAD4 or the fixed DOFs of a
+    'Constraint_Set_<constraint ID>' SPC1 in place. Returns the LBC name if the card was one
+    of those, else None."""
+
+    if load_set is None:
+        return None
+
+    prefix, _, lbc_id = load_set.rpartition('_')
+
+    if prefix == 'Load_Set' and name == 'PLOAD4' and lbc_id in pressures:
+        value = nastran_real(pressures[lbc_id])
+        for i in range(2, min(len(fields), 6)):
+            if i == 2 or fields[i]:
+                fields[i] = value
+        return load_set
+
+    if prefix == 'Constraint_Set' and name == 'SPC1' and lbc_id in fixed_components:
+        fields[1] = fixed_components[lbc_id]
+        return load_set
+
+    return None
+
+
+def check_patran_lbcs_found(deck_path, found, pressures, fixed_components):
+
+    expected = set(['Load_Set_' + i for i in pressures] + ['Constraint_Set_' + i for i in fixed_components])
+    missing = sorted(expected - found)
+
+    if missing:
+        raise NastranRestartError("{}: no cards for {}".format(deck_path, ', '.join(missing)))
+
+
+def database_master(database_prefix):
+    return database_prefix + '.MASTER'
+
+
+def read_restart_state(database_prefix):
+    """What write_restart_state recorded about the database, or None if there is no usable one."""
+
+    state_path = database_prefix + RESTART_STATE_EXTENSION
+
+    if not os.path.exists(state_path) or not os.path.exists(database_master(database_prefix)):
+        return None
+
+    with open(state_path, 'r') as f_in:
+        return json.load(f_in)
+
+
+def write_restart_state(database_prefix, deck, max_set_id=None):
+    """Record the model a kept database was built from, after Nastran finished with it."""
+
+    state = {
+        'Deck': os.path.abspath(deck.path),
+        'StiffnessDigest': deck.stiffness_digest,
+        'MaxSetId': max(max_set_id or 0, deck.max_set_id())
+    }
+
+    with open(database_prefix + RESTART_STATE_EXTENSION, 'w') as f_out:
+        json.dump(state, f_out, indent=4, sort_keys=True)
+
+
+def can_restart(deck, state):
+    """True if deck has the model (everything but loads and constraints) the database was built from."""
+
+    return state is not None and state['StiffnessDigest'] == deck.stiffness_digest
+
+
+def write_restart_deck(deck, database_prefix, state, restart_path=RESTART_DECK_NAME):
+    """Write a deck that restarts from database_prefix with the loads and constraints in deck.
+
+    Every load and SPC set is renumbered above any set ID the database has seen, so the new
+    cards only add to the stored bulk data and nothing has to be deleted from it. Returns the
+    path written and the new largest set ID (for write_restart_state)."""
+
+    offset = 10 ** len(str(max(deck.max_set_id(), state['MaxSetId'])))
+
+    lines = ["$ Restart of {} written by NastranRestart.py".format(database_master(database_prefix)),
+             "RESTART VERSION=LAST,KEEP",
+             "ASSIGN MASTER='{}'".format(os.path.abspath(database_master(database_prefix)))]
+
+    lines.extend(deck.run_statements())
+
+    for line in deck.case_control:
+        match = SET_REQUEST.match(line)
+        if match:
+            line = match.group(1) + str(int(match.group(2)) + offset) + line[match.end():]
+        lines.append(line)
+
+    lines.append("BEGIN BULK")
+
+    for card in deck.load_cards:
+        fields = list(card.fields)
+        for i in set_id_positions(card.name, fields):
+            if i < len(fields) and fields[i].isdigit():
+                fields[i] = str(int(fields[i]) + offset)
+        lines.extend(format_card(card.name, fields))
+
+    lines.append("ENDDATA")
+
+    with open(restart_path, 'w') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+
+    return restart_path, deck.max_set_id() + offset
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Write a Nastran restart deck if a deck differs from the one "
+                                                 "a kept database was built from only in loads and constraints")
+    parser.add_argument('deck', help="The new deck")
+    parser.add_argument('database', help="Database prefix, e.g. Nastran_mod for Nastran_mod.MASTER")
+    parser.add_argument('-o', default=RESTART_DECK_NAME, help="Restart deck to write")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    try:
+        deck = Deck(args.deck)
+    except NastranRestartError as e:
+        print(e)
+        sys.exit(1)
+
+    state = read_restart_state(args.database)
+
+    if not can_restart(deck, state):
+        print("No restart: {}".format("no kept database" if state is None else "the model changed"))
+        sys.exit(1)
+
+    restart_path, _ = write_restart_deck(deck, args.database, state, args.o)
+    print("Wrote {}".format(restart_path))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -1,6 +1,5 @@
 import sys
 import argparse
-import shutil
 from subprocess import call
 import os
 # from xml.etree.ElementTree import Element, SubElement, ElementTree, Comment
@@ -8,7 +7,24 @@ import ComputedMetricsSummary
 import UpdateReportJson_CAD
 import logging
 import csv
-import _winreg
+from ArtifactStaging import stage_file
+from QueueLogging import add_queued_handler, add_queued_file_handler, remove_queued_handler
+from ToolPaths import tool_paths
+from StressHotspots import DEFAULT_HOTSPOT_COUNT
+from ResultsStore import ResultsStore, hash_file, RESULTS_DB_ENV, ENVELOPE_LOAD_CASE
+
+
+SESSION_STRING_LENGTHS = {
+    'dir': 262,
+    'filename': 64,
+    'bdfPath': 262,
+    'xdbPath': 262
+}
+
+BATCH_SESSION_NAME = 'Patran_PP_Batch'
+
+# DEBUG adds a dump of every component to PostProcess_Log.txt
+LOG_LEVEL_ENV = 'PATRAN_PP_LOG_LEVEL'
 
 
 def recurselist(component, componentList):
@@ -27,6 +43,7 @@ def ParseOutFile(outfilename, gComponentList):
     part  = 2
     value = 3
     ##########
+    rows = []
     ifile = open(outfilename)
     reader = csv.reader(ifile)
     for row in reader:
@@ -34,7 +51,22 @@ def ParseOutFile(outfilename, gComponentList):
             # MetaData : PSOLID_3 || PatranOutput : PSOLID.3
             eID = '.'.join(gComponentList[component].ElementID.rsplit('_', 1)).lower()
             if eID == row[part].lower():
-                gComponentList[component].FEAResults[row[mtype]] = float(row[value])
+                SetEnvelopeResult(gComponentList[component], row[mtype], float(row[value]))
+                rows.append((component, row[lcase], row[mtype], float(row[value])))
+    return rows
+
+
+def SetEnvelopeResult(component, mtype, value):
+    # One row per load case (subcase); a part's result is the worst case over all of them
+    if mtype not in component.FEAResults or value > component.FEAResults[mtype]:
+        component.FEAResults[mtype] = value
+
+
+def ApplyResultRows(rows, gComponentList):
+    # Same effect as ParseOutFile, from (component, load case, type, value) rows read back from a ResultsStore
+    for component, lcase, mtype, value in rows:
+        if lcase != ENVELOPE_LOAD_CASE and component in gComponentList:
+            SetEnvelopeResult(gComponentList[component], mtype, value)
 
 
 class Patran_PostProcess:
@@ -44,10 +76,12 @@ class Patran_PostProcess:
                  xdb_filename,
                  meta_data_file,
                  requested_metrics,
-                 results_json):
+                 results_json,
+                 results_db=None,
+                 log_mode='w'):
 
         self.logger = None
-        self.get_logger()
+        self.get_logger(log_mode)
 
         if not os.path.exists(nas_filename):
             msg = "File not found: {}".format(nas_filename)
@@ -79,12 +113,29 @@ class Patran_PostProcess:
 
         self.results_json = results_json
 
+        # Optional SQLite results store shared across runs
+        if results_db is None:
+            results_db = os.environ.get(RESULTS_DB_ENV)
+
+        self.results_db = results_db
+        self._model_hash = None
+
+        self.hotspot_count = DEFAULT_HOTSPOT_COUNT
+        self.mass_properties_tolerance = None   # MassProperties.MASS_PROPERTIES_TOLERANCE
+
+        # CAD mass properties, next to the testbench manifest in the result directory
+        self.cad_metrics_file = os.path.join(os.path.dirname(results_json), 'CADAssembly_metrics.xml')
+
         filename = xdb_filename.split(".")[0]
         self._filename = filename.replace("_nas_mod","")
-        self._bdf_file_name = filename + ".bdf"
 
-        if nas_filename != self._bdf_file_name:
-            shutil.copy2(nas_filename, self._bdf_file_name)
+        # Patran's nastran_input_import needs a .bdf extension; otherwise hand it the original deck.
+        if os.path.splitext(nas_filename)[1].lower() == '.bdf':
+            self._bdf_file_name = nas_filename
+        else:
+            self._bdf_file_name = filename + ".bdf"
+            method = stage_file(nas_filename, self._bdf_file_name, self.logger)
+            self.logger.info("Staged {} as {} ({})".format(nas_filename, self._bdf_file_name, method))
 
         self._xdb_file_name = xdb_filename
         self._lib_file_name = 'patran_pp.pcl'
@@ -92,19 +143,23 @@ class Patran_PostProcess:
         self.meta_bin_cad = None
         self.pp_pcl_path = None
         self.PATRAN_PATH = None
-        self.LATEST_PATRAN_VERSION = None
 
         self.get_paths_from_keys()
 
-    def get_logger(self):
+    def get_logger(self, mode='w'):
 
-        self.logger = logging.getLogger('Patran_PostProcess')
-        handler = logging.FileHandler('PostProcess_Log.txt', 'w')
+        # One child logger per directory, like PatranPCL, so a batch writes each job's log to its own file;
+        # mode 'a' continues a log run_batch started
+        self.logger = logging.getLogger('Patran_PostProcess.{}'.format(os.getcwd().replace('.', '_')))
         formatter = logging.Formatter(
             '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.DEBUG)
+        add_queued_file_handler(self.logger, 'PostProcess_Log.txt', mode, formatter)
+        self.logger.setLevel(logging.getLevelName(os.environ.get(LOG_LEVEL_ENV, 'INFO').upper()))
+
+    def close(self):
+        """Write out and close PostProcess_Log.txt."""
+
+        remove_queued_handler(self.logger)
 
     def pre_process_cleanup(self):
         db_name = self._filename + ".db"
@@ -115,6 +170,33 @@ class Patran_PostProcess:
         if os.path.exists(out_txt_name):
             os.remove(out_txt_name)
 
+    def session_job_lines(self, declare=True):
+        """PCL session lines that post-process this job from Patran's current directory.
+        With declare=False the STRING variables are assigned rather than declared and Patran
+        is left running, so several jobs can share one session file (see run_batch_patran)."""
+
+        values = [
+            ('dir', '.\\'),
+            ('filename', self._filename),
+            ('bdfPath', self._bdf_file_name),
+            ('xdbPath', self._xdb_file_name)
+        ]
+
+        lines = []
+
+        for name, value in values:
+            if declare:
+                lines.append("STRING {}[{}] = '{}'".format(name, SESSION_STRING_LENGTHS[name], value))
+            else:
+                lines.append("{} = '{}'".format(name, value))
+
+        if declare:
+            lines.append("Patran_PP(patranDir, dir, filename, bdfPath, xdbPath)")
+        else:
+            lines.append("vPostProcessing.postProcessProject(dir, filename, bdfPath, xdbPath, FALSE)")
+
+        return lines
+
     def create_session_file(self):
         self.logger.debug("Filename: {}".format(self._filename))
 
@@ -123,11 +205,7 @@ class Patran_PostProcess:
         with open(self._filename + "_PP.ses", "w") as ses_out:
             ses_out.write("!!compile {} into patran_pp.plb{}".format(self._lib_file_name, new_line))
             ses_out.write("!!library patran_pp.plb{}".format(new_line))
-            ses_out.write("STRING dir[262] = '.\\'{}".format(new_line))
-            ses_out.write("STRING filename[64] = '{}'{}".format(self._filename, new_line))
-            ses_out.write("STRING bdfPath[262] = '{}'{}".format(self._bdf_file_name, new_line))
-            ses_out.write("STRING xdbPath[262] = '{}'{}".format(self._xdb_file_name, new_line))
-            ses_out.write("Patran_PP(patranDir, dir, filename, bdfPath, xdbPath)")
+            ses_out.write(new_line.join(self.session_job_lines()))
 
     def run_patran(self):
 
@@ -147,16 +225,142 @@ class Patran_PostProcess:
 
         return status
 
-    def update_results_files(self):
+    def get_model_hash(self):
+        if self._model_hash is None:
+            self._model_hash = hash_file(self._bdf_file_name)
+        return self._model_hash
+
+    def get_configuration_id(self, gComponentList):
+        for component in gComponentList.values():
+            if component.IsConfigurationID:
+                return component.ComponentID
+        return ''
+
+    def get_cached_results(self):
+        """Rows stored for this configuration and model hash, or None if there are none."""
+
+        if not self.results_db or not os.path.exists(self.results_db) or not os.path.exists(self._bdf_file_name):
+            return None
+
+        gComponentList = ComputedMetricsSummary.ParseMetaDataFile(self.meta_data_file, None, None)
+        config_id = self.get_configuration_id(gComponentList)
+
+        store = ResultsStore(self.results_db)
+        try:
+            rows = store.get_results(config_id, self.get_model_hash())
+        finally:
+            store.close()
+
+        return rows if rows else None
+
+    def store_results(self, gComponentList, result_rows):
+
+        rows = list(result_rows)
+        for component_id, component in gComponentList.items():
+            for mtype in ['VM', 'FOS']:
+                if mtype in component.FEAResults:
+                    rows.append((component_id, ENVELOPE_LOAD_CASE, mtype, component.FEAResults[mtype]))
+
+        try:
+            store = ResultsStore(self.results_db)
+            try:
+                store.upsert_results(self.get_configuration_id(gComponentList), self.get_model_hash(), rows,
+                                     os.getcwd())
+            finally:
+                store.close()
+
+            self.logger.info("Stored {} result rows in {}".format(len(rows), self.results_db))
+
+        except Exception as e:
+            self.logger.error("Could not store results in {}: {}".format(self.results_db, e))
+
+    def write_hotspots(self, gComponentList):
+        """Write <filename>_hotspots.csv with the highest-stress elements of each part,
+        read from the Nastran .f06. Skipped (with a warning) if the .f06 is missing."""
+
+        f06_name = self._filename + ".f06"
+
+        if not os.path.exists(f06_name):
+            self.logger.warning("File not found: {}; no stress hotspots written".format(f06_name))
+            return
+
+        from BdfIndex import BdfIndex
+        from StressHotspots import find_solid_hotspots, write_hotspots_csv
+
+        try:
+            bdf_index = BdfIndex.load(self._bdf_file_name)
+            hotspots = find_solid_hotspots(f06_name, bdf_index, self.hotspot_count)
+
+            write_hotspots_csv(self._filename + "_hotspots.csv", hotspots, bdf_index,
+                               self.get_component_ids_by_label(gComponentList))
+
+        except Exception as e:
+            self.logger.error("Could not extract stress hotspots: {}".format(e))
+
+    def write_mass_properties(self, gComponentList):
+        """Write <filename>_mass_properties.csv with the meshed volume, mass and CG of each
+        part, and how far they are off the CAD mass properties in CADAssembly_metrics.xml.
+        Returns the largest deviations as manifest metrics ({} if there are none)."""
+
+        try:
+            from MassProperties import compute_mass_properties, write_mass_properties_csv, \
+                read_cad_mass_properties, compare_mass_properties, mass_properties_metrics, MASS_PROPERTIES_TOLERANCE
+        except ImportError as e:
+            self.logger.warning("Mesh mass properties not computed ({})".format(e))
+            return {}
+
+        from BdfIndex import BdfIndex
+
+        try:
+            bdf_index = BdfIndex.load(self._bdf_file_name)
+            mass_properties = compute_mass_properties(bdf_index)
+            component_ids_by_label = self.get_component_ids_by_label(gComponentList)
+
+            comparison = {}
+            if os.path.exists(self.cad_metrics_file):
+                comparison = compare_mass_properties(mass_properties, bdf_index, component_ids_by_label,
+                                                     read_cad_mass_properties(self.cad_metrics_file, self.logger),
+                                                     self.mass_properties_tolerance or MASS_PROPERTIES_TOLERANCE,
+                                                     self.logger)
+            else:
+                self.logger.warning("File not found: {}; mesh mass properties not compared with the CAD".format(
+                    self.cad_metrics_file))
+
+            write_mass_properties_csv(self._filename + "_mass_properties.csv", mass_properties, bdf_index,
+                                      component_ids_by_label, comparison)
+
+            for pid in sorted(mass_properties):
+                self.logger.info("{}: mesh volume {}, mass {}, CG {}".format(
+                    bdf_index.property_label(pid), mass_properties[pid]['Volume'], mass_properties[pid]['Mass'],
+                    mass_properties[pid]['CG']))
+
+            return mass_properties_metrics(comparison)
+
+        except Exception as e:
+            self.logger.error("Could not compute mesh mass properties: {}".format(e))
+            return {}
+
+    def get_component_ids_by_label(self, gComponentList):
+        component_ids_by_label = {}
+        for component_id, component in gComponentList.items():
+            if component.CadType == "PART":
+                # MetaData : PSOLID_3 || Patran : PSOLID.3
+                component_ids_by_label['.'.join(component.ElementID.rsplit('_', 1)).lower()] = component_id
+        return component_ids_by_label
+
+    def update_results_files(self, cached_rows=None):
         status = True
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         gComponentList = ComputedMetricsSummary.ParseMetaDataFile(self.meta_data_file, None, None)
 
-        if not os.path.exists(self._filename + "_out.txt"):
-            msg = "File not found: {}".format(self._filename + "_out.txt")
-            self.logger.error(msg)
-            
+        if cached_rows is None:
+            if not os.path.exists(self._filename + "_out.txt"):
+                msg = "File not found: {}".format(self._filename + "_out.txt")
+                self.logger.error(msg)
 
-        ParseOutFile(self._filename + "_out.txt", gComponentList)
+            result_rows = ParseOutFile(self._filename + "_out.txt", gComponentList)
+        else:
+            ApplyResultRows(cached_rows, gComponentList)
         reqMetrics = ComputedMetricsSummary.ParseReqMetricsFile(self.requested_metrics, gComponentList)
         
         for component in gComponentList.values():
@@ -167,7 +371,8 @@ class Patran_PostProcess:
                 if component.ComponentID in comp.Children and not comp.IsConfigurationID:
                     # component is actually a child, so parent's metric data
                     # should be updated - provided that child metrics are larger
-                    self.logger.debug(comp)
+                    if debug:
+                        self.logger.debug(comp)
                     if 'FactorOfSafety' in component.MetricsInfo:
                         component.MetricsInfo['FactorOfSafety'] = comp.MetricsInfo['FactorOfSafety']
                     if 'VonMisesStress' in component.MetricsInfo:
@@ -192,12 +397,15 @@ class Patran_PostProcess:
                     writer.writerow([component.ComponentID,
                                      str(component.Allowables.mechanical__strength_tensile), \
                                      str(component.FEAResults["VM"]),str(component.FEAResults["FOS"])])
+
+        self.write_hotspots(gComponentList)
+        mass_properties_metrics = self.write_mass_properties(gComponentList)
                     
         ################  Populate Assembly Results  #########
         for component in gComponentList.values():
-            self.logger.info('ComponentID: {}'.format(component.ComponentID))
-            self.logger.info(component)
-            self.logger.info('')
+            if debug:
+                self.logger.debug('ComponentID: {}'.format(component.ComponentID))
+                self.logger.debug(component)
             if component.CadType == "ASSEMBLY" and not component.IsConfigurationID:
                 FOS = []
                 VM = []
@@ -210,12 +418,20 @@ class Patran_PostProcess:
                 component.MetricsOutput[component.MetricsInfo['VonMisesStress']] = max(VM)
 
 
+        ################  Results Database  #################
+        if self.results_db and cached_rows is None:
+            self.store_results(gComponentList, result_rows)
+
         ################  Populate Metrics  #################
         computedValuesXml = ComputedMetricsSummary.WriteXMLFile(gComponentList)
         
         ################  Update Results Json  ##############
         if os.path.exists(self.results_json):
             UpdateReportJson_CAD.update_manifest(self.results_json, computedValuesXml)
+
+            if mass_properties_metrics:
+                from MassProperties import update_manifest_metrics
+                update_manifest_metrics(self.results_json, mass_properties_metrics)
         else:
             self.logger.error("Could not update file: {}, file does not exist.".format(self.results_json))
             status = False
@@ -225,74 +441,230 @@ class Patran_PostProcess:
         return status
 
     def get_paths_from_keys(self):
+        """META and Patran install paths; looked up once per process and cached (see ToolPaths)."""
 
-        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE,
-                             r'Software\META',
-                             0,
-                             _winreg.KEY_READ | _winreg.KEY_WOW64_32KEY) as key:
+        paths = tool_paths()
 
-            META_PATH = _winreg.QueryValueEx(key, 'META_PATH')[0]
-            self.meta_bin_cad = os.path.join(META_PATH, 'bin', 'CAD')
+        self.meta_bin_cad = os.path.join(paths.get('MetaPath'), 'bin', 'CAD')
+        self.PATRAN_PATH = paths.get('PatranPath')
 
-        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE,
-                             r'Software\Wow6432Node\MSC.Software Corporation\Patran x64\Latest',
-                             0,
-                             _winreg.KEY_READ | _winreg.KEY_WOW64_32KEY) as key:
+        # A missing library is reported by main() and run_batch_patran
+        self.pp_pcl_path = os.path.join(self.meta_bin_cad, self._lib_file_name)
 
-            self.LATEST_PATRAN_VERSION = _winreg.QueryValueEx(key, '')[0]
 
-        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE,
-                             r'Software\Wow6432Node\MSC.Software Corporation\Patran x64\\' + self.LATEST_PATRAN_VERSION,
-                             0,
-                             _winreg.KEY_READ | _winreg.KEY_WOW64_32KEY) as key:
+    def main(self):
 
-            self.PATRAN_PATH = _winreg.QueryValueEx(key, 'Path')[0]
+        cached_rows = self.get_cached_results()
 
-        self.pp_pcl_path = os.path.join(self.meta_bin_cad, self._lib_file_name)
+        if cached_rows is not None:
+            self.logger.info("Results for model hash {} found in {}; skipping Patran".format(
+                self.get_model_hash(), self.results_db))
 
+        else:
+            if not os.path.exists(self.pp_pcl_path):
+                msg = "File not found in Meta-Tools installation: {}".format(self.pp_pcl_path)
+                self.logger.error(msg)
+                sys.exit(1)
 
-    def main(self):
+            stage_file(self.pp_pcl_path, os.getcwd(), self.logger)
 
-        if not os.path.exists(self.pp_pcl_path):
-            msg = "File not found in Meta-Tools installation: {}".format(self.pp_pcl_path)
-            self.logger.error(msg)
-            sys.exit(1)
+            success = self.run_patran()
 
-        shutil.copy2(self.pp_pcl_path, os.getcwd())
+            if not success:
+                msg = "post_process.run_patran() returned false"
+                self.logger.error(msg)
+                sys.exit(1)
 
-        success = self.run_patran()
+        success = self.update_results_files(cached_rows)
 
         if not success:
-            msg = "post_process.run_patran() returned false"
+            msg = "post_process.update_results_files() returned false"
             self.logger.error(msg)
             sys.exit(1)
 
-        success = self.update_results_files()
 
+def update_results_in_dir(job):
+    """Pool worker for batch mode: run the Python half of post-processing in one
+    result directory, with the cached rows and model hash run_batch already looked up.
+    Returns (job_dir, success, message)."""
+
+    job_dir, file_names, cached_rows, model_hash = job
+
+    try:
+        os.chdir(job_dir)
+        post_process = Patran_PostProcess(*file_names, log_mode='a')
+        try:
+            post_process._model_hash = model_hash
+            success = post_process.update_results_files(cached_rows)
+        finally:
+            post_process.close()
+        return job_dir, success, '' if success else 'update_results_files() returned false'
+
+    except Exception:
+        import traceback
+        return job_dir, False, traceback.format_exc()
+
+
+def run_batch(job_dirs, file_names, workers=None):
+    """Post-process several Nastran result directories with a single Patran session,
+    then parse the results and update the manifests on a pool of worker processes.
+
+    file_names are the Patran_PostProcess constructor arguments, relative to each directory."""
+
+    import multiprocessing
+
+    logger = logging.getLogger('Patran_PostProcess')
+    batch_dir = os.getcwd()
+    job_dirs = [os.path.abspath(d) for d in job_dirs]
+    post_processes = []
+    jobs = []
+
+    for job_dir in job_dirs:
+        os.chdir(job_dir)
+        try:
+            post_process = Patran_PostProcess(*file_names)
+            try:
+                # Each BDF is hashed here only; the workers get the digest and any cached rows
+                cached_rows = post_process.get_cached_results()
+                jobs.append((job_dir, file_names, cached_rows, post_process._model_hash))
+                if cached_rows is not None:
+                    logger.info("Results for {} found in {}; skipping Patran".format(job_dir, post_process.results_db))
+                    continue
+                post_process.pre_process_cleanup()
+                post_processes.append((job_dir, post_process))
+            finally:
+                # The workers below write the rest of each job's log
+                post_process.close()
+        finally:
+            os.chdir(batch_dir)
+
+    if post_processes and not run_batch_patran(post_processes, batch_dir):
+        return False
+
+    pool = multiprocessing.Pool(processes=workers, maxtasksperchild=1)
+    try:
+        results = pool.map(update_results_in_dir, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    status = True
+    for job_dir, success, message in results:
         if not success:
-            msg = "post_process.update_results_files() returned false"
-            self.logger.error(msg)
-            sys.exit(1)
+            logger.error("Post processing failed in {}: {}".format(job_dir, message))
+            status = False
+
+    return status
+
+
+def run_batch_patran(post_processes, batch_dir):
+    """Write one session file covering every (job_dir, Patran_PostProcess) pair and run Patran on it.
+    Patran quits only after the last directory. Directories left without an _out.txt are logged;
+    the caller reports them, since Patran's exit code does not."""
+
+    logger = logging.getLogger('Patran_PostProcess')
+
+    pp_pcl_path = post_processes[0][1].pp_pcl_path
+    if not os.path.exists(pp_pcl_path):
+        logger.error("File not found in Meta-Tools installation: {}".format(pp_pcl_path))
+        return False
+
+    stage_file(pp_pcl_path, batch_dir, logger)
+
+    new_line = '\n'
+
+    with open(BATCH_SESSION_NAME + ".ses", "w") as ses_out:
+        ses_out.write("!!compile {} into patran_pp.plb{}".format(os.path.basename(pp_pcl_path), new_line))
+        ses_out.write("!!library patran_pp.plb{}".format(new_line))
+        for name in ['dir', 'filename', 'bdfPath', 'xdbPath']:
+            ses_out.write("STRING {}[{}]{}".format(name, SESSION_STRING_LENGTHS[name], new_line))
+
+        for job_dir, post_process in post_processes:
+            ses_out.write("set_current_dir(\"{}\"){}".format(job_dir, new_line))
+            ses_out.write(new_line.join(post_process.session_job_lines(declare=False)) + new_line)
+
+        ses_out.write("vPostProcessing.quitPatran(){}".format(new_line))
+
+    patran_call = "patran -b -graphics -sfp {0}.ses -stdout {0}_log.txt".format(BATCH_SESSION_NAME)
+
+    retcode = call(patran_call, shell=True)
+
+    if retcode != 0:
+        logger.error("Patran batch process failed ({})".format(retcode))
+        return False
+
+    for job_dir, post_process in post_processes:
+        out_txt_path = os.path.join(job_dir, post_process._filename + "_out.txt")
+        if not os.path.exists(out_txt_path):
+            logger.error("Patran batch process wrote no {}".format(out_txt_path))
+
+    logger.info("Patran batch process finished for {} directories".format(len(post_processes)))
+
+    return True
+
+
+def batch_main(argv):
+
+    parser = argparse.ArgumentParser(description='Post process several Nastran result directories '
+                                                 'w/ one Patran session')
+    parser.add_argument('directories', nargs='+', help='Result directories (e.g. Analysis\\Patran_Nastran)')
+    parser.add_argument('-nas_filename', default='Nastran_mod.bdf', help='.nas File Name')
+    parser.add_argument('-xdb_filename', default='Nastran_mod.xdb', help='.xdb File Name')
+    parser.add_argument('-MetaDataFile', default=os.path.join('..', 'AnalysisMetaData.xml'),
+                        help='.xml AnalysisMetaData File Name')
+    parser.add_argument('-RequestedMetrics', default=os.path.join('..', '..', 'RequestedMetrics.xml'),
+                        help='.xml RequestedMetrics File name')
+    parser.add_argument('-ResultsJson', default=os.path.join('..', '..', 'testbench_manifest.json'),
+                        help='.json summary testresults File name')
+    parser.add_argument('-results_db', default=None, help='.sqlite results database (default: %%{}%%)'.format(
+        RESULTS_DB_ENV))
+    parser.add_argument('-workers', type=int, default=None, help='Worker processes for result parsing')
+    args = parser.parse_args(argv)
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
+    console.setLevel(logging.INFO)
+    logger = logging.getLogger('Patran_PostProcess')
+    logger.setLevel(logging.INFO)
+    add_queued_handler(logger, console)
+
+    results_db = os.path.abspath(args.results_db) if args.results_db else None
+    file_names = (args.nas_filename, args.xdb_filename, args.MetaDataFile, args.RequestedMetrics, args.ResultsJson,
+                  results_db)
+
+    if not run_batch(args.directories, file_names, args.workers):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
 
     try:
-        parser = argparse.ArgumentParser(description='Post process Nastran output w/ Patran')
+        if len(sys.argv) > 1 and sys.argv[1] == '-batch':
+            batch_main(sys.argv[2:])
+            sys.exit(0)
+
+        parser = argparse.ArgumentParser(description='Post process Nastran output w/ Patran '
+                                                     '(or: -batch DIR [DIR ...] for several result directories)')
         parser.add_argument('nas_filename', help='.nas File Name')
         parser.add_argument('xdb_filename', help='.xdb File Name')
         parser.add_argument('MetaDataFile', help='.xml AnalysisMetaData File Name')
         parser.add_argument('RequestedMetrics', help='.xml RequestedMetrics File name')
         parser.add_argument('ResultsJson', help='.json summary testresults File name')
+        parser.add_argument('-results_db', default=None, help='.sqlite results database (default: %%{}%%)'.format(
+            RESULTS_DB_ENV))
         args = parser.parse_args()
 
         post_process = Patran_PostProcess(args.nas_filename,
                                           args.xdb_filename,
                                           args.MetaDataFile,
                                           args.RequestedMetrics,
-                                          args.ResultsJson)
+                                          args.ResultsJson,
+                                          args.results_db)
 
-        post_process.main()
+        try:
+            post_process.main()
+        finally:
+            post_process.close()
 
     except Exception: # catch *all* exceptions
         import traceback
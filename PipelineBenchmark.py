@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import math
+import stat
+import shutil
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from SyntheticAssembly import SyntheticAssembly
+from PipelineStubs import STUB_CONFIG_ENV, STUB_RECORD_ENV, DEFAULT_CONFIG
+from SolverResources import JOB_REGISTRY_ENV
+from ToolPaths import TOOL_PATHS_CACHE_ENV
+from JobMetrics import METRICS_TEXTFILE_ENV, serve_metrics
+from QueueLogging import add_queued_file_handler, remove_queued_handler
+from JobDispatch import Coordinator, DEFAULT_DRIVER_ARGS, start_loopback_agents
+from RuntimePredictor import RUNTIME_HISTORY_ENV, ORDERS, order_jobs
+
+SOURCE_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Stages of CADJobDriver.run_job that are a stub tool's run time rather than orchestration
+STUB_STAGES = {'Assembler': 'creo', 'Patran': 'patran', 'Nastran': 'nastran'}
+
+STUB_EXECUTABLES = [
+    ('bin', 'patran', 'patran'),
+    ('bin', 'nastran', 'nastran'),
+    (os.path.join('isis', 'bin'), 'CADCreoParametricCreateAssembly.exe', 'creo')
+]
+
+# The jobs' Prometheus metrics, in the sandbox
+METRICS_TEXTFILE_NAME = 'cad_jobs.prom'
+
+# The jobs' runtime history, in the sandbox unless CAD_RUNTIME_HISTORY points at one from earlier runs
+RUNTIME_HISTORY_NAME = 'runtime_history.jsonl'
+
+_worker_options = {}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values; None if there are none."""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def write_stub_executables(sandbox_dir):
+    """Shell scripts named like the real tools that run PipelineStubs.py."""
+
+    stubs_path = os.path.join(SOURCE_DIR, 'PipelineStubs.py')
+
+    for directory, name, tool in STUB_EXECUTABLES:
+        directory = os.path.join(sandbox_dir, directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        path = os.path.join(directory, name)
+
+        with open(path, 'w') as f_out:
+            f_out.write('#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(sys.executable, stubs_path, tool))
+
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def create_sandbox(sandbox_dir, assembly, stub_config, jobs):
+    """Lay out a META installation, the stub tools and one result directory per job.
+    Returns the job directories."""
+
+    meta_dir = os.path.join(sandbox_dir, 'META')
+    meta_bin_cad = os.path.join(meta_dir, 'bin', 'CAD')
+    template_dir = os.path.join(sandbox_dir, 'template')
+
+    # CREO's outputs for every job are copied from here by the creo stub
+    assembly.write(template_dir)
+
+    os.makedirs(meta_bin_cad)
+    for file_name in ['CreatePatranInputFile.py', 'CreatePatranModel.pcl', 'CreatePatranModel.ses']:
+        shutil.copy2(os.path.join(SOURCE_DIR, file_name), meta_bin_cad)
+
+    material_library_dir = os.path.join(meta_dir, 'models', 'MaterialLibrary')
+    os.makedirs(material_library_dir)
+    shutil.copy2(os.path.join(template_dir, 'material_library.json'), material_library_dir)
+
+    write_stub_executables(sandbox_dir)
+
+    config = dict(stub_config)
+    config['template_dir'] = template_dir
+
+    with open(os.path.join(sandbox_dir, 'stub_config.json'), 'w') as f_out:
+        json.dump(config, f_out, indent=4, sort_keys=True)
+
+    job_dirs = []
+
+    for job in range(1, jobs + 1):
+        job_dir = os.path.join(sandbox_dir, 'jobs', 'Job_{:05d}'.format(job))
+        os.makedirs(job_dir)
+        shutil.copy2(os.path.join(template_dir, 'CADAssembly.xml'), job_dir)
+        job_dirs.append(job_dir)
+
+    return job_dirs
+
+
+def configure_environment(sandbox_dir):
+    """Point CADJobDriver, PatranPCL and the stub tools at the sandbox."""
+
+    meta_dir = os.path.join(sandbox_dir, 'META')
+
+    os.environ['MetaPath'] = meta_dir
+    os.environ['PROE_ISIS_EXTENSIONS'] = os.path.join(sandbox_dir, 'isis')
+    os.environ['NASTRAN_EXE'] = os.path.join(sandbox_dir, 'bin', 'nastran')
+    os.environ['PATH'] = os.path.join(sandbox_dir, 'bin') + os.pathsep + os.environ.get('PATH', '')
+    os.environ[STUB_CONFIG_ENV] = os.path.join(sandbox_dir, 'stub_config.json')
+    os.environ[STUB_RECORD_ENV] = os.path.join(sandbox_dir, 'stub_runs.jsonl')
+    os.environ[JOB_REGISTRY_ENV] = os.path.join(sandbox_dir, 'job_registry')
+    os.environ[TOOL_PATHS_CACHE_ENV] = os.path.join(sandbox_dir, 'tool_paths.json')
+    os.environ[METRICS_TEXTFILE_ENV] = os.path.join(sandbox_dir, METRICS_TEXTFILE_NAME)
+    os.environ.setdefault(RUNTIME_HISTORY_ENV, os.path.join(sandbox_dir, RUNTIME_HISTORY_NAME))
+
+    import cad_library
+    cad_library.META_PATH = meta_dir + os.sep
+
+
+def init_worker(sandbox_dir, run_postprocessing, mesh_cache, quiet):
+
+    _worker_options['run_postprocessing'] = run_postprocessing
+    _worker_options['mesh_cache_dir'] = os.path.join(sandbox_dir, 'mesh_cache') if mesh_cache else None
+
+    configure_environment(sandbox_dir)
+
+    # CADJobDriver prints every command and every file it walks
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def run_job(job_dir):
+    """Run CADJobDriver in job_dir as main() would. Returns the job's timings."""
+
+    os.chdir(job_dir)
+    os.mkdir('log')
+
+    logger = logging.getLogger('CADJobDriver')
+    logger.setLevel(logging.DEBUG)
+    add_queued_file_handler(logger, os.path.join('log', 'CADJobDriver.py.txt'), 'w',
+                            logging.Formatter('%(asctime)s %(name)-12s %(levelname)-8s %(message)s'))
+
+    exit_code = None
+    start = time.time()
+
+    try:
+        # Imported here so the import time counts, as it does for a job started by runCADJob.bat
+        from CADJobDriver import CADJobDriver
+
+        CADJobDriver('CREO', 'PATRAN', 'PATRAN_NASTRAN', 'STATIC',
+                     run_postprocessing=_worker_options['run_postprocessing'],
+                     mesh_cache_dir=_worker_options['mesh_cache_dir'])
+    except SystemExit as e:
+        exit_code = e.code
+    except Exception as e:
+        logger.exception("CADJobDriver raised")
+        exit_code = str(e)
+    finally:
+        end = time.time()
+        # Pool workers end with os._exit, which skips the atexit flush
+        remove_queued_handler(logger)
+
+    return {'Directory': job_dir, 'Start': start, 'End': end, 'Seconds': end - start,
+            'ExitCode': exit_code, 'Stages': read_stage_times(job_dir)}
+
+
+def read_stage_times(job_dir):
+
+    from CADJobDriver import STAGE_TIMES_FILE_NAME
+
+    stages = {}
+    stages_path = os.path.join(job_dir, 'log', STAGE_TIMES_FILE_NAME)
+
+    if os.path.exists(stages_path):
+        with open(stages_path, 'r') as f_in:
+            stages = json.load(f_in)
+
+    return stages
+
+
+def run_dispatched(sandbox_dir, job_dirs, agents, run_postprocessing, mesh_cache):
+    """Run the jobs on JobDispatch agents on this machine, each with its own mesh cache."""
+
+    driver_args = DEFAULT_DRIVER_ARGS + ('' if run_postprocessing else ' -nopostprocess')
+    agent_processes = start_loopback_agents(agents, os.path.join(sandbox_dir, 'agents'), 1, mesh_cache)
+
+    try:
+        results = Coordinator([address for _, address in agent_processes], driver_args).run(job_dirs)
+    finally:
+        for process, _ in agent_processes:
+            process.terminate()
+
+    for result in results:
+        result['Stages'] = read_stage_times(result['Directory'])
+        if result['Error'] is not None:
+            result['ExitCode'] = result['Error']
+
+    return results
+
+
+def read_stub_runs(record_path):
+
+    runs = []
+
+    if os.path.exists(record_path):
+        with open(record_path, 'r') as f_in:
+            runs = [json.loads(line) for line in f_in if line.strip()]
+
+    return runs
+
+
+def summarize(results, stub_runs, wall_seconds, workers):
+    """Throughput, job latency percentiles, and per stage the time spent in CADJobDriver
+    around each stub tool (overhead = stage time - time the stub itself reported)."""
+
+    # By job directory name: a dispatched job runs in its agent's copy of the directory
+    stub_seconds = {}   # (job name, tool) -> seconds
+    job_stub_seconds = {}
+
+    for run in stub_runs:
+        job_dir = os.path.basename(run['Directory'].split(os.sep + 'Analysis' + os.sep)[0])
+        key = (job_dir, run['Tool'])
+        stub_seconds[key] = stub_seconds.get(key, 0.0) + run['End'] - run['Start']
+        job_stub_seconds[job_dir] = job_stub_seconds.get(job_dir, 0.0) + run['End'] - run['Start']
+
+    succeeded = [r for r in results if r['ExitCode'] in (0, None)]
+    latencies = [r['Seconds'] for r in succeeded]
+
+    stage_names = sorted(set(name for r in succeeded for name in r['Stages']))
+    stages = {}
+
+    for name in stage_names:
+        seconds = [r['Stages'][name] for r in succeeded if name in r['Stages']]
+        summary = {'Mean': sum(seconds) / len(seconds), 'P50': percentile(seconds, 0.5),
+                   'P99': percentile(seconds, 0.99)}
+
+        if name in STUB_STAGES:
+            overheads = [r['Stages'][name] -
+                         stub_seconds.get((os.path.basename(r['Directory']), STUB_STAGES[name]), 0.0)
+                         for r in succeeded if name in r['Stages']]
+            summary['OverheadMean'] = sum(overheads) / len(overheads)
+            summary['OverheadP99'] = percentile(overheads, 0.99)
+
+        stages[name] = summary
+
+    # Everything in a job that is not a stub tool running
+    overheads = [r['Seconds'] - job_stub_seconds.get(os.path.basename(r['Directory']), 0.0) for r in succeeded]
+
+    return {
+        'Jobs': len(results),
+        'Failed': len(results) - len(succeeded),
+        'Workers': workers,
+        'WallSeconds': wall_seconds,
+        'JobsPerSecond': len(results) / wall_seconds if wall_seconds else None,
+        'Latency': {'P50': percentile(latencies, 0.5), 'P90': percentile(latencies, 0.9),
+                    'P99': percentile(latencies, 0.99), 'Max': max(latencies) if latencies else None},
+        'OrchestrationOverhead': {'Mean': sum(overheads) / len(overheads) if overheads else None,
+                                  'P50': percentile(overheads, 0.5), 'P99': percentile(overheads, 0.99)},
+        'Stages': stages
+    }
+
+
+def print_summary(summary):
+
+    def seconds(value):
+        return '{:.3f}'.format(value) if value is not None else '-'
+
+    print("{} jobs ({} failed) on {} workers in {:.1f} s: {:.2f} jobs/s".format(
+        summary['Jobs'], summary['Failed'], summary['Workers'], summary['WallSeconds'], summary['JobsPerSecond']))
+
+    latency = summary['Latency']
+    print("Job latency (s): p50 {}  p90 {}  p99 {}  max {}".format(
+        seconds(latency['P50']), seconds(latency['P90']), seconds(latency['P99']), seconds(latency['Max'])))
+
+    overhead = summary['OrchestrationOverhead']
+    print("Orchestration overhead per job (s): mean {}  p50 {}  p99 {}".format(
+        seconds(overhead['Mean']), seconds(overhead['P50']), seconds(overhead['P99'])))
+
+    print("{:<16} {:>10} {:>10} {:>10} {:>14} {:>14}".format(
+        "Stage", "Mean", "P50", "P99", "Overhead mean", "Overhead P99"))
+
+    for name, stage in sorted(summary['Stages'].items()):
+        print("{:<16} {:>10} {:>10} {:>10} {:>14} {:>14}".format(
+            name, seconds(stage['Mean']), seconds(stage['P50']), seconds(stage['P99']),
+            seconds(stage.get('OverheadMean')), seconds(stage.get('OverheadP99'))))
+
+
+def postprocessing_available():
+
+    try:
+        import Patran_PP
+    except ImportError:
+        return False
+
+    return True
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run CADJobDriver (CREO, PATRAN, PATRAN_NASTRAN) end to end on "
+                                                 "synthetic jobs with stub CREO, Patran and Nastran executables")
+    parser.add_argument('-jobs', type=int, default=100)
+    parser.add_argument('-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('-parts', type=int, default=20, help="Parts per synthetic assembly")
+    parser.add_argument('-cells_per_edge', type=int, default=DEFAULT_CONFIG['cells_per_edge'],
+                        help="Mesh density of the stub Patran deck (6 * cells^3 CTETRAs per part)")
+    parser.add_argument('-creo_delay', type=float, default=DEFAULT_CONFIG['delay']['creo'])
+    parser.add_argument('-patran_delay', type=float, default=DEFAULT_CONFIG['delay']['patran'])
+    parser.add_argument('-nastran_delay', type=float, default=DEFAULT_CONFIG['delay']['nastran'])
+    parser.add_argument('-jitter', type=float, default=DEFAULT_CONFIG['jitter'])
+    parser.add_argument('-slow_fraction', type=float, default=DEFAULT_CONFIG['slow_fraction'],
+                        help="Fraction of stub runs that are slow_factor times longer")
+    parser.add_argument('-slow_factor', type=float, default=DEFAULT_CONFIG['slow_factor'])
+    parser.add_argument('-patran_fail_fraction', type=float, default=0.0)
+    parser.add_argument('-nastran_fatal_fraction', type=float, default=0.0,
+                        help="Fraction of Nastran runs that log a fatal message and hang, until SolverMonitor stops them")
+    parser.add_argument('-hang_seconds', type=float, default=DEFAULT_CONFIG['hang_seconds'])
+    parser.add_argument('-postprocess', choices=['auto', 'on', 'off'], default='auto',
+                        help="Run Patran_PP (auto: if it can be imported here)")
+    parser.add_argument('-meshcache', action='store_true', help="Share Patran meshes between the jobs")
+    parser.add_argument('-order', choices=ORDERS[:2], default='given',
+                        help="Start the jobs in the given order or shortest predicted first")
+    parser.add_argument('-dispatch', action='store_true',
+                        help="Run the jobs on -workers JobDispatch agents on this machine instead of a Pool")
+    parser.add_argument('-workdir', default=None, help="Sandbox directory (default: a temp dir)")
+    parser.add_argument('-keep', action='store_true', help="Keep the sandbox")
+    parser.add_argument('-verbose', action='store_true', help="Show CADJobDriver's console output")
+    parser.add_argument('-json', default=None, help="Also write the summary and per-job results here")
+    parser.add_argument('-metrics_port', type=int, default=None,
+                        help="Serve the jobs' Prometheus metrics at http://127.0.0.1:PORT/metrics while running")
+    args = parser.parse_args()
+
+    if os.name == 'nt':
+        print("The stub executables are shell scripts; run this on Linux or macOS")
+        sys.exit(1)
+
+    run_postprocessing = postprocessing_available() if args.postprocess == 'auto' else args.postprocess == 'on'
+
+    stub_config = {
+        'delay': {'creo': args.creo_delay, 'patran': args.patran_delay, 'nastran': args.nastran_delay},
+        'jitter': args.jitter,
+        'slow_fraction': args.slow_fraction,
+        'slow_factor': args.slow_factor,
+        'fail_fraction': {'patran': args.patran_fail_fraction},
+        'fatal_fraction': {'nastran': args.nastran_fatal_fraction},
+        'hang_seconds': args.hang_seconds,
+        'cells_per_edge': args.cells_per_edge
+    }
+
+    sandbox_dir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='PipelineBenchmark_'))
+
+    try:
+        job_dirs = create_sandbox(sandbox_dir, SyntheticAssembly(parts=args.parts), stub_config, args.jobs)
+
+        print("{} jobs of {} parts in {}; post-processing {}".format(
+            args.jobs, args.parts, sandbox_dir, 'on' if run_postprocessing else 'off'))
+
+        if args.metrics_port is not None:
+            textfile_path = os.path.join(sandbox_dir, METRICS_TEXTFILE_NAME)
+
+            def render_textfile():
+                if not os.path.exists(textfile_path):
+                    return ''
+                with open(textfile_path, 'r') as f_in:
+                    return f_in.read()
+
+            metrics_server = serve_metrics(render_textfile, args.metrics_port)
+
+        # For the agents' processes, and for predicting the jobs' runtimes here
+        configure_environment(sandbox_dir)
+        job_dirs = order_jobs(job_dirs, args.order, analyzer='PATRAN_NASTRAN')[0]
+
+        start = time.time()
+
+        if args.dispatch:
+            logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                                format='%(asctime)s %(threadName)-16s %(levelname)-8s %(message)s')
+            results = run_dispatched(sandbox_dir, job_dirs, args.workers, run_postprocessing, args.meshcache)
+        else:
+            # A fresh process per job, as each job gets one from runCADJob.bat
+            pool = multiprocessing.Pool(args.workers, init_worker, (sandbox_dir, run_postprocessing,
+                                                                      args.meshcache, not args.verbose),
+                                        maxtasksperchild=1)
+            try:
+                results = pool.map(run_job, job_dirs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        wall_seconds = time.time() - start
+
+        if args.metrics_port is not None:
+            metrics_server.shutdown()
+
+        summary = summarize(results, read_stub_runs(os.path.join(sandbox_dir, 'stub_runs.jsonl')),
+                            wall_seconds, args.workers)
+
+    finally:
+        if not args.keep:
+            shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+    print_summary(summary)
+
+    for result in results:
+        if result['ExitCode'] not in (0, None):
+            print("FAILED ({}): {}".format(result['ExitCode'], result['Directory']))
+
+    if args.json:
+        with open(args.json, 'w') as f_out:
+            json.dump({'Summary': summary, 'Jobs': results}, f_out, indent=4, sort_keys=True, separators=(',', ': '))
+
+
+if __name__ == '__main__':
+
+    main()
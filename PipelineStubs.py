@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+from ArtifactStaging import stage_file
+
+
+STUB_CONFIG_ENV = 'PIPELINE_STUB_CONFIG'
+STUB_RECORD_ENV = 'PIPELINE_STUB_RECORD'
+
+TOOLS = ['creo', 'patran', 'nastran']
+
+PATRAN_INPUT_FILE_NAME = 'CreatePatranModelInput.txt'
+PATRAN_MODEL_NAME = 'Nastran_mod'
+
+DEFAULT_CONFIG = {
+    'delay': {'creo': 0.2, 'patran': 1.0, 'nastran': 0.5},   # seconds
+    'jitter': 0.2,            # delay is scaled by a uniform factor in [1 - jitter, 1 + jitter]
+    'slow_fraction': 0.0,     # fraction of runs that take slow_factor times longer
+    'slow_factor': 5.0,
+    'fail_fraction': {},      # tool -> fraction of runs that exit with 1
+    'fatal_fraction': {},     # tool -> fraction of runs that log a fatal message, then hang for hang_seconds
+    'hang_seconds': 600,
+    'template_dir': None,     # where creo copies CADAssembly_metrics.xml, ComputedValues.xml and Parasolid from
+    'cells_per_edge': 2       # each solid is meshed as a brick of cells_per_edge^3 cubes, 6 CTETRAs each
+}
+
+# In Nastran component order
+DOF_NAMES = ['x_Disp', 'y_Disp', 'z_Disp', 'x_Rot', 'y_Rot', 'z_Rot']
+
+# What the real tools log when a run is lost but they keep going
+FATAL_MESSAGES = {
+    'nastran': ' *** USER FATAL MESSAGE 9050 (SEKRRS)\n     RUN TERMINATED DUE TO EXCESSIVE PIVOT RATIOS IN MATRIX KLL.\n',
+    'patran': 'FATAL ERROR: Synthetic Patran failure\n'
+}
+
+# Splits a unit cube into 6 tetrahedra around its 0-7 diagonal; corners are numbered i + 2j + 4k
+CUBE_TETRAS = [(0, 1, 3, 7), (0, 1, 5, 7), (0, 2, 3, 7), (0, 2, 6, 7), (0, 4, 5, 7), (0, 4, 6, 7)]
+
+
+def load_config():
+
+    config = dict(DEFAULT_CONFIG)
+    config_path = os.environ.get(STUB_CONFIG_ENV)
+
+    if config_path:
+        with open(config_path, 'r') as f_in:
+            config.update(json.load(f_in))
+
+    return config
+
+
+def record_run(tool, start, end, exit_code):
+    """Append this run to the file named by PIPELINE_STUB_RECORD (one JSON object per line)."""
+
+    record_path = os.environ.get(STUB_RECORD_ENV)
+    if not record_path:
+        return
+
+    line = json.dumps({'Tool': tool, 'Directory': os.getcwd(), 'Start': start, 'End': end, 'ExitCode': exit_code})
+
+    # One short write per line, so runs in parallel do not interleave
+    with open(record_path, 'a') as f_out:
+        f_out.write(line + '\n')
+
+
+def simulate_run_time(tool, config):
+
+    delay = config['delay'].get(tool, 0.0) * (1.0 + random.uniform(-config['jitter'], config['jitter']))
+
+    if random.random() < config['slow_fraction']:
+        delay *= config['slow_factor']
+
+    time.sleep(max(delay, 0.0))
+
+
+def read_patran_input(path):
+    """Sections of CreatePatranModelInput.txt as (name, {key: value}) pairs, comments removed."""
+
+    sections = []
+
+    with open(path, 'r') as f_in:
+        for line in f_in:
+            if not line.strip() or line.strip().startswith('#'):
+                continue
+
+            if not line[0].isspace():
+                sections.append((line.strip(), {}))
+            elif '=' in line and sections:
+                key, value = line.split('#')[0].split('=', 1)
+                sections[-1][1][key.strip()] = value.strip()
+
+    return sections
+
+
+def signed_volume(a, b, c, d):
+
+    u = [b[i] - a[i] for i in range(3)]
+    v = [c[i] - a[i] for i in range(3)]
+    w = [d[i] - a[i] for i in range(3)]
+
+    return (u[0] * (v[1] * w[2] - v[2] * w[1]) -
+            u[1] * (v[0] * w[2] - v[2] * w[0]) +
+            u[2] * (v[0] * w[1] - v[1] * w[0])) / 6.0
+
+
+def write_deck(bdf_path, solid_ids, materials, cells_per_edge, loads=(), constraints=()):
+    """A free field Nastran deck with one CTETRA brick per solid, laid out along x. Each load
+    (ID, subcase, pressure) is a PLOAD4 and each constraint (ID, subcase, fixed DOFs) an SPC1
+    on the first brick, under the '$ ... Load Set : <LBC name>' comments Patran writes."""
+
+    subcases = sorted(set(subcase for _, subcase, _ in list(loads) + list(constraints)))
+
+    lines = ['SOL 101', 'CEND']
+    for subcase in subcases:
+        lines.extend(['SUBCASE {}'.format(subcase), '   LOAD = {}'.format(subcase), '   SPC = {}'.format(subcase)])
+    lines.append('BEGIN BULK')
+    grid_id = 0
+    element_id = 0
+    n = cells_per_edge + 1
+
+    for brick, (solid_id, material_id) in enumerate(solid_ids):
+        first_grid = grid_id + 1
+        positions = {}
+
+        for k in range(n):
+            for j in range(n):
+                for i in range(n):
+                    grid_id += 1
+                    positions[grid_id] = (brick * (cells_per_edge + 1) + i, float(j), float(k))
+                    lines.append('GRID,{},0,{:.1f},{:.1f},{:.1f}'.format(grid_id, *positions[grid_id]))
+
+        def grid(i, j, k):
+            return first_grid + i + j * n + k * n * n
+
+        for k in range(cells_per_edge):
+            for j in range(cells_per_edge):
+                for i in range(cells_per_edge):
+                    corners = [grid(i + (c & 1), j + ((c >> 1) & 1), k + ((c >> 2) & 1)) for c in range(8)]
+
+                    for tetra in CUBE_TETRAS:
+                        g = [corners[c] for c in tetra]
+                        if signed_volume(*[positions[x] for x in g]) < 0:
+                            g[1], g[2] = g[2], g[1]
+                        element_id += 1
+                        lines.append('CTETRA,{},{},{},{},{},{}'.format(element_id, solid_id, *g))
+
+        lines.append('PSOLID,{},{}'.format(solid_id, material_id))
+
+    for load_id, subcase, pressure in loads:
+        lines.append('$ Pressures of Load Set : Load_Set_{}'.format(load_id))
+        lines.append('PLOAD4,{},1,{},,,,1,2'.format(subcase, pressure))
+
+    for constraint_id, subcase, components in constraints:
+        lines.append('$ Displacement Constraints of Load Set : Constraint_Set_{}'.format(constraint_id))
+        lines.append('SPC1,{},{},1,2,3'.format(subcase, components))
+
+    for material_id, material in sorted(materials.items()):
+        lines.append('$ Material Record : M{}_{}'.format(material_id, material.get('Name', '')))
+        lines.append('MAT1,{},{},,{},{}'.format(material_id, material.get('Elastic_Modulus', '1.0'),
+                                               material.get('Poissons_Ratio', '0.3'), material.get('Density', '1.0')))
+
+    lines.append('ENDDATA')
+
+    with open(bdf_path, 'w') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+
+
+def write_results(model_name):
+
+    with open(model_name + '.xdb', 'wb') as f_out:
+        f_out.write('Synthetic XDB placeholder\n')
+
+    with open(model_name + '.f06', 'w') as f_out:
+        f_out.write('1    SYNTHETIC NASTRAN RUN\n0                                   * * * END OF JOB * * *\n')
+
+
+def run_creo(args, config):
+
+    template_dir = config['template_dir']
+    if template_dir is None:
+        return 0
+
+    for file_name in ['CADAssembly_metrics.xml', 'ComputedValues.xml']:
+        shutil.copy2(os.path.join(template_dir, file_name), file_name)
+
+    if not os.path.isdir('Parasolid'):
+        shutil.copytree(os.path.join(template_dir, 'Parasolid'), 'Parasolid')
+
+    return 0
+
+
+def run_patran(args, config):
+
+    # Post-processing sessions only read the results
+    if not os.path.exists(PATRAN_INPUT_FILE_NAME) or not any(arg.endswith('CreatePatranModel.ses') for arg in args):
+        return 0
+
+    sections = read_patran_input(PATRAN_INPUT_FILE_NAME)
+
+    def by_id(section_name):
+        return dict((s['ID'], s) for name, s in sections if name == section_name)
+
+    solids = [(int(float(s['ID'])), int(float(s['Material_ID']))) for name, s in sections if name == 'Solid']
+    materials = dict((int(float(s['ID'])), s) for name, s in sections if name == 'Material')
+    instructions = [s.get('Instructions') for name, s in sections if name == 'Analysis']
+
+    load_values = by_id('Load_Value')
+    loads = [(load['ID'], load['SubCase_ID'], load_values[load['Load_Value_ID']]['Scalar_Value'])
+             for load in by_id('Load').values() if load.get('Type') == 'PRESSURE']
+
+    displacements = by_id('Displacement')
+    constraints = []
+
+    for constraint in by_id('Constraint').values():
+        displacement = displacements.get(constraint.get('Displacement_ID'), {})
+        components = ''.join(str(i + 1) for i, name in enumerate(DOF_NAMES)
+                             if displacement.get(name + '_State') == 'FIXED')
+        if components:
+            constraints.append((constraint['ID'], constraint['SubCase_ID'], components))
+
+    write_deck(PATRAN_MODEL_NAME + '.bdf', solids, materials, config['cells_per_edge'], sorted(loads), sorted(constraints))
+
+    # The deck under a second name, linked as Patran_PP stages one for -analyzer NASTRAN, so a
+    # dispatched benchmark sends a staged pair back through JobDispatch's pack and unpack
+    stage_file(PATRAN_MODEL_NAME + '.bdf', PATRAN_MODEL_NAME + '.nas')
+
+    if 'MESH_AND_SOLVE' in instructions:
+        write_results(PATRAN_MODEL_NAME)
+
+    return 0
+
+
+def nastran_keywords(args):
+    return dict(arg.split('=', 1) for arg in args[1:] if '=' in arg)
+
+
+def nastran_output_prefix(args):
+    return nastran_keywords(args).get('out', os.path.splitext(os.path.basename(args[0]))[0])
+
+
+def run_fatal(tool, args, config):
+    """Log the tool's fatal message where the real tool would, then hang, as Nastran and Patran
+    can after one. Exits with 0, as Nastran does after most fatal messages."""
+
+    log_path = None
+
+    if tool == 'nastran' and args:
+        log_path = nastran_output_prefix(args) + '.f06'
+    elif tool == 'patran' and '-stdout' in args[:-1]:
+        log_path = args[args.index('-stdout') + 1]
+
+    if log_path is not None:
+        with open(log_path, 'a') as f_out:
+            f_out.write(FATAL_MESSAGES[tool])
+
+    time.sleep(config['hang_seconds'])
+
+    return 0
+
+
+def run_nastran(args, config):
+
+    if not args:
+        return 1
+
+    keywords = nastran_keywords(args)
+    output_prefix = nastran_output_prefix(args)
+
+    write_results(output_prefix)
+
+    # scr=no keeps the database, which a later run can restart from
+    if keywords.get('scr') == 'no':
+        with open(keywords.get('dbs', output_prefix) + '.MASTER', 'a') as f_out:
+            f_out.write('{}\n'.format(args[0]))
+
+    return 0
+
+
+def main(argv):
+    """PipelineStubs.py creo|patran|nastran [tool arguments]
+
+    Stands in for the CREO assembler, Patran and Nastran: sleeps for a configured time and
+    writes the files CADJobDriver expects the real tool to write. Configured by the JSON file
+    named by PIPELINE_STUB_CONFIG; see DEFAULT_CONFIG."""
+
+    if len(argv) < 2 or argv[1] not in TOOLS:
+        sys.stderr.write("Usage: {} {} [arguments]\n".format(argv[0], '|'.join(TOOLS)))
+        return 2
+
+    tool, args = argv[1], argv[2:]
+    config = load_config()
+
+    start = time.time()
+    simulate_run_time(tool, config)
+
+    if random.random() < config['fatal_fraction'].get(tool, 0.0):
+        exit_code = run_fatal(tool, args, config)
+    elif random.random() < config['fail_fraction'].get(tool, 0.0):
+        exit_code = 1
+    else:
+        exit_code = {'creo': run_creo, 'patran': run_patran, 'nastran': run_nastran}[tool](args, config)
+
+    record_run(tool, start, time.time(), exit_code)
+
+    return exit_code
+
+
+if __name__ == '__main__':
+
+    sys.exit(main(sys.argv))
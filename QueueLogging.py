@@ -0,0 +1,188 @@
+import os
+import Queue
+import atexit
+import logging
+import threading
+
+# Python 2 has no logging.handlers.QueueHandler/QueueListener; these follow the Python 3 ones.
+# A QueueHandler only formats the message and puts the record on a queue, and a listener thread
+# does the writing, so code that logs from a hot loop does not wait on the file.
+
+_STOP = None
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+class QueueListener():
+    """Hands the records on its queue to handlers from a background thread."""
+
+    def __init__(self, *handlers):
+
+        self.handlers = handlers
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.finalizer = None
+
+    def start(self):
+
+        self.queue = Queue.Queue()
+        self.pid = os.getpid()
+
+        # Daemon, so a job that exits without stop() does not hang; stop_listeners runs at exit
+        self.thread = threading.Thread(target=self.monitor, name='QueueListener')
+        self.thread.daemon = True
+        self.thread.start()
+
+        # multiprocessing workers end with os._exit, after running these finalizers but not atexit
+        from multiprocessing import util
+        self.finalizer = util.Finalize(self, self.stop, exitpriority=0)
+
+    def monitor(self):
+
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            self.handle(record)
+
+    def handle(self, record):
+
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        """Write out the queued records and end the thread."""
+
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+        self.thread = None
+
+        for handler in self.handlers:
+            handler.flush()
+
+    def close(self):
+
+        self.stop()
+
+        if self.finalizer is not None:
+            self.finalizer.cancel()
+            self.finalizer = None
+
+        for handler in self.handlers:
+            handler.close()
+
+
+class QueueHandler(logging.Handler):
+
+    def __init__(self, listener):
+
+        logging.Handler.__init__(self)
+        self.listener = listener
+
+    def prepare(self, record):
+        """Merge the arguments into the message now: they may change before the listener gets to
+        the record. The traceback is kept as text for the same reason."""
+
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def emit(self, record):
+
+        try:
+            # A forked worker inherits the queue but not the thread that drains it
+            if self.listener.pid != os.getpid():
+                self.listener.start()
+
+            # Stopped, e.g. logging from an atexit function that runs after stop_listeners
+            if self.listener.thread is None:
+                self.listener.handle(record)
+            else:
+                self.listener.queue.put_nowait(self.prepare(record))
+
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+def queued_handler(logger):
+    """The QueueHandler add_queued_handler attached to logger, or None."""
+
+    for handler in logger.handlers:
+        if isinstance(handler, QueueHandler):
+            return handler
+
+    return None
+
+
+def add_queued_handler(logger, handler):
+    """Send logger's records to handler through a QueueHandler, in place of one added before."""
+
+    remove_queued_handler(logger)
+
+    listener = QueueListener(handler)
+    listener.start()
+
+    with _listeners_lock:
+        _listeners.append(listener)
+
+    queue_handler = QueueHandler(listener)
+    logger.addHandler(queue_handler)
+
+    return queue_handler
+
+
+def add_queued_file_handler(logger, path, mode='a', formatter=None, level=logging.NOTSET):
+    """add_queued_handler with a FileHandler for path. If logger already logs to path this way
+    nothing changes, so setting a logger up twice neither repeats its records nor truncates its file."""
+
+    current = queued_handler(logger)
+
+    if current is not None and any(getattr(handler, 'baseFilename', None) == os.path.abspath(path)
+                                   for handler in current.listener.handlers):
+        return current
+
+    handler = logging.FileHandler(path, mode)
+    handler.setLevel(level)
+
+    if formatter is not None:
+        handler.setFormatter(formatter)
+
+    return add_queued_handler(logger, handler)
+
+
+def remove_queued_handler(logger):
+    """Write out the records queued for logger, then detach and close its handlers."""
+
+    current = queued_handler(logger)
+
+    if current is None:
+        return
+
+    logger.removeHandler(current)
+    current.listener.close()
+
+    with _listeners_lock:
+        if current.listener in _listeners:
+            _listeners.remove(current.listener)
+
+
+@atexit.register
+def stop_listeners():
+
+    with _listeners_lock:
+        listeners = list(_listeners)
+
+    for listener in listeners:
+        listener.stop()
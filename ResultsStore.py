@@ -0,0 +1,145 @@
+import os
+import sys
+import csv
+import sqlite3
+import hashlib
+import argparse
+import datetime
+
+
+RESULTS_DB_ENV = 'META_FEA_RESULTS_DB'
+
+# Load case name for values derived across all load cases (e.g. factor of safety)
+ENVELOPE_LOAD_CASE = 'ENVELOPE'
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+           configuration_id TEXT NOT NULL,
+           model_hash TEXT NOT NULL,
+           run_dir TEXT,
+           updated TEXT,
+           PRIMARY KEY (configuration_id, model_hash))""",
+    """CREATE TABLE IF NOT EXISTS results (
+           configuration_id TEXT NOT NULL,
+           model_hash TEXT NOT NULL,
+           component_id TEXT NOT NULL,
+           load_case TEXT NOT NULL,
+           metric TEXT NOT NULL,
+           value REAL,
+           seq INTEGER,
+           PRIMARY KEY (configuration_id, model_hash, component_id, load_case, metric))""",
+    "CREATE INDEX IF NOT EXISTS results_by_metric ON results (metric, component_id)",
+    "CREATE INDEX IF NOT EXISTS results_by_hash ON results (model_hash)"
+]
+
+
+def hash_file(path, block_size=1 << 20):
+    """SHA-1 of a file's contents, read in blocks so multi-GB decks are not loaded at once."""
+
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as f_in:
+        while True:
+            block = f_in.read(block_size)
+            if not block:
+                break
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class ResultsStore(object):
+    """Local SQLite database of FEA results keyed by configuration ID and model hash.
+
+    Rows are (component_id, load_case, metric, value)."""
+
+    def __init__(self, db_path):
+
+        self.db_path = db_path
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+
+        # Batch post-processing workers write concurrently; wait for the lock rather than fail.
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def has_results(self, configuration_id, model_hash):
+        cursor = self.connection.execute(
+            "SELECT 1 FROM results WHERE configuration_id = ? AND model_hash = ? LIMIT 1",
+            (configuration_id, model_hash))
+        return cursor.fetchone() is not None
+
+    def get_results(self, configuration_id, model_hash):
+        cursor = self.connection.execute(
+            "SELECT component_id, load_case, metric, value FROM results "
+            "WHERE configuration_id = ? AND model_hash = ? ORDER BY seq",
+            (configuration_id, model_hash))
+        return cursor.fetchall()
+
+    def upsert_results(self, configuration_id, model_hash, rows, run_dir=None):
+        """Replace the stored rows for (configuration_id, model_hash) in one transaction."""
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs (configuration_id, model_hash, run_dir, updated) VALUES (?, ?, ?, ?)",
+                (configuration_id, model_hash, run_dir, datetime.datetime.now().isoformat()))
+
+            self.connection.execute(
+                "DELETE FROM results WHERE configuration_id = ? AND model_hash = ?",
+                (configuration_id, model_hash))
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results "
+                "(configuration_id, model_hash, component_id, load_case, metric, value, seq) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((configuration_id, model_hash, component_id, load_case, metric, value, seq)
+                 for seq, (component_id, load_case, metric, value) in enumerate(rows)))
+
+    def query(self, metric, component_id=None):
+        """All stored values of metric across runs, optionally for one component."""
+
+        sql = "SELECT configuration_id, model_hash, component_id, load_case, value FROM results WHERE metric = ?"
+        params = [metric]
+
+        if component_id is not None:
+            sql += " AND component_id = ?"
+            params.append(component_id)
+
+        return self.connection.execute(sql + " ORDER BY configuration_id, component_id, load_case", params).fetchall()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Query the FEA results database')
+    parser.add_argument('db', help='.sqlite results database')
+    parser.add_argument('metric', help='Metric, e.g. VM, MP, D or FOS')
+    parser.add_argument('-component', default=None, help='Limit to one ComponentID')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print("File not found: {}".format(args.db))
+        sys.exit(1)
+
+    store = ResultsStore(args.db)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["Configuration ID", "Model Hash", "Unique ID", "Load Case", args.metric])
+    for row in store.query(args.metric, args.component):
+        writer.writerow(row)
+
+    store.close()
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,297 @@
+import os
+import json
+import math
+import time
+import argparse
+import logging
+import tempfile
+import xml.etree.cElementTree as etree
+from JobMetrics import locked
+
+# Every CADJobDriver job on a node appends its features, stage times and runtime here
+RUNTIME_HISTORY_ENV = 'CAD_RUNTIME_HISTORY'
+RUNTIME_HISTORY_FILE_NAME = 'CADRuntimeHistory.jsonl'
+
+# Model features. Parts, Layers and Loads are known before a job runs; Elements once it is meshed.
+FEATURES = ['Parts', 'Layers', 'Loads', 'Elements']
+
+# Jobs the model is fitted to: the most recent successful ones of the analyzer
+MAX_HISTORY = 2000
+MIN_HISTORY = 5
+
+# Keeps the fit stable when a feature hardly varies (e.g. every job has one load set)
+RIDGE = 1e-3
+
+ORDERS = ['given', 'sjf', 'deadline']
+
+
+def history_path():
+    return os.environ.get(RUNTIME_HISTORY_ENV) or os.path.join(tempfile.gettempdir(), RUNTIME_HISTORY_FILE_NAME)
+
+
+def assembly_features(job_dir):
+    """Parts, Layers and Loads of the job's CADAssembly.xml, counted as PatranPCL counts them;
+    {} if there is none."""
+
+    path = os.path.join(job_dir, 'CADAssembly.xml')
+
+    if not os.path.exists(path):
+        return {}
+
+    root = etree.parse(path).getroot()
+
+    components = root.findall('.//CADComponent')
+    parts = [c for c in components if c.find('CADComponent') is None]
+
+    return {
+        'Parts': len(parts),
+        'Layers': len(root.findall('.//MaterialLayup/Layer')),
+        'Loads': len(root.findall('Assembly/Analyses/FEA/Loads/Load'))
+    }
+
+
+def read_history(path=None, analyzer=None):
+    """The last MAX_HISTORY successful jobs in the history file (of analyzer, if given)."""
+
+    path = path or history_path()
+    records = []
+
+    if not os.path.exists(path):
+        return records
+
+    with open(path, 'r') as f_in:
+        for line in f_in:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue    # a line a crashed job left half written
+
+            if record.get('ExitCode') not in (0, None) or not record.get('Seconds'):
+                continue
+            if analyzer is not None and record.get('Analyzer') != analyzer:
+                continue
+
+            records.append(record)
+
+    return records[-MAX_HISTORY:]
+
+
+def append_history(record, path=None):
+
+    path = path or history_path()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with locked(path + '.lock'):
+        with open(path, 'a') as f_out:
+            f_out.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def solve(a, b):
+    """x with a x = b, by Gaussian elimination with partial pivoting; a is small and square."""
+
+    n = len(b)
+    m = [list(row) + [value] for row, value in zip(a, b)]
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda row: abs(m[row][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+
+        if abs(m[col][col]) < 1e-12:
+            raise ValueError("Singular system")
+
+        for row in range(col + 1, n):
+            factor = m[row][col] / m[col][col]
+            for k in range(col, n + 1):
+                m[row][k] -= factor * m[col][k]
+
+    x = [0.0] * n
+    for row in reversed(range(n)):
+        x[row] = (m[row][n] - sum(m[row][k] * x[k] for k in range(row + 1, n))) / m[row][row]
+
+    return x
+
+
+class RuntimeModel():
+    """log(runtime) as a linear function of log(1 + feature), fitted by ridge least squares.
+    Runtimes grow roughly as a power of model size, which this makes linear."""
+
+    def __init__(self, features, coefficients, samples):
+
+        self.features = features
+        self.coefficients = coefficients
+        self.samples = samples
+
+    @staticmethod
+    def fit(records, features):
+        """The model of features fitted to records that have all of them, or None if too few do."""
+
+        rows = []
+        targets = []
+
+        for record in records:
+            values = record.get('Features', {})
+            if all(values.get(name) is not None for name in features):
+                rows.append([1.0] + [math.log1p(values[name]) for name in features])
+                targets.append(math.log(record['Seconds']))
+
+        if len(rows) < max(MIN_HISTORY, len(features) + 1):
+            return None
+
+        size = len(features) + 1
+        ata = [[sum(row[i] * row[j] for row in rows) + (RIDGE * len(rows) if i == j and i > 0 else 0.0)
+                for j in range(size)] for i in range(size)]
+        atb = [sum(row[i] * target for row, target in zip(rows, targets)) for i in range(size)]
+
+        try:
+            coefficients = solve(ata, atb)
+        except ValueError:
+            return None
+
+        return RuntimeModel(features, coefficients, len(rows))
+
+    def predict(self, values):
+
+        x = [1.0] + [math.log1p(values[name]) for name in self.features]
+        return math.exp(sum(c * v for c, v in zip(self.coefficients, x)))
+
+
+class RuntimePredictor():
+    """Predicts a job's runtime from the features it has, with a model of just those features
+    fitted to the history; so a job not yet meshed is predicted without its element count."""
+
+    def __init__(self, records):
+
+        self.records = records
+        self.models = {}
+
+    @staticmethod
+    def load(path=None, analyzer=None):
+        return RuntimePredictor(read_history(path, analyzer))
+
+    def model(self, features):
+
+        features = tuple(name for name in FEATURES if name in features)
+
+        if features not in self.models:
+            self.models[features] = RuntimeModel.fit(self.records, list(features))
+
+        return self.models[features]
+
+    def predict(self, features):
+        """Predicted seconds for a job with these features, or None if there is too little history."""
+
+        features = dict((name, value) for name, value in features.items() if name in FEATURES and value is not None)
+
+        model = self.model(features)
+        if model is None:
+            return None
+
+        return model.predict(features)
+
+
+def predict_job(predictor, job_dir):
+    """The predicted seconds of the job in job_dir, or None, also if its CADAssembly.xml cannot be read."""
+
+    try:
+        return predictor.predict(assembly_features(job_dir))
+    except (IOError, etree.ParseError) as e:
+        logging.getLogger('RuntimePredictor').warning("Cannot predict {}: {}".format(job_dir, e))
+        return None
+
+
+def order_jobs(job_dirs, order='sjf', predictor=None, deadlines=None, analyzer=None):
+    """job_dirs in the order a batch should run them, with the predicted seconds of each.
+
+    given: as they are, with nothing predicted. sjf: shortest predicted first. deadline: least
+    slack (deadline - predicted runtime) first, then the jobs without a deadline, shortest first.
+    deadlines maps a job directory to a time (seconds since the epoch). Jobs that cannot be
+    predicted keep their place after the others. Without a predictor, one is fitted to the
+    history of analyzer's jobs."""
+
+    if order == 'given':
+        return list(job_dirs), dict((job_dir, None) for job_dir in job_dirs)
+
+    predictor = predictor or RuntimePredictor.load(analyzer=analyzer)
+    deadlines = dict((os.path.abspath(k), v) for k, v in (deadlines or {}).items())
+
+    predicted = dict((job_dir, predict_job(predictor, job_dir)) for job_dir in job_dirs)
+
+    position = dict((job_dir, i) for i, job_dir in enumerate(job_dirs))
+
+    def sjf_key(job_dir):
+        return (predicted[job_dir] is None, predicted[job_dir], position[job_dir])
+
+    def deadline_key(job_dir):
+        deadline = deadlines.get(os.path.abspath(job_dir))
+        if deadline is None:
+            return (1,) + sjf_key(job_dir)
+        return (0, deadline - (predicted[job_dir] or 0.0), position[job_dir])
+
+    return sorted(job_dirs, key=deadline_key if order == 'deadline' else sjf_key), predicted
+
+
+def read_deadlines(path):
+    """{job directory: deadline} from a JSON file of {job directory: seconds from now}."""
+
+    now = time.time()
+
+    with open(path, 'r') as f_in:
+        return dict((job_dir, now + seconds) for job_dir, seconds in json.load(f_in).items())
+
+
+def accuracy(records):
+    """Mean absolute percentage error and count of the jobs that were predicted before they ran."""
+
+    errors = [abs(r['PredictedSeconds'] - r['Seconds']) / r['Seconds'] for r in records if r.get('PredictedSeconds')]
+
+    if not errors:
+        return None, 0
+
+    return 100.0 * sum(errors) / len(errors), len(errors)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Show how well CADJobDriver runtimes are predicted, "
+                                                 "or the order a batch of jobs would run in")
+    parser.add_argument('job_dirs', nargs='*', help="Jobs to predict and order")
+    parser.add_argument('-history', default=None, help="Runtime history (default: %%{}%%)".format(RUNTIME_HISTORY_ENV))
+    parser.add_argument('-analyzer', default='PATRAN_NASTRAN')
+    parser.add_argument('-order', choices=ORDERS, default='sjf')
+    parser.add_argument('-deadlines', default=None, help="JSON file of {job directory: seconds from now}")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    predictor = RuntimePredictor.load(args.history, args.analyzer)
+
+    mape, predicted_count = accuracy(predictor.records)
+    print("{} {} jobs in {}".format(len(predictor.records), args.analyzer, args.history or history_path()))
+    if mape is not None:
+        print("Mean absolute error of the predictions made before {} of them ran: {:.1f}%".format(
+            predicted_count, mape))
+
+    for size in range(1, len(FEATURES) + 1):
+        model = predictor.model(FEATURES[:size])
+        if model is not None:
+            print("log(s) = {:.3f} + {}  ({} jobs)".format(model.coefficients[0], ' + '.join(
+                '{:.3f} log(1 + {})'.format(c, name) for c, name in zip(model.coefficients[1:], model.features)),
+                model.samples))
+
+    if not args.job_dirs:
+        return
+
+    deadlines = read_deadlines(args.deadlines) if args.deadlines else None
+    ordered, predicted = order_jobs(args.job_dirs, args.order, predictor, deadlines)
+
+    for job_dir in ordered:
+        seconds = predicted[job_dir]
+        print("{:>12}  {}".format('{:.1f} s'.format(seconds) if seconds is not None else '-', job_dir))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,397 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import fnmatch
+import argparse
+import logging
+import threading
+import subprocess
+
+# JSON file of rules added to (or replacing) DEFAULT_RULES; see load_rules
+SOLVER_RULES_ENV = 'SOLVER_MONITOR_RULES'
+
+# Seconds between looks at the solver logs
+POLL_SECONDS = 1.0
+
+# Seconds a killed solver is given to exit before it is killed outright
+KILL_GRACE_SECONDS = 10
+
+# Bytes before a log's read position that are checked to tell an appended log from a rewritten one
+SIGNATURE_BYTES = 64
+
+FAILED_FILE_NAME = '_FAILED.txt'
+
+ACTIONS = ['abort', 'warn', 'off']
+
+# Solver: the logs it writes in its working directory, and the messages in them that mean the run
+# is lost. A rule acts on its Count-th match; StallSeconds aborts a solver whose logs stop growing.
+DEFAULT_RULES = {
+    'NASTRAN': {
+        'Files': ['*.f06', '*.f04', '*.log'],
+        'StallSeconds': None,
+        'Rules': [
+            {'Name': 'Nastran fatal message', 'Pattern': r'\*\*\* (?:USER|SYSTEM) FATAL MESSAGE', 'Action': 'abort'},
+            {'Name': 'Nastran license', 'Pattern': r'(?i)license.*(?:not available|denied|checkout failed)',
+             'Action': 'abort'},
+            {'Name': 'Nastran singularity', 'Pattern': r'USER WARNING MESSAGE 4698', 'Action': 'warn'},
+            {'Name': 'Nastran divergence', 'Pattern': r'\bDIVERG(?:ED|ES|ING|ENCE)\b', 'Action': 'abort',
+             'Count': 10}
+        ]
+    },
+    'ABAQUS': {
+        'Files': ['*.msg', '*.sta', '*.dat', '*.log'],
+        'StallSeconds': None,
+        'Rules': [
+            {'Name': 'Abaqus error', 'Pattern': r'\*\*\*ERROR', 'Action': 'abort'},
+            {'Name': 'Abaqus cutbacks', 'Pattern': r'TOO MANY ATTEMPTS MADE FOR THIS INCREMENT', 'Action': 'abort'},
+            {'Name': 'Abaqus singularity', 'Pattern': r'NUMERICAL SINGULARITY|ZERO PIVOT', 'Action': 'abort',
+             'Count': 50},
+            {'Name': 'Abaqus divergence', 'Pattern': r'(?i)solution appears to be diverging', 'Action': 'abort',
+             'Count': 20},
+            {'Name': 'Abaqus license', 'Pattern': r'(?i)queued for release of available licenses', 'Action': 'warn'}
+        ]
+    },
+    'CALCULIX': {
+        'Files': ['*.sta', '*.dat', '*.cvg'],
+        'StallSeconds': None,
+        'Rules': [
+            {'Name': 'CalculiX error', 'Pattern': r'\*ERROR', 'Action': 'abort'},
+            {'Name': 'CalculiX divergence', 'Pattern': r'(?i)\bdivergence\b', 'Action': 'abort', 'Count': 20}
+        ]
+    },
+    'PATRAN': {
+        'Files': ['*_Session.log'],
+        'StallSeconds': None,
+        'Rules': [
+            {'Name': 'Patran fatal error', 'Pattern': r'(?i)\bfatal error\b', 'Action': 'abort'},
+            {'Name': 'Patran license', 'Pattern': r'(?i)license.*(?:not available|denied|cannot be checked out)',
+             'Action': 'abort'}
+        ]
+    }
+}
+
+
+class SolverRulesError(Exception):
+    pass
+
+
+def load_rules(path=None):
+    """DEFAULT_RULES with those of the JSON file path (default: %SOLVER_MONITOR_RULES%).
+
+    The file has DEFAULT_RULES' layout. Its Files and StallSeconds replace the defaults; a rule
+    named like a default one replaces it (Action 'off' turns it off), others are added."""
+
+    rules = json.loads(json.dumps(DEFAULT_RULES))
+
+    path = path or os.environ.get(SOLVER_RULES_ENV)
+    if not path:
+        return rules
+
+    try:
+        with open(path, 'r') as f_in:
+            overrides = json.load(f_in)
+    except (IOError, ValueError) as e:
+        raise SolverRulesError("Cannot read solver monitor rules {}: {}".format(path, e))
+
+    for solver, override in overrides.items():
+        solver_rules = rules.setdefault(solver.upper(), {'Files': [], 'StallSeconds': None, 'Rules': []})
+
+        for key in ['Files', 'StallSeconds']:
+            if key in override:
+                solver_rules[key] = override[key]
+
+        for rule in override.get('Rules', []):
+            if rule.get('Action', 'abort') not in ACTIONS or 'Name' not in rule or 'Pattern' not in rule:
+                raise SolverRulesError("{}: {} rule {} needs a Name, a Pattern and an Action of {}".format(
+                    path, solver, rule, ACTIONS))
+
+            try:
+                re.compile(rule['Pattern'])
+            except re.error as e:
+                raise SolverRulesError("{}: {} rule {}: {}".format(path, solver, rule['Name'], e))
+
+            names = [r['Name'] for r in solver_rules['Rules']]
+            if rule['Name'] in names:
+                solver_rules['Rules'][names.index(rule['Name'])] = rule
+            else:
+                solver_rules['Rules'].append(rule)
+
+    return rules
+
+
+def popen_kwargs(rlimits=None):
+    """Popen arguments that let kill_process_tree stop the process and everything it starts, and
+    give it rlimits, a list of (resource, (soft, hard)) (see SolverResources.solver_rlimits)."""
+
+    if os.name == 'nt':
+        return {}
+
+    def preexec():
+        os.setpgrp()
+
+        import resource
+        for limit, (soft, hard) in rlimits or []:
+            current_hard = resource.getrlimit(limit)[1]
+            if current_hard != resource.RLIM_INFINITY:
+                soft, hard = min(soft, current_hard), min(hard, current_hard)
+            resource.setrlimit(limit, (soft, hard))
+
+    return {'preexec_fn': preexec}
+
+
+def kill_process_tree(process):
+    """Stop process and its children (Nastran and Abaqus drivers start the solver as a child)."""
+
+    if process.poll() is not None:
+        return
+
+    if os.name == 'nt':
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=devnull, stderr=devnull)
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except OSError:
+        return
+
+    deadline = time.time() + KILL_GRACE_SECONDS
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class LogTail():
+    """The lines added to a log since it was last read, numbered from where reading began. A log
+    that shrinks, or whose bytes before the read position change, was rewritten and is read again
+    from the start."""
+
+    def __init__(self, path, start_at_end=False):
+
+        self.path = path
+        self.offset = 0
+        self.signature = ''
+        self.partial = ''
+        self.line_number = 0
+
+        if start_at_end:
+            with open(path, 'rb') as f_in:
+                f_in.seek(0, os.SEEK_END)
+                self.offset = f_in.tell()
+                f_in.seek(max(0, self.offset - SIGNATURE_BYTES))
+                self.signature = f_in.read(SIGNATURE_BYTES)
+
+    def new_lines(self):
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+
+        if size == self.offset:
+            return []
+
+        with open(self.path, 'rb') as f_in:
+            if size > self.offset:
+                f_in.seek(self.offset - len(self.signature))
+
+            if size < self.offset or f_in.read(len(self.signature)) != self.signature:
+                f_in.seek(0)
+                self.offset = 0
+                self.partial = ''
+                self.line_number = 0
+
+            data = f_in.read(size - self.offset)
+
+        self.offset += len(data)
+        self.signature = (self.signature + data)[-SIGNATURE_BYTES:]
+
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+
+        return lines
+
+
+class SolverMonitor():
+    """Watches the logs of a running solver and kills it on the first abort rule that matches, or
+    when its logs stop growing for StallSeconds, instead of letting it run on (or hang) holding a
+    license and cores. The reason is kept in self.reason and added to _FAILED.txt.
+
+    Logs already in the directory are read from their current end, so a previous run's messages
+    do not count. stop() reads them one last time: Nastran exits with 0 after most fatal messages."""
+
+    def __init__(self, process, solvers, directory='.', rules=None, poll_seconds=POLL_SECONDS, logger=None):
+
+        self.logger = logger or logging.getLogger('SolverMonitor')
+
+        self.process = process
+        self.directory = os.path.abspath(directory)
+        self.poll_seconds = poll_seconds
+
+        rules = rules or load_rules()
+        solver_rules = [rules[solver] for solver in solvers if solver in rules]
+
+        self.patterns = sorted(set(pattern for r in solver_rules for pattern in r.get('Files', [])))
+        self.rules = [dict(rule, Regex=re.compile(rule['Pattern']), Matches=0)
+                      for r in solver_rules for rule in r.get('Rules', []) if rule.get('Action', 'abort') != 'off']
+
+        stall_seconds = [r['StallSeconds'] for r in solver_rules if r.get('StallSeconds')]
+        self.stall_seconds = min(stall_seconds) if stall_seconds else None
+
+        self.tails = {}
+        for path in self.log_paths():
+            try:
+                self.tails[path] = LogTail(path, start_at_end=True)
+            except IOError:
+                pass
+
+        self.reason = None
+        self.matched_rule = None
+        self.last_growth = time.time()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='SolverMonitor')
+        self.thread.daemon = True
+
+    def start(self):
+
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching once the solver has exited. Returns the reason it was (or should have been) stopped."""
+
+        self.stopped.set()
+        self.thread.join()
+
+        if self.reason is None and self.scan():
+            self.logger.error("Solver failed: {}".format(self.reason))
+            self.write_failed()
+
+        return self.reason
+
+    def log_paths(self):
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+
+        return [os.path.join(self.directory, name) for name in sorted(names)
+                if any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)]
+
+    def run(self):
+
+        while not self.stopped.wait(self.poll_seconds):
+            if self.process.poll() is not None:
+                break
+
+            if self.scan():
+                self.abort()
+                break
+
+            if self.stall_seconds and time.time() - self.last_growth > self.stall_seconds:
+                self.reason = "no output in {} for {} s".format(', '.join(self.patterns), self.stall_seconds)
+                self.matched_rule = 'Stall'
+                self.abort()
+                break
+
+    def scan(self):
+        """Read what the logs gained; True if an abort rule matched."""
+
+        for path in self.log_paths():
+            tail = self.tails.setdefault(path, LogTail(path))
+
+            lines = tail.new_lines()
+            if lines:
+                self.last_growth = time.time()
+
+            for line in lines:
+                tail.line_number += 1
+
+                for rule in self.rules:
+                    if not rule['Regex'].search(line):
+                        continue
+
+                    rule['Matches'] += 1
+                    where = "{}:{}: {}".format(os.path.basename(path), tail.line_number, line.strip())
+
+                    if rule['Action'] == 'warn':
+                        if rule['Matches'] == 1:
+                            self.logger.warning("{} in {}".format(rule['Name'], where))
+                        continue
+
+                    if rule['Matches'] >= rule.get('Count', 1):
+                        self.reason = "{} in {}".format(rule['Name'], where)
+                        self.matched_rule = rule['Name']
+                        return True
+
+        return False
+
+    def abort(self):
+
+        self.logger.error("Stopping the solver (pid {}): {}".format(self.process.pid, self.reason))
+        kill_process_tree(self.process)
+        self.write_failed()
+
+    def write_failed(self):
+
+        try:
+            with open(os.path.join(self.directory, FAILED_FILE_NAME), 'a') as f_out:
+                f_out.write("SolverMonitor: {}\n".format(self.reason))
+        except IOError as e:
+            self.logger.warning("Could not write {}: {}".format(FAILED_FILE_NAME, e))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run a solver command, stopping it when its logs show it has "
+                                                 "failed; or check logs against the rules")
+    parser.add_argument('-solver', action='append', required=True, choices=sorted(DEFAULT_RULES),
+                        help="Rules to apply; may be given more than once")
+    parser.add_argument('-rules', default=None, help="Rules file (default: %%{}%%)".format(SOLVER_RULES_ENV))
+    parser.add_argument('-dir', default='.', help="Where the solver writes its logs")
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="Solver command; if none, check the logs in -dir")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    try:
+        rules = load_rules(args.rules)
+    except SolverRulesError as e:
+        print(e)
+        sys.exit(2)
+
+    if not args.command:
+        monitor = SolverMonitor(None, args.solver, args.dir, rules)
+        monitor.tails = {}
+        monitor.scan()
+        print(monitor.reason or "No abort rule matched in {}".format(', '.join(monitor.tails) or args.dir))
+        sys.exit(1 if monitor.reason else 0)
+
+    process = subprocess.Popen(args.command, cwd=args.dir, **popen_kwargs())
+    monitor = SolverMonitor(process, args.solver, args.dir, rules).start()
+
+    try:
+        exit_code = process.wait()
+    finally:
+        kill_process_tree(process)
+        reason = monitor.stop()
+
+    if reason:
+        print("Stopped: {}".format(reason))
+        sys.exit(1)
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+
+    main()
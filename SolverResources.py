@@ -0,0 +1,498 @@
+import os
+import sys
+import json
+import math
+import errno
+import argparse
+import time
+import logging
+import tempfile
+import multiprocessing
+from JobMetrics import locked
+
+# Running CADJobDriver jobs register here, so each can size its solve by how many share the node
+JOB_REGISTRY_ENV = 'CAD_JOB_REGISTRY'
+JOB_REGISTRY_DIR_NAME = 'CADJobDriver_jobs'
+
+# Overrides for the host, e.g. when other work runs on the node
+CORES_ENV = 'SOLVER_CORES'
+MEMORY_MB_ENV = 'SOLVER_MEMORY_MB'
+JOBS_PER_NODE_ENV = 'CAD_JOBS_PER_NODE'
+MAX_DMP_ENV = 'NASTRAN_MAX_DMP'
+
+# Fraction of physical memory the solves on a node may use together, unless SOLVER_MEMORY_MB is set
+MEMORY_FRACTION = 0.8
+MIN_MEMORY_MB = 512
+
+# Rough solver memory need: TETRA10 meshes have about 4.5 DOF per element
+MEMORY_MB_PER_1000_ELEMENTS = 8.0
+
+# Once this many past jobs recorded their element count and peak memory, memory is estimated
+# from the MEMORY_PERCENTILE of their MB per 1000 elements, plus MEMORY_HEADROOM
+MIN_MEMORY_SAMPLES = 5
+MEMORY_PERCENTILE = 0.9
+MEMORY_HEADROOM = 1.25
+
+# A solve waits until the node has the memory it is estimated to need; the jobs' reservations
+# are kept in the job registry as <pid>.mem
+ADMISSION_POLL_SECONDS = 1
+ADMISSION_LOCK_FILE_NAME = 'memory.lock'
+
+# Set to limit the address space of each solver process to this many times its memory estimate
+# (e.g. 3), plus RLIMIT_BASE_MB for code, thread stacks and allocator arenas. Off by default.
+RLIMIT_FACTOR_ENV = 'SOLVER_RLIMIT_FACTOR'
+DEFAULT_RLIMIT_FACTOR = 0.0
+RLIMIT_BASE_MB = 2048
+
+# Cores a model of up to this many elements can use well; sparse direct solves stop scaling below them
+CORES_BY_MODEL_SIZE = [(50000, 2), (250000, 4), (1000000, 8)]
+
+# Nastran DMP splits a model into domains; below this size the split costs more than it saves
+MIN_DMP_ELEMENTS = 500000
+MIN_CORES_PER_DMP_TASK = 4
+
+
+def host_cores():
+
+    cores = os.environ.get(CORES_ENV)
+    return int(cores) if cores else multiprocessing.cpu_count()
+
+
+def solver_memory_mb():
+    """Memory in MB the solves on this node may use together, or None if it cannot be found."""
+
+    memory = os.environ.get(MEMORY_MB_ENV)
+    if memory:
+        return int(memory)
+
+    physical = physical_memory_mb()
+    return int(physical * MEMORY_FRACTION) if physical is not None else None
+
+
+def _memory_status():
+    """GlobalMemoryStatusEx's MEMORYSTATUSEX (Windows only), or None if the call fails."""
+
+    import ctypes
+
+    class MemoryStatusEx(ctypes.Structure):
+        _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+    status = MemoryStatusEx()
+    status.dwLength = ctypes.sizeof(MemoryStatusEx)
+
+    if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return status
+    return None
+
+
+def physical_memory_mb():
+
+    if sys.platform == 'win32':
+        status = _memory_status()
+        return int(status.ullTotalPhys / (1024 * 1024)) if status is not None else None
+
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def free_memory_mb():
+    """Memory in MB that can be used on this node without swapping, or None if it cannot be found."""
+
+    if sys.platform == 'win32':
+        status = _memory_status()
+        return int(status.ullAvailPhys / (1024 * 1024)) if status is not None else None
+
+    # MemAvailable counts the page cache the kernel can drop; SC_AVPHYS_PAGES does not
+    try:
+        with open('/proc/meminfo', 'r') as f_in:
+            for line in f_in:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, ValueError, IndexError):
+        pass
+
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES') / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def process_alive(pid):
+
+    if sys.platform == 'win32':
+        import ctypes
+
+        process_query_limited_information = 0x1000
+        still_active = 259
+
+        handle = ctypes.windll.kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+
+        exit_code = ctypes.c_ulong()
+        try:
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+
+        return exit_code.value == still_active
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+def job_registry_dir():
+    return os.environ.get(JOB_REGISTRY_ENV) or os.path.join(tempfile.gettempdir(), JOB_REGISTRY_DIR_NAME)
+
+
+def register_job(job_dir):
+    """Record that this process is running a job until unregister_job; returns the record's path."""
+
+    registry_dir = job_registry_dir()
+
+    if not os.path.isdir(registry_dir):
+        try:
+            os.makedirs(registry_dir)
+        except OSError:
+            if not os.path.isdir(registry_dir):
+                raise
+
+    record_path = os.path.join(registry_dir, '{}.job'.format(os.getpid()))
+
+    with open(record_path, 'w') as f_out:
+        f_out.write(job_dir)
+
+    return record_path
+
+
+def unregister_job(record_path):
+
+    try:
+        os.remove(record_path)
+    except OSError:
+        pass
+
+
+def running_jobs():
+    """Jobs running on this node, including this one. Records of processes that died are removed."""
+
+    jobs_per_node = os.environ.get(JOBS_PER_NODE_ENV)
+    if jobs_per_node:
+        return max(1, int(jobs_per_node))
+
+    registry_dir = job_registry_dir()
+    count = 0
+
+    if os.path.isdir(registry_dir):
+        for name in os.listdir(registry_dir):
+            pid_text, _, extension = name.partition('.')
+            if extension != 'job' or not pid_text.isdigit():
+                continue
+
+            if process_alive(int(pid_text)):
+                count += 1
+            else:
+                unregister_job(os.path.join(registry_dir, name))
+
+    return max(1, count)
+
+
+def memory_mb_per_1000_elements(records=()):
+    """Solver memory per 1000 elements, calibrated on the solver peak memory of past jobs (runtime
+    history records) once there are MIN_MEMORY_SAMPLES of them; MEMORY_MB_PER_1000_ELEMENTS until then."""
+
+    ratios = sorted(r['SolverPeakMemoryMB'] * 1000.0 / r['Features']['Elements'] for r in records
+                    if r.get('SolverPeakMemoryMB') and r.get('Features', {}).get('Elements'))
+
+    if len(ratios) < MIN_MEMORY_SAMPLES:
+        return MEMORY_MB_PER_1000_ELEMENTS
+
+    return ratios[max(0, int(math.ceil(MEMORY_PERCENTILE * len(ratios))) - 1)] * MEMORY_HEADROOM
+
+
+def estimate_memory_mb(elements=None, records=(), mb_per_1000_elements=None):
+    """Memory in MB a solve of a model of elements needs. Before a model is meshed (elements None),
+    the MEMORY_PERCENTILE of the past jobs' peak memory, or MIN_MEMORY_MB without enough of them."""
+
+    if elements is None:
+        peaks = sorted(r['PeakMemoryMB'] for r in records if r.get('PeakMemoryMB'))
+        if len(peaks) < MIN_MEMORY_SAMPLES:
+            return MIN_MEMORY_MB
+        return max(MIN_MEMORY_MB, int(peaks[int(math.ceil(MEMORY_PERCENTILE * len(peaks))) - 1] * MEMORY_HEADROOM))
+
+    if mb_per_1000_elements is None:
+        mb_per_1000_elements = memory_mb_per_1000_elements(records)
+
+    return max(MIN_MEMORY_MB, int(elements / 1000.0 * mb_per_1000_elements))
+
+
+def reserved_memory_mb():
+    """Memory in MB reserved by the solves of other jobs on this node. Reservations of processes
+    that died are removed."""
+
+    registry_dir = job_registry_dir()
+    reserved = 0
+
+    if not os.path.isdir(registry_dir):
+        return reserved
+
+    for name in os.listdir(registry_dir):
+        pid_text, _, extension = name.partition('.')
+        if extension != 'mem' or not pid_text.isdigit() or int(pid_text) == os.getpid():
+            continue
+
+        path = os.path.join(registry_dir, name)
+
+        if not process_alive(int(pid_text)):
+            unregister_job(path)
+            continue
+
+        try:
+            with open(path, 'r') as f_in:
+                reserved += int(f_in.read().strip() or 0)
+        except (IOError, ValueError):
+            pass    # being written
+
+    return reserved
+
+
+def reserve_memory(memory_mb, budget_mb=None, logger=None, poll_seconds=ADMISSION_POLL_SECONDS):
+    """Wait until memory_mb is free on this node for a solve, then reserve it until release_memory.
+    Returns (reservation path, seconds waited).
+
+    Memory is free if it is both within budget_mb (default: solver_memory_mb()) less the other
+    jobs' reservations (which cover solves that have not grown to their size yet) and within
+    free_memory_mb() (which covers everything else on the node). A solve is let through without it
+    when no other job holds a reservation, as waiting would not free any."""
+
+    logger = logger or logging.getLogger('SolverResources')
+
+    registry_dir = job_registry_dir()
+    if not os.path.isdir(registry_dir):
+        try:
+            os.makedirs(registry_dir)
+        except OSError:
+            if not os.path.isdir(registry_dir):
+                raise
+
+    reservation_path = os.path.join(registry_dir, '{}.mem'.format(os.getpid()))
+    start = time.time()
+    waiting = False
+
+    while True:
+        with locked(os.path.join(registry_dir, ADMISSION_LOCK_FILE_NAME)):
+            budget = budget_mb or solver_memory_mb()
+            reserved = reserved_memory_mb()
+            free = free_memory_mb()
+
+            limits = [m for m in [budget - reserved if budget is not None else None, free] if m is not None]
+            available = min(limits) if limits else None
+
+            if available is None or memory_mb <= available or reserved == 0:
+                with open(reservation_path, 'w') as f_out:
+                    f_out.write(str(memory_mb))
+                break
+
+        if not waiting:
+            logger.info("Waiting for {} MB of memory: {} MB available, {} MB reserved by other jobs".format(
+                memory_mb, available, reserved))
+            waiting = True
+
+        time.sleep(poll_seconds)
+
+    if available is not None and memory_mb > available:
+        logger.warning("Solving with {} MB estimated and {} MB available; it may swap".format(memory_mb, available))
+    elif waiting:
+        logger.info("{} MB of memory reserved after {:.0f} s".format(memory_mb, time.time() - start))
+
+    return reservation_path, time.time() - start
+
+
+def release_memory(reservation_path):
+    unregister_job(reservation_path)
+
+
+def solver_rlimits(memory_mb=None):
+    """(resource, (soft, hard)) limits for a solver process estimated to need memory_mb: no core
+    dumps, and if RLIMIT_FACTOR_ENV is set, an address space limit, so a runaway solve fails on its
+    own instead of pushing the node into swap. Pass memory_mb None when the estimate is only a
+    guess (e.g. before the model is meshed). None where there are no rlimits (Windows)."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    limits = [(resource.RLIMIT_CORE, (0, 0))]
+
+    factor = float(os.environ.get(RLIMIT_FACTOR_ENV, DEFAULT_RLIMIT_FACTOR))
+    if factor > 0 and memory_mb:
+        address_space = int((memory_mb * factor + RLIMIT_BASE_MB) * 1024 * 1024)
+        limits.append((resource.RLIMIT_AS, (address_space, address_space)))
+
+    return limits
+
+
+def maxrss_mb(maxrss):
+
+    if not maxrss:
+        return None
+
+    # Bytes on macOS, KB elsewhere
+    return int(maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0))
+
+
+def children_peak_memory_mb():
+    """Largest resident memory in MB of the finished child processes (and theirs) of this process,
+    or None where it is not known (Windows)."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    return maxrss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def wait_with_peak_memory(process):
+    """process.wait(), and the largest resident memory in MB of process and the children it waited
+    for. The peak is None where it is not known (Windows, or process was reaped by a poll() elsewhere)."""
+
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                return process.wait(), None
+            if e.errno != errno.EINTR:
+                raise
+
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+    return process.returncode, maxrss_mb(usage.ru_maxrss)
+
+
+def plan_resources(elements=None, jobs=None, cores=None, memory_mb=None, max_dmp=None, mb_per_1000_elements=None):
+    """Cores, memory and the Nastran SMP/DMP split for one solve.
+
+    cores and memory_mb are what the solves on the node may use (default: host_cores() and
+    solver_memory_mb()). They are shared evenly by the jobs running on it; a small model
+    gets fewer cores than its share (CORES_BY_MODEL_SIZE), and no more memory than it needs
+    (estimate_memory_mb). elements is the model's element count, None if unknown."""
+
+    jobs = jobs or running_jobs()
+    cores = cores or host_cores()
+    memory_mb = memory_mb or solver_memory_mb()
+    max_dmp = max_dmp or int(os.environ.get(MAX_DMP_ENV, 1))
+
+    job_cores = max(1, cores // jobs)
+
+    if elements is not None:
+        for max_elements, model_cores in CORES_BY_MODEL_SIZE:
+            if elements <= max_elements:
+                job_cores = min(job_cores, model_cores)
+                break
+
+    needed = None
+    if elements is not None:
+        needed = estimate_memory_mb(elements, mb_per_1000_elements=mb_per_1000_elements)
+
+    job_memory_mb = None
+    if memory_mb is not None:
+        job_memory_mb = max(MIN_MEMORY_MB, memory_mb // jobs)
+        if needed is not None:
+            job_memory_mb = min(job_memory_mb, needed)
+
+    dmp = 1
+    if elements is not None and elements >= MIN_DMP_ELEMENTS:
+        dmp = max(1, min(max_dmp, job_cores // MIN_CORES_PER_DMP_TASK))
+
+    return {
+        'Elements': elements,
+        'Jobs': jobs,
+        'NodeCores': cores,
+        'NodeMemoryMB': memory_mb,
+        'Cores': job_cores,
+        'MemoryMB': job_memory_mb,
+        'EstimatedMemoryMB': needed,
+        'NastranDMP': dmp,
+        'NastranSMP': max(1, job_cores // dmp)
+    }
+
+
+def nastran_keywords(plan):
+
+    keywords = ['smp={}'.format(plan['NastranSMP'])]
+
+    if plan['NastranDMP'] > 1:
+        keywords.append('dmp={}'.format(plan['NastranDMP']))
+
+    if plan['MemoryMB']:
+        keywords.append('mem={}mb'.format(plan['MemoryMB']))
+
+    return ' '.join(keywords)
+
+
+def abaqus_options(plan):
+
+    options = ['cpus={}'.format(plan['Cores']), 'mp_mode=threads']
+
+    if plan['MemoryMB']:
+        options.append('memory="{} mb"'.format(plan['MemoryMB']))
+
+    return ' '.join(options)
+
+
+def calculix_environment(plan, environment=None):
+    """A copy of environment (default os.environ) with CalculiX's thread counts set."""
+
+    environment = dict(os.environ if environment is None else environment)
+    threads = str(plan['Cores'])
+
+    for name in ['OMP_NUM_THREADS', 'CCX_NPROC_STIFFNESS', 'CCX_NPROC_EQUATION_SOLVER', 'CCX_NPROC_RESULTS']:
+        environment[name] = threads
+
+    return environment
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Show the solver cores and memory a job would get on this node")
+    parser.add_argument('-elements', type=int, default=None)
+    parser.add_argument('-jobs', type=int, default=None, help="Jobs sharing the node (default: registered jobs)")
+    parser.add_argument('-history', default=None, help="Runtime history the memory estimate is calibrated on "
+                                                       "(default: %%CAD_RUNTIME_HISTORY%%)")
+    args = parser.parse_args()
+
+    from RuntimePredictor import read_history
+
+    records = read_history(args.history)
+    mb_per_1000_elements = memory_mb_per_1000_elements(records)
+
+    plan = plan_resources(args.elements, args.jobs, mb_per_1000_elements=mb_per_1000_elements)
+
+    print(json.dumps(plan, indent=4, sort_keys=True))
+    print("Memory: {:.1f} MB per 1000 elements ({}), {} MB free, {} MB reserved by running jobs".format(
+        mb_per_1000_elements, 'calibrated on past jobs' if mb_per_1000_elements != MEMORY_MB_PER_1000_ELEMENTS
+        else 'default', free_memory_mb(), reserved_memory_mb()))
+    print("Nastran: {}".format(nastran_keywords(plan)))
+    print("Abaqus: {}".format(abaqus_options(plan)))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,113 @@
+import re
+import csv
+import heapq
+import logging
+
+
+DEFAULT_HOTSPOT_COUNT = 5
+
+SUBCASE_PATTERN = re.compile(r'SUBCASE\s+(\d+)\s*$')
+
+# "0       123           0GRID CS  4 GP" starts the stress block of one solid element
+SOLID_ELEMENT_PATTERN = re.compile(r'^[0 ]\s*(\d+)\s+0GRID CS\s+\d+\s+GP')
+
+# The X row of the center and of each corner ends with the von Mises stress at that point
+SOLID_POINT_PATTERN = re.compile(r'^[0 ]\s*(?:CENTER|\d+)\s+X\s')
+
+
+def _heap_push(heap, k, entry):
+    if len(heap) < k:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+
+def find_solid_hotspots(f06_path, bdf_index, k=DEFAULT_HOTSPOT_COUNT):
+    """Read the solid element stress tables of a Nastran .f06 in one pass and keep
+    the k highest von Mises elements per property id.
+
+    Each element's stress is the maximum over its center and corner points. Memory is
+    bounded by (properties x k) whatever the size of the .f06.
+
+    Returns {pid: [(von_mises, element_id, subcase), ...]}, highest stress first."""
+
+    logger = logging.getLogger('StressHotspots')
+
+    heaps = {}
+    subcase = ''
+    in_solid_stresses = False
+    element_id = None
+    element_vm = None
+    unknown_elements = 0
+
+    def flush():
+        if element_id is None or element_vm is None:
+            return 0
+        try:
+            pid = bdf_index.property_for_element(element_id)
+        except KeyError:
+            return 1
+        _heap_push(heaps.setdefault(pid, []), k, (element_vm, element_id, subcase))
+        return 0
+
+    with open(f06_path, 'r') as f06_in:
+        for line in f06_in:
+
+            if 'S T R E S S E S' in line or 'F O R C E S' in line or 'D I S P L A C E M E N T' in line:
+                # Titles repeat on every page; an element block may continue across the page break
+                solid_title = 'S T R E S S E S' in line and 'S O L I D' in line
+                if solid_title != in_solid_stresses:
+                    unknown_elements += flush()
+                    element_id = None
+                    in_solid_stresses = solid_title
+                continue
+
+            subcase_match = SUBCASE_PATTERN.search(line)
+            if subcase_match:
+                if subcase_match.group(1) != subcase:
+                    unknown_elements += flush()
+                    element_id = None
+                    subcase = subcase_match.group(1)
+                continue
+
+            if not in_solid_stresses:
+                continue
+
+            element_match = SOLID_ELEMENT_PATTERN.match(line)
+            if element_match:
+                unknown_elements += flush()
+                element_id = int(element_match.group(1))
+                element_vm = None
+                continue
+
+            if element_id is not None and SOLID_POINT_PATTERN.match(line):
+                try:
+                    vm = float(line.split()[-1])
+                except ValueError:
+                    continue
+                if element_vm is None or vm > element_vm:
+                    element_vm = vm
+
+    unknown_elements += flush()
+
+    if unknown_elements:
+        logger.warning("{} elements in {} are not in {}".format(unknown_elements, f06_path, bdf_index.bdf_path))
+
+    return dict((pid, sorted(heap, reverse=True)) for pid, heap in heaps.items())
+
+
+def write_hotspots_csv(csv_path, hotspots, bdf_index, component_ids_by_label):
+    """Write one row per hotspot. component_ids_by_label maps Patran part labels
+    (e.g. 'psolid.3', lower case) to ComponentIDs."""
+
+    with open(csv_path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Unique ID", "Part", "Load Case", "Rank", "Element ID", "Von Mises Stress", "X", "Y", "Z"])
+
+        for pid in sorted(hotspots):
+            label = bdf_index.property_label(pid)
+            component_id = component_ids_by_label.get(label.lower(), '')
+
+            for rank, (vm, element_id, subcase) in enumerate(hotspots[pid], 1):
+                x, y, z = bdf_index.element_centroid(element_id)
+                writer.writerow([component_id, label, subcase, rank, element_id, vm, x, y, z])
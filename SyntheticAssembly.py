@@ -0,0 +1,254 @@
+import os
+import json
+import argparse
+import xml.etree.cElementTree as etree
+
+
+ASSEMBLY_NAME = 'SyntheticAssembly'
+ASSEMBLY_COMPONENT_ID = '{00000000-0000-0000-0000-000000000000}'
+
+# Material library entries, in the units material_library.json uses (Pa, kg/m^3, 1/K)
+MATERIAL_PROPERTIES = [
+    (200.0e9, 0.29, 7850.0, 1.2e-5),
+    (70.0e9, 0.33, 2700.0, 2.3e-5),
+    (110.0e9, 0.34, 4430.0, 8.6e-6),
+    (3.5e9, 0.37, 1200.0, 7.0e-5)
+]
+
+
+def component_id(part_number):
+    return '{{00000000-0000-0000-0000-{:012d}}}'.format(part_number)
+
+
+def material_name(material_number):
+    return 'synthetic_material_{}'.format(material_number)
+
+
+def sub_element(parent, tag, **attributes):
+    return etree.SubElement(parent, tag, dict((k, str(v)) for k, v in attributes.items()))
+
+
+class SyntheticAssembly():
+    """Writes a CADAssembly.xml, CADAssembly_metrics.xml, ComputedValues.xml and material library
+    that PatranPCL reads like a CREO export, for benchmarking without CAD.
+
+    Every load and constraint gets its own face and point metric. Layered parts get a
+    MaterialLayup and a SURFACE element instead of a solid."""
+
+    def __init__(self, parts=100, layered_parts=0, layers=4, load_sets=1, loads=1, constraints=1,
+                 materials=4, critical_parts=0):
+
+        self.parts = parts
+        self.layered_parts = min(layered_parts, parts)
+        self.layers = layers
+        self.load_sets = load_sets
+        self.loads = loads
+        self.constraints = constraints
+        self.materials = max(materials, 1)
+        self.critical_parts = min(critical_parts, parts)
+
+        self.metric_id = 0
+        self.point_metric_ids = []
+
+    def next_metric_id(self):
+        self.metric_id += 1
+        return self.metric_id
+
+    def add_face(self, parent, name):
+        """A Geometry/Features FACE node with a point metric, as CREO writes for a picked face."""
+
+        metric_id = self.next_metric_id()
+        self.point_metric_ids.append(metric_id)
+
+        geometry = sub_element(parent, 'Geometry', _id='id-geometry-{}'.format(metric_id))
+        features = sub_element(geometry, 'Features', _id='id-features-{}'.format(metric_id),
+                               GeometryType='FACE', FeatureGeometryType='POINT', PrimaryGeometryQualifier='ANY')
+        sub_element(features, 'Feature', _id='id-feature-{}'.format(metric_id), MetricID=metric_id,
+                    Name=name, ComponentID=component_id(1 + metric_id % self.parts))
+
+    def create_cad_assembly(self):
+
+        root = etree.Element('Assemblies', {'VersionInfo': 'SyntheticAssembly'})
+        assembly = sub_element(root, 'Assembly', _id='id-assembly', ConfigurationID='SyntheticConfiguration')
+        top = sub_element(assembly, 'CADComponent', _id='id-asm', ComponentID=ASSEMBLY_COMPONENT_ID,
+                          Type='ASSEMBLY', Name=ASSEMBLY_NAME, DisplayName=ASSEMBLY_NAME)
+
+        for part_number in range(1, self.parts + 1):
+            part = sub_element(top, 'CADComponent', _id='id-part-{}'.format(part_number),
+                               ComponentID=component_id(part_number), Type='PART',
+                               Name='Part_{}'.format(part_number), DisplayName='Part_{}'.format(part_number))
+
+            if part_number <= self.layered_parts:
+                self.add_layup(part, part_number)
+
+        analyses = sub_element(assembly, 'Analyses', _id='id-analyses')
+        fea = sub_element(analyses, 'FEA', _id='id-fea', AnalysisID='SyntheticFEA', Type='STRUCTURAL',
+                          MeshOnly='false')
+
+        solvers = sub_element(fea, 'Solvers', _id='id-solvers')
+        sub_element(solvers, 'Solver', _id='id-solver', Type='PATRAN_NASTRAN', MeshType='SOLID',
+                    ShellElementType='PLATE_4_NODE', ElementShapeType='TETRA_10', AnalysisSolutionType='STATIC')
+
+        sub_element(fea, 'MeshParameters', _id='id-mesh-parameters', Max_Global_Length='0.1',
+                    Max_Curv_Delta_Div_Edge_Len='0.1', Ratio_Min_Edge_To_Max_Edge='0.2',
+                    Match_Face_Proximity_Tol='0.05')
+
+        analysis_constraints = sub_element(fea, 'AnalysisConstraints', _id='id-analysis-constraints')
+
+        for constraint_number in range(1, self.constraints + 1):
+            analysis_constraint = sub_element(analysis_constraints, 'AnalysisConstraint',
+                                              _id='id-analysis-constraint-{}'.format(constraint_number))
+            displacement = sub_element(analysis_constraint, 'Displacement',
+                                       _id='id-displacement-{}'.format(constraint_number))
+            sub_element(displacement, 'Translation', x='FIXED', y='FIXED', z='FIXED', Units='mm')
+            sub_element(displacement, 'Rotation', x='FREE', y='FREE', z='FREE', Units='deg')
+            self.add_face(analysis_constraint, 'Constraint_{}'.format(constraint_number))
+
+        for load_set_number in range(1, self.load_sets + 1):
+            loads = sub_element(fea, 'Loads', _id='id-loads-{}'.format(load_set_number),
+                                Name='LoadSet_{}'.format(load_set_number))
+
+            for load_number in range(1, self.loads + 1):
+                load = sub_element(loads, 'Load', _id='id-load-{}-{}'.format(load_set_number, load_number))
+                sub_element(load, 'Pressure', _id='id-pressure-{}-{}'.format(load_set_number, load_number),
+                            Units='MPa', Value=float(load_set_number * load_number))
+                self.add_face(load, 'Load_{}_{}'.format(load_set_number, load_number))
+
+        fea_metrics = sub_element(fea, 'Metrics', _id='id-fea-metrics')
+
+        for part_number in range(1, self.critical_parts + 1):
+            sub_element(fea_metrics, 'Metric', ComponentID=component_id(part_number),
+                        MetricID=self.next_metric_id(), MetricType='VONMISESSTRESS', RequestedValueType='SCALAR')
+
+        # PatranPCL looks for the point metrics under Static
+        static = sub_element(analyses, 'Static', _id='id-static')
+        static_metrics = sub_element(static, 'Metrics', _id='id-static-metrics')
+
+        for metric_id in self.point_metric_ids:
+            sub_element(static_metrics, 'Metric', ComponentID=ASSEMBLY_COMPONENT_ID, MetricID=metric_id,
+                        MetricType='POINTCOORDINATES', RequestedValueType='VECTOR')
+
+        return etree.ElementTree(root)
+
+    def add_layup(self, part, part_number):
+
+        elements = sub_element(part, 'Elements', _id='id-elements-{}'.format(part_number))
+        element = sub_element(elements, 'Element', _id='id-element-{}'.format(part_number), ElementType='SURFACE')
+        self.add_face(element, 'Surface_{}'.format(part_number))
+
+        contents = sub_element(element, 'ElementContents', _id='id-contents-{}'.format(part_number))
+        layup = sub_element(contents, 'MaterialLayup', _id='id-layup-{}'.format(part_number),
+                            Postion='MIDDLE', OffsetValue='0.0')  # sic, PatranPCL reads 'Postion'
+
+        for layer_number in range(1, self.layers + 1):
+            sub_element(layup, 'Layer', ID=layer_number, Drop_Order=layer_number,
+                        Material_Name=material_name(1 + (part_number + layer_number) % self.materials),
+                        Thickness='0.5', Orientation=(45 * layer_number) % 180)
+
+        orientation = sub_element(contents, 'Orientation', _id='id-orientation-{}'.format(part_number))
+        geometry = sub_element(orientation, 'Geometry', _id='id-orientation-geometry-{}'.format(part_number))
+        features = sub_element(geometry, 'Features', GeometryType='POINT', FeatureGeometryType='POINT')
+
+        for name in ['Direction_Start_Pt', 'Direction_End_Pt']:
+            metric_id = self.next_metric_id()
+            self.point_metric_ids.append(metric_id)
+            sub_element(features, 'Feature', _id='id-feature-{}'.format(metric_id), MetricID=metric_id, Name=name)
+
+    def create_cad_assembly_metrics(self):
+
+        root = etree.Element('CADAssemblyMetrics')
+        metric_components = sub_element(root, 'MetricComponents')
+
+        for part_number in range(1, self.parts + 1):
+            metric_component = sub_element(metric_components, 'MetricComponent', MetricID=part_number,
+                                           Name='Part_{}'.format(part_number), Type='PART')
+            sub_element(metric_component, 'Material', Type=material_name(1 + part_number % self.materials))
+
+        assemblies = sub_element(root, 'Assemblies')
+        top = sub_element(assemblies, 'CADComponent', MetricID=0, ComponentInstanceID=ASSEMBLY_COMPONENT_ID)
+
+        for part_number in range(1, self.parts + 1):
+            sub_element(top, 'CADComponent', MetricID=part_number, ComponentInstanceID=component_id(part_number))
+
+        return etree.ElementTree(root)
+
+    def create_computed_values(self):
+
+        root = etree.Element('Components')
+        component = sub_element(root, 'Component', ComponentID=ASSEMBLY_COMPONENT_ID)
+        metrics = sub_element(component, 'Metrics')
+
+        for metric_id in self.point_metric_ids:
+            sub_element(metrics, 'Metric', MetricID=metric_id, Type='VECTOR', Units='mm',
+                        ArrayValue='{};{};{}'.format(metric_id, 2 * metric_id, 3 * metric_id))
+
+        return etree.ElementTree(root)
+
+    def create_material_library(self):
+
+        library = {}
+
+        for material_number in range(1, self.materials + 1):
+            modulus, poissons, density, expansion = MATERIAL_PROPERTIES[material_number % len(MATERIAL_PROPERTIES)]
+
+            library[material_name(material_number)] = {
+                'mechanical__modulus_elastic': {'value': modulus, 'units': 'Pa'},
+                'mechanical__ratio_poissons': {'value': poissons},
+                'density': {'value': density, 'units': 'kg/m^3'},
+                'thermal__coefficient_expansion_linear': {'value': expansion, 'units': '1/K'}
+            }
+
+        return {'Material library': library}
+
+    def write(self, result_dir):
+        """Write the inputs into result_dir laid out like a CADJobDriver result directory.
+        Returns the Analysis/Patran_Nastran directory PatranPCL should run in."""
+
+        self.metric_id = 0
+        self.point_metric_ids = []
+
+        patran_nastran_dir = os.path.join(result_dir, 'Analysis', 'Patran_Nastran')
+        parasolid_dir = os.path.join(result_dir, 'Parasolid')
+
+        for directory in [patran_nastran_dir, parasolid_dir]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        # The metric IDs are assigned while CADAssembly.xml is built; the other files follow it
+        self.create_cad_assembly().write(os.path.join(result_dir, 'CADAssembly.xml'))
+        self.create_cad_assembly_metrics().write(os.path.join(result_dir, 'CADAssembly_metrics.xml'))
+        self.create_computed_values().write(os.path.join(result_dir, 'ComputedValues.xml'))
+
+        with open(os.path.join(result_dir, 'material_library.json'), 'w') as f_out:
+            json.dump(self.create_material_library(), f_out, indent=4, sort_keys=True)
+
+        with open(os.path.join(parasolid_dir, ASSEMBLY_NAME + '_asm.x_t'), 'w') as f_out:
+            f_out.write('**Synthetic Parasolid placeholder\n')
+
+        return patran_nastran_dir
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Write synthetic CADAssembly.xml, CADAssembly_metrics.xml, "
+                                                 "ComputedValues.xml and material_library.json")
+    parser.add_argument('result_dir', help="Output directory")
+    parser.add_argument('-parts', type=int, default=100)
+    parser.add_argument('-layered_parts', type=int, default=0, help="Parts with a MaterialLayup instead of a solid")
+    parser.add_argument('-layers', type=int, default=4, help="Layers per MaterialLayup")
+    parser.add_argument('-load_sets', type=int, default=1)
+    parser.add_argument('-loads', type=int, default=1, help="Loads per load set")
+    parser.add_argument('-constraints', type=int, default=1)
+    parser.add_argument('-materials', type=int, default=4)
+    parser.add_argument('-critical_parts', type=int, default=0, help="Parts with FEA metrics")
+    args = parser.parse_args()
+
+    synthetic_assembly = SyntheticAssembly(args.parts, args.layered_parts, args.layers, args.load_sets, args.loads,
+                                           args.constraints, args.materials, args.critical_parts)
+
+    print("Wrote {}".format(synthetic_assembly.write(args.result_dir)))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,292 @@
+import os
+import json
+import argparse
+import logging
+import tempfile
+from distutils.spawn import find_executable
+
+# Where the discovered paths are kept between runs, and an optional JSON file of {name: path}
+TOOL_PATHS_CACHE_ENV = 'TOOL_PATHS_CACHE'
+TOOL_PATHS_CONFIG_ENV = 'TOOL_PATHS_CONFIG'
+
+CACHE_FILE_NAME = 'CADToolPaths.json'
+CACHE_VERSION = 1
+
+BIN_CAD_DIR = os.path.dirname(os.path.realpath(__file__))
+
+PUBLIC_MATERIAL_LIBRARY = r'C:\Users\Public\Documents\META Documents\MaterialLibrary\material_library.json'
+ABAQUS_COMMAND = r'c:\SIMULIA\Abaqus\Commands\abaqus.bat'
+
+# MSC installs record each version's Path under <key>\<version> and the newest version in <key>\Latest
+PATRAN_REGISTRY_KEY = r'Software\Wow6432Node\MSC.Software Corporation\Patran x64'
+NASTRAN_REGISTRY_KEY = r'Software\Wow6432Node\MSC.Software Corporation\MSC Nastran x64'
+META_REGISTRY_KEY = r'Software\META'
+CALCULIX_REGISTRY_KEY = r'Software\CMS\CalculiX'
+
+
+class ToolPathError(Exception):
+    pass
+
+
+def read_registry(key_path, value_name):
+    """A value under HKEY_LOCAL_MACHINE (32 bit view), or None if it is not there or this is not Windows."""
+
+    try:
+        import _winreg
+    except ImportError:
+        return None
+
+    try:
+        with _winreg.OpenKey(_winreg.HKEY_LOCAL_MACHINE, key_path, 0,
+                             _winreg.KEY_READ | _winreg.KEY_WOW64_32KEY) as key:
+            return _winreg.QueryValueEx(key, value_name)[0]
+    except WindowsError:
+        return None
+
+
+def first_existing(*paths):
+
+    for path in paths:
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+def discover_meta_path():
+    return read_registry(META_REGISTRY_KEY, 'META_PATH') or os.path.abspath(os.path.join(BIN_CAD_DIR, '..', '..'))
+
+
+def read_msc_install_path(key_path):
+    """The Path of the Latest version of an MSC product, or None."""
+
+    latest_version = read_registry(key_path + r'\Latest', '')
+
+    if latest_version is None:
+        return None
+
+    return read_registry(key_path + '\\' + latest_version, 'Path')
+
+
+def discover_patran_path():
+
+    patran_path = read_msc_install_path(PATRAN_REGISTRY_KEY)
+
+    if patran_path is not None:
+        return patran_path
+
+    # <Patran install>/bin/patran
+    patran = find_executable('patran')
+    return os.path.dirname(os.path.dirname(os.path.realpath(patran))) if patran else None
+
+
+def discover_nastran_exe():
+
+    nastran_path = read_msc_install_path(NASTRAN_REGISTRY_KEY)
+
+    if nastran_path is not None:
+        nastran_exe = first_existing(os.path.join(nastran_path, 'bin', 'nastran.exe'),
+                                     os.path.join(nastran_path, 'bin', 'nastran'))
+        if nastran_exe is not None:
+            return nastran_exe
+
+    return find_executable('nastran')
+
+
+def discover_calculix_path():
+    return read_registry(CALCULIX_REGISTRY_KEY, 'InstallLocation')
+
+
+def discover_abaqus_exe():
+    return first_existing(ABAQUS_COMMAND) or find_executable('abaqus')
+
+
+def discover_patran_model_file(file_name):
+
+    def discover(meta_path):
+        return first_existing(os.path.join(meta_path, 'src', 'CADAssembler', 'Python', file_name),
+                              os.path.join(meta_path, 'bin', 'CAD', file_name))
+
+    return discover
+
+
+def discover_bin_cad_file(file_name):
+
+    def discover(meta_path):
+        return first_existing(os.path.join(meta_path, 'bin', 'CAD', file_name))
+
+    return discover
+
+
+def discover_material_library(meta_path):
+    return first_existing(os.path.join(meta_path, 'models', 'MaterialLibrary', 'material_library.json'),
+                          PUBLIC_MATERIAL_LIBRARY)
+
+
+# name: (environment variable that overrides it, discovery function, names of the paths it is found from)
+TOOLS = {
+    'MetaPath': ('MetaPath', discover_meta_path, []),
+    'PatranPath': ('PATRAN_PATH', discover_patran_path, []),
+    'NastranExe': ('NASTRAN_EXE', discover_nastran_exe, []),
+    'AbaqusExe': ('ABAQUS_EXE', discover_abaqus_exe, []),
+    'CalculixPath': ('CALCULIX_PATH', discover_calculix_path, []),
+    'CreatePatranModel.pcl': (None, discover_patran_model_file('CreatePatranModel.pcl'), ['MetaPath']),
+    'CreatePatranModel.ses': (None, discover_patran_model_file('CreatePatranModel.ses'), ['MetaPath']),
+    'Patran_PP.py': (None, discover_bin_cad_file('Patran_PP.py'), ['MetaPath']),
+    'Nastran.py': (None, discover_bin_cad_file('Nastran.py'), ['MetaPath']),
+    'MaterialLibrary': ('MATERIAL_LIBRARY', discover_material_library, ['MetaPath'])
+}
+
+
+# The registry value each registry-backed tool is found from; an install or upgrade changes it,
+# and so makes the cached path stale even though it still exists
+REGISTRY_VALUES = {
+    'MetaPath': (META_REGISTRY_KEY, 'META_PATH'),
+    'PatranPath': (PATRAN_REGISTRY_KEY + r'\Latest', ''),
+    'NastranExe': (NASTRAN_REGISTRY_KEY + r'\Latest', ''),
+    'CalculixPath': (CALCULIX_REGISTRY_KEY, 'InstallLocation')
+}
+
+
+def default_cache_path():
+    return os.environ.get(TOOL_PATHS_CACHE_ENV) or os.path.join(tempfile.gettempdir(), CACHE_FILE_NAME)
+
+
+class ToolPaths():
+    """Tool installs and resource files, each found once: from its environment variable, the
+    config file, the cache file, or else by looking in the registry and on PATH. What is found
+    by looking is cached, and a cached path is used only while it exists and the paths and
+    registry value (REGISTRY_VALUES) it was found from are unchanged."""
+
+    def __init__(self, cache_path=None, config_path=None):
+
+        self.logger = logging.getLogger('ToolPaths')
+        self.cache_path = cache_path or default_cache_path()
+        self.config_path = config_path or os.environ.get(TOOL_PATHS_CONFIG_ENV)
+
+        self.config = {}
+        if self.config_path:
+            with open(self.config_path, 'r') as f_in:
+                self.config = json.load(f_in)
+
+        self.cached = self.read_cache()
+        self.resolved = {}
+        self.sources = {}
+
+    def read_cache(self):
+
+        try:
+            with open(self.cache_path, 'r') as f_in:
+                cache = json.load(f_in)
+        except (IOError, ValueError):
+            return {}
+
+        if not isinstance(cache, dict) or cache.get('Version') != CACHE_VERSION:
+            return {}
+
+        return cache.get('Paths', {})
+
+    def write_cache(self):
+
+        temp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+
+        try:
+            with open(temp_path, 'w') as f_out:
+                json.dump({'Version': CACHE_VERSION, 'Paths': self.cached}, f_out, indent=4, sort_keys=True)
+
+            # Jobs starting together may all write it; each writes a complete file
+            if os.name == 'nt' and os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+            os.rename(temp_path, self.cache_path)
+
+        except (IOError, OSError) as e:
+            self.logger.warning("Could not write {}: {}".format(self.cache_path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, name):
+        """The path of name (a key of TOOLS). Raises ToolPathError if it cannot be found."""
+
+        if name in self.resolved:
+            return self.resolved[name]
+
+        env_name, discover, depends_on = TOOLS[name]
+
+        if env_name and os.environ.get(env_name):
+            path, source = os.environ[env_name], 'environment'
+        elif name in self.config:
+            path, source = self.config[name], 'config'
+        else:
+            depends = dict((dependency, self.get(dependency)) for dependency in depends_on)
+            if name in REGISTRY_VALUES:
+                depends['Registry'] = read_registry(*REGISTRY_VALUES[name])
+            entry = self.cached.get(name)
+
+            if entry is not None and entry.get('Depends') == depends and os.path.exists(entry.get('Path', '')):
+                path, source = entry['Path'], 'cache'
+            else:
+                path = discover(*[depends[dependency] for dependency in depends_on])
+
+                if path is None:
+                    raise ToolPathError("{} not found; set {}".format(
+                        name, 'the {} environment variable or '.format(env_name) if env_name else '') +
+                        "'{}' in the {} file".format(name, TOOL_PATHS_CONFIG_ENV))
+
+                source = 'discovered'
+                self.cached[name] = {'Path': path, 'Depends': depends}
+                self.write_cache()
+
+        self.logger.debug("{}: {} ({})".format(name, path, source))
+
+        self.resolved[name] = path
+        self.sources[name] = source
+
+        return path
+
+
+_tool_paths = None
+
+
+def tool_paths():
+    """The ToolPaths of this process."""
+
+    global _tool_paths
+
+    if _tool_paths is None:
+        _tool_paths = ToolPaths()
+
+    return _tool_paths
+
+
+def tool_path(name):
+    return tool_paths().get(name)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Show where the CAD tools and resource files are found")
+    parser.add_argument('-refresh', action='store_true', help="Look everything up again instead of using the cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+    if args.refresh and os.path.exists(default_cache_path()):
+        os.remove(default_cache_path())
+
+    paths = tool_paths()
+
+    for name in sorted(TOOLS):
+        try:
+            path = paths.get(name)
+            source = paths.sources[name]
+        except ToolPathError as e:
+            path, source = e, 'missing'
+
+        print("{:<24}{:<12}{}".format(name, source, path))
+
+    print("Cache: {}".format(paths.cache_path))
+
+
+if __name__ == '__main__':
+
+    main()